@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+'''reproducible ingest and fan-out benchmarks of the Laporte'''
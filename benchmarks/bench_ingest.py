@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+'''
+in-process benchmark of Sensors.set_node_values and CustomCollector.collect
+
+usage: python -m benchmarks.bench_ingest [--sizes 1000,10000] [--output run.json]
+'''
+
+import logging
+import os
+import tempfile
+from argparse import ArgumentParser, Namespace
+from multiprocessing import get_context
+from time import perf_counter
+from yaml import safe_dump
+from prometheus_client import CollectorRegistry, generate_latest
+from laporte.sensors import Sensors
+from laporte.prometheus import PrometheusMetrics
+from benchmarks.configs import VARIANTS, get_config, get_workload
+from benchmarks.common import (StubScheduler, StubSocketIO, get_latency_stats,
+                               get_rss_bytes, get_environment, write_results)
+
+
+def run_case(sensors_total, variant, updates, duration, scrapes, seed):
+    '''run one benchmark case, return a dict of results'''
+
+    logging.disable(logging.CRITICAL)
+    config, node_ids = get_config(sensors_total, variant)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        safe_dump(config, f)
+        config_file = f.name
+
+    sensors = Sensors()
+    sensors.sio = StubSocketIO()
+    sensors.scheduler = StubScheduler()
+    rss_start = get_rss_bytes()
+
+    try:
+        start_t = perf_counter()
+        sensors.load_config(
+            Namespace(config_file=config_file, config_jinja=False, config_dir='.'))
+        load_seconds = perf_counter() - start_t
+    finally:
+        os.unlink(config_file)
+
+    latencies = []
+    start_t = perf_counter()
+    deadline = start_t + duration
+    for node_id, values in get_workload(node_ids, variant, updates, seed=seed):
+        t = perf_counter()
+        sensors.set_node_values(node_id, values)
+        latencies.append(perf_counter() - t)
+        if t > deadline:
+            break
+    ingest_seconds = perf_counter() - start_t
+
+    registry = CollectorRegistry(auto_describe=False)
+    metrics = PrometheusMetrics(sensors)
+    registry.register(metrics.CustomCollector(metrics))
+    scrape_latencies = []
+    scrape_bytes = 0
+    for _ in range(scrapes):
+        t = perf_counter()
+        scrape_bytes = len(generate_latest(registry))
+        scrape_latencies.append(perf_counter() - t)
+
+    return {
+        'sensors': len(sensors.sensor_index),
+        'sensors_configured': sensors_total,
+        'variant': variant,
+        'load_seconds': load_seconds,
+        'updates': len(latencies),
+        'updates_per_second': len(latencies) / ingest_seconds if ingest_seconds else None,
+        'latency_seconds': get_latency_stats(latencies),
+        'emits_total': sensors.sio.emits_total,
+        'emitted_bytes': sensors.sio.emitted_bytes,
+        'scrape_seconds': get_latency_stats(scrape_latencies),
+        'scrape_bytes': scrape_bytes,
+        'rss_bytes': get_rss_bytes(),
+        'rss_growth_bytes': get_rss_bytes() - rss_start if rss_start else None,
+    }
+
+
+def get_pars():
+    parser = ArgumentParser(description='Laporte in-process ingest benchmark')
+    parser.add_argument('--sizes',
+                        default='1000,10000,100000',
+                        help='comma separated numbers of sensors (default %(default)s)')
+    parser.add_argument('--variants',
+                        default=','.join(VARIANTS),
+                        help='comma separated config variants (default %(default)s)')
+    parser.add_argument('--updates',
+                        type=int,
+                        default=2000,
+                        help='max number of updates per case (default %(default)s)')
+    parser.add_argument('--duration',
+                        type=float,
+                        default=10.0,
+                        help='max ingest time per case in seconds (default %(default)s)')
+    parser.add_argument('--scrapes',
+                        type=int,
+                        default=3,
+                        help='number of Prometheus scrapes per case (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='workload random seed')
+    parser.add_argument('--output', help='write JSON results to a file instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    pars = get_pars()
+    results = []
+
+    # each case in a fresh process to get comparable RSS
+    ctx = get_context('spawn')
+    for sensors_total in [int(x) for x in pars.sizes.split(',')]:
+        for variant in pars.variants.split(','):
+            with ctx.Pool(1) as pool:
+                results.append(
+                    pool.apply(run_case, (sensors_total, variant, pars.updates,
+                                          pars.duration, pars.scrapes, pars.seed)))
+
+    write_results({
+        'benchmark': 'ingest',
+        'environment': get_environment(),
+        'parameters': vars(pars),
+        'results': results
+    }, pars.output)
+
+
+if __name__ == '__main__':
+    main()
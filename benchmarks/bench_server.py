@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''
+end-to-end benchmark of a local Laporte server (run_server) using HTTP
+and Socket.IO load generators
+
+usage: python -m benchmarks.bench_server [--sizes 1000,10000] [--output run.json]
+'''
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from threading import Thread
+from time import perf_counter, sleep
+from urllib.request import Request, urlopen
+from urllib.parse import urlencode
+from urllib.error import URLError
+from yaml import safe_dump
+import socketio
+from benchmarks.configs import VARIANTS, get_config, get_workload
+from benchmarks.common import (get_latency_stats, get_rss_bytes, get_environment,
+                               write_results)
+
+
+def start_server(config_file, port):
+    '''start laporte in a subprocess, wait until it responds'''
+
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    proc = subprocess.Popen([
+        sys.executable, '-m', 'laporte', '-c', config_file, '-p',
+        str(port), '-l', 'ERROR'
+    ],
+                            env=env,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+
+    start_t = perf_counter()
+    while True:
+        try:
+            with urlopen('http://127.0.0.1:{}/api/info/version'.format(port)):
+                break
+        except (URLError, ConnectionError):
+            if proc.poll() is not None:
+                raise RuntimeError('laporte exited with code {}'.format(proc.returncode))
+            sleep(0.1)
+
+    return proc, perf_counter() - start_t
+
+
+def http_worker(url, workload, latencies, errors):
+    '''send PUT /api/metrics/<node_id> requests'''
+
+    for node_id, values in workload:
+        data = urlencode(values).encode()
+        req = Request('{}/api/metrics/{}'.format(url, node_id), data=data, method='PUT')
+        t = perf_counter()
+        try:
+            with urlopen(req) as resp:
+                resp.read()
+        except (URLError, ConnectionError):
+            errors.append(node_id)
+            continue
+        latencies.append(perf_counter() - t)
+
+
+def sio_worker(url, workload, latencies, errors):
+    '''send sensor_response messages, wait for acknowledgement of each'''
+
+    sio = socketio.Client()
+    sio.connect(url, namespaces=['/metrics'])
+    for node_id, values in workload:
+        t = perf_counter()
+        try:
+            sio.call('sensor_response', {node_id: values}, namespace='/metrics', timeout=30)
+        except socketio.exceptions.TimeoutError:
+            errors.append(node_id)
+            continue
+        latencies.append(perf_counter() - t)
+    sio.disconnect()
+
+
+def run_load(worker, url, workload, clients):
+    '''split workload between clients running in threads'''
+
+    latencies = []
+    errors = []
+    chunks = [workload[i::clients] for i in range(clients)]
+    threads = [
+        Thread(target=worker, args=(url, chunk, latencies, errors)) for chunk in chunks
+    ]
+
+    start_t = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = perf_counter() - start_t
+
+    return {
+        'updates': len(latencies),
+        'errors': len(errors),
+        'updates_per_second': len(latencies) / seconds if seconds else None,
+        'latency_seconds': get_latency_stats(latencies),
+    }
+
+
+def run_case(sensors_total, variant, pars):
+    '''run one benchmark case against a fresh server, return a dict of results'''
+
+    config, node_ids = get_config(sensors_total, variant)
+    url = 'http://127.0.0.1:{}'.format(pars.port)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        safe_dump(config, f)
+        config_file = f.name
+
+    proc = None
+    try:
+        proc, startup_seconds = start_server(config_file, pars.port)
+        workload = list(get_workload(node_ids, variant, pars.updates, seed=pars.seed))
+
+        result = {
+            'sensors_configured': sensors_total,
+            'variant': variant,
+            'startup_seconds': startup_seconds,
+            'http': run_load(http_worker, url, workload, pars.clients),
+            'socketio': run_load(sio_worker, url, workload, pars.clients),
+        }
+
+        scrape_latencies = []
+        for _ in range(pars.scrapes):
+            t = perf_counter()
+            with urlopen(url + '/metrics') as resp:
+                result['scrape_bytes'] = len(resp.read())
+            scrape_latencies.append(perf_counter() - t)
+        result['scrape_seconds'] = get_latency_stats(scrape_latencies)
+        result['rss_bytes'] = get_rss_bytes(proc.pid)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        os.unlink(config_file)
+
+    return result
+
+
+def get_pars():
+    parser = ArgumentParser(description='Laporte end-to-end server benchmark')
+    parser.add_argument('--sizes',
+                        default='1000,10000,100000',
+                        help='comma separated numbers of sensors (default %(default)s)')
+    parser.add_argument('--variants',
+                        default=','.join(VARIANTS),
+                        help='comma separated config variants (default %(default)s)')
+    parser.add_argument('--updates',
+                        type=int,
+                        default=500,
+                        help='number of updates per case and protocol '
+                        '(default %(default)s)')
+    parser.add_argument('--clients',
+                        type=int,
+                        default=4,
+                        help='number of concurrent clients (default %(default)s)')
+    parser.add_argument('--scrapes',
+                        type=int,
+                        default=3,
+                        help='number of Prometheus scrapes per case (default %(default)s)')
+    parser.add_argument('--port', type=int, default=19128, help='server port')
+    parser.add_argument('--seed', type=int, default=0, help='workload random seed')
+    parser.add_argument('--output', help='write JSON results to a file instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    pars = get_pars()
+    results = []
+
+    for sensors_total in [int(x) for x in pars.sizes.split(',')]:
+        for variant in pars.variants.split(','):
+            results.append(run_case(sensors_total, variant, pars))
+
+    write_results(
+        {
+            'benchmark': 'server',
+            'environment': get_environment(),
+            'parameters': vars(pars),
+            'results': results
+        }, pars.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''
+startup benchmark - import-time profile of laporte.server and time until
+a fresh server responds, optionally checked against a startup budget
+
+usage: python -m benchmarks.bench_startup [--budget 2.0] [--output startup.json]
+'''
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from statistics import median
+from yaml import safe_dump
+from benchmarks.configs import get_config
+from benchmarks.bench_server import start_server
+from benchmarks.common import get_environment, write_results
+
+IMPORT_CODE = "import sys; sys.argv = ['laporte']; import laporte.server"
+
+
+def get_import_profile(top):
+    '''
+    import laporte.server with -X importtime in a subprocess,
+    return total import seconds and top modules by self time
+    '''
+
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_CODE],
+                          env=env,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=True)
+
+    modules = []
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ' * 2):  # top level import
+            total += int(cumulative_us)
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+
+    modules.sort(reverse=True)
+    return {
+        'import_seconds': total / 1e6,
+        'modules_imported': len(modules),
+        'slowest_modules': [{
+            'module': name,
+            'self_seconds': self_us / 1e6,
+            'cumulative_seconds': cumulative_us / 1e6
+        } for self_us, cumulative_us, name in modules[:top]],
+    }
+
+
+def run_case(sensors_total, variant, pars):
+    '''start a server several times, return a dict of results'''
+
+    config, _ = get_config(sensors_total, variant)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False) as f:
+        safe_dump(config, f)
+        config_file = f.name
+
+    startups = []
+    try:
+        for _ in range(pars.runs):
+            proc, startup_seconds = start_server(config_file, pars.port)
+            proc.terminate()
+            proc.wait()
+            startups.append(startup_seconds)
+    finally:
+        os.unlink(config_file)
+
+    return {
+        'sensors_configured': sensors_total,
+        'variant': variant,
+        'startup_seconds': {
+            'p50': median(startups),
+            'min': min(startups),
+            'max': max(startups)
+        },
+    }
+
+
+def get_pars():
+    parser = ArgumentParser(description='Laporte startup benchmark')
+    parser.add_argument('--sizes',
+                        default='1000',
+                        help='comma separated numbers of sensors (default %(default)s)')
+    parser.add_argument('--variants',
+                        default='plain,eval',
+                        help='comma separated config variants (default %(default)s)')
+    parser.add_argument('--runs',
+                        type=int,
+                        default=5,
+                        help='number of server starts per case (default %(default)s)')
+    parser.add_argument('--top',
+                        type=int,
+                        default=15,
+                        help='number of slowest imported modules to report '
+                        '(default %(default)s)')
+    parser.add_argument('--budget',
+                        type=float,
+                        help='fail if the median startup of a case exceeds '
+                        'this number of seconds')
+    parser.add_argument('--port', type=int, default=19128, help='server port')
+    parser.add_argument('--output', help='write JSON results to a file instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    pars = get_pars()
+    results = []
+
+    for sensors_total in [int(x) for x in pars.sizes.split(',')]:
+        for variant in pars.variants.split(','):
+            results.append(run_case(sensors_total, variant, pars))
+
+    write_results(
+        {
+            'benchmark': 'startup',
+            'environment': get_environment(),
+            'parameters': vars(pars),
+            'import_profile': get_import_profile(pars.top),
+            'results': results
+        }, pars.output)
+
+    if pars.budget is not None:
+        over = [r for r in results if r['startup_seconds']['p50'] > pars.budget]
+        for result in over:
+            logging.error("startup of %s/%s: %.3f s exceeds budget %.3f s",
+                          result['sensors_configured'], result['variant'],
+                          result['startup_seconds']['p50'], pars.budget)
+        if over:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
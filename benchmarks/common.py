@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+'''helpers shared by the benchmarks'''
+
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+from laporte.version import __version__
+
+
+class StubJob():
+    '''scheduler job that is run only if requested'''
+    def __init__(self, func, trigger, args=None):
+        self.func = func
+        self.trigger = trigger
+        self.args = args or []
+        self.next_run_time = getattr(trigger, 'run_date', None) or datetime.now()
+
+    def run(self):
+        return self.func(*self.args)
+
+    def remove(self):
+        pass
+
+
+class StubScheduler():
+    '''scheduler that only remembers jobs'''
+    def __init__(self):
+        self.jobs = {}
+
+    # pylint: disable=redefined-builtin
+    def add_job(self, func, trigger, args=None, id=None, replace_existing=False):
+        del replace_existing  # Ignored parameter
+        job = StubJob(func, trigger, args)
+        self.jobs[id or len(self.jobs)] = job
+        return job
+
+
+class StubSocketIO():
+    '''Socket.IO server that only counts emits, background tasks are not run'''
+    def __init__(self):
+        self.emits_total = 0
+        self.emitted_bytes = 0
+
+    def start_background_task(self, target, *args, **kwargs):
+        del target, args, kwargs  # Ignored parameters
+
+    def sleep(self, seconds=0):
+        del seconds  # Ignored parameter
+
+    def emit(self, event, data=None, **_):
+        del event  # Ignored parameter
+        self.emits_total += 1
+        if isinstance(data, str):
+            self.emitted_bytes += len(data)
+
+
+def percentile(sorted_values, q):
+    '''return q-th percentile (0-100) of sorted values'''
+
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_latency_stats(latencies):
+    '''return latency summary (seconds) of a list of durations'''
+
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else None,
+    }
+
+
+def get_rss_bytes(pid='self'):
+    '''return current resident set size of a process'''
+
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_environment():
+    return {
+        'laporte': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.now().isoformat(),
+    }
+
+
+def write_results(results, output=None):
+    '''write results as JSON to a file or stdout'''
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
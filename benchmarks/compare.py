@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+'''
+compare two benchmark JSON results
+
+usage: python -m benchmarks.compare base.json new.json
+'''
+
+import json
+from argparse import ArgumentParser
+
+# (path in result, higher is better)
+KEYS = {
+    'ingest': [
+        (('updates_per_second', ), True),
+        (('latency_seconds', 'p50'), False),
+        (('latency_seconds', 'p99'), False),
+        (('scrape_seconds', 'p50'), False),
+        (('rss_bytes', ), False),
+    ],
+    'server': [
+        (('http', 'updates_per_second'), True),
+        (('http', 'latency_seconds', 'p99'), False),
+        (('socketio', 'updates_per_second'), True),
+        (('socketio', 'latency_seconds', 'p99'), False),
+        (('scrape_seconds', 'p50'), False),
+        (('rss_bytes', ), False),
+    ],
+    'startup': [
+        (('startup_seconds', 'p50'), False),
+    ],
+}
+
+
+def get_value(result, path):
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def compare(base, new):
+    '''yield (case, metric, base value, new value, change ratio, better or None)'''
+
+    base_results = {(r['sensors_configured'], r['variant']): r for r in base['results']}
+
+    for result in new['results']:
+        case = (result['sensors_configured'], result['variant'])
+        if case not in base_results:
+            continue
+        for path, higher_is_better in KEYS[new['benchmark']]:
+            base_value = get_value(base_results[case], path)
+            new_value = get_value(result, path)
+            if not base_value or new_value is None:
+                continue
+            ratio = new_value / base_value
+            if ratio == 1:
+                better = None
+            else:
+                better = ratio > 1 if higher_is_better else ratio < 1
+            yield case, '.'.join(path), base_value, new_value, ratio, better
+
+
+def main():
+    parser = ArgumentParser(description='compare two Laporte benchmark results')
+    parser.add_argument('base', help='JSON results of the base run')
+    parser.add_argument('new', help='JSON results of the new run')
+    pars = parser.parse_args()
+
+    with open(pars.base) as f:
+        base = json.load(f)
+    with open(pars.new) as f:
+        new = json.load(f)
+
+    for case, metric, base_value, new_value, ratio, better in compare(base, new):
+        print('{:>7} {:<9} {:<32} {:>14.6g} {:>14.6g} {:>7.2f}x {}'.format(
+            case[0], case[1], metric, base_value, new_value, ratio,
+            {None: 'same', True: 'better', False: 'worse'}[better]))
+
+
+if __name__ == '__main__':
+    main()
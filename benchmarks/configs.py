@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+'''generators of synthetic sensor configurations'''
+
+from random import Random
+
+GATEWAY = 'bench'
+SENSORS_PER_NODE = 10
+
+# available config variants
+VARIANTS = ('plain', 'template', 'eval', 'ttl', 'dataset')
+
+
+def get_node_id(i):
+    return 'node{}'.format(i)
+
+
+def get_input_sensor_ids(variant):
+    '''ids of sensors fed by the workload'''
+
+    if variant in ('eval', 'dataset'):
+        return ['in0', 'in1']
+    return ['s{}'.format(i) for i in range(SENSORS_PER_NODE)]
+
+
+def __get_node_config(variant):
+    '''config of one node with SENSORS_PER_NODE sensors'''
+
+    sensors = {}
+
+    if variant in ('plain', 'template', 'ttl'):
+        for i in range(SENSORS_PER_NODE):
+            sensors['s{}'.format(i)] = {'type': 'gauge'}
+        if variant == 'ttl':
+            for sensor in sensors.values():
+                sensor['ttl'] = 600
+        return {'sensors': sensors}
+
+    # 2 inputs and a chain of evals depending on them
+    for sensor_id in ('in0', 'in1'):
+        sensors[sensor_id] = {'type': 'gauge'}
+        if variant == 'dataset':
+            sensors[sensor_id]['debounce'] = {'dataset': True}
+
+    sensors['e0'] = {
+        'type': 'gauge',
+        'eval': {
+            'require': {
+                'a': ['in0', 'value'],
+                'b': ['in1', 'value']
+            },
+            'code': 'a + b'
+        }
+    }
+    for i in range(1, SENSORS_PER_NODE - 2):
+        sensors['e{}'.format(i)] = {
+            'type': 'gauge',
+            'eval': {
+                'require': {
+                    'x': ['e{}'.format(i - 1), 'value']
+                },
+                'code': 'x * 1.01 + 0.5'
+            }
+        }
+    return {'sensors': sensors}
+
+
+def get_config(sensors_total, variant='plain'):
+    '''
+    return a config dict with (about) sensors_total sensors
+    and a list of node_ids for the workload
+    '''
+
+    nodes_total = max(1, sensors_total // SENSORS_PER_NODE)
+    node_ids = [get_node_id(i) for i in range(nodes_total)]
+
+    if variant == 'template':
+        # nodes are spawned from the template upon the first hit
+        return {GATEWAY: {1: __get_node_config(variant)}}, node_ids
+
+    return {GATEWAY: {node_id: __get_node_config(variant) for node_id in node_ids}}, node_ids
+
+
+def get_workload(node_ids, variant, updates, seed=0):
+    '''generate (node_id, {sensor_id: value}) updates'''
+
+    rnd = Random(seed)
+    sensor_ids = get_input_sensor_ids(variant)
+
+    for _ in range(updates):
+        node_id = node_ids[rnd.randrange(len(node_ids))]
+        if variant in ('eval', 'dataset'):
+            values = {sensor_id: rnd.uniform(-20, 40) for sensor_id in sensor_ids}
+        else:
+            values = {rnd.choice(sensor_ids): rnd.uniform(-20, 40)}
+        yield node_id, values
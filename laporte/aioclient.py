@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+'''objects that create an asyncio Socket.OI client for Laporte'''
+
+import logging
+import json
+import asyncio
+from inspect import isawaitable
+from random import uniform
+import socketio
+from laporte.client import (METRICS_NAMESPACE, EVENTS_NAMESPACE, BATCHED_RESPONSES,
+                            EmitBuffer, c_responses_total, c_emits_total,
+                            c_connects_total, h_emit_batch_size)
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+async def call_handler(handler, *args):
+    '''call a sync or async handler, await its result if needed'''
+
+    ret = handler(*args)
+    if isawaitable(ret):
+        ret = await ret
+    return ret
+
+
+class AsyncMetricsNamespace(socketio.AsyncClientNamespace):
+    '''class-based asyncio Socket.IO event handlers for metrics'''
+
+    gateways = []
+
+    @staticmethod
+    async def default_actuator_handler(gateway, node_id, sensors):
+        '''default coroutine launched upon an actuator response node_id/sensor_id'''
+
+        del sensors  # Ignored parameter
+        logger.debug("empty default_actuator_handler for %s in %s", node_id, gateway)
+
+    @staticmethod
+    async def default_actuator_addr_handler(gateway, node_addr, keys):
+        '''default coroutine launched upon an actuator response node_addr/key'''
+
+        del keys  # Ignored parameter
+        logger.debug("empty default_actuator_addr_handler for %s in %s", node_addr,
+                     gateway)
+
+    @staticmethod
+    async def default_config_handler(data):
+        '''default coroutine launched upon an gateway config response'''
+
+        gateway = next(iter(data))
+        logger.debug("empty default_config_handler for %s", gateway)
+
+    actuator_handler = default_actuator_handler
+    actuator_addr_handler = default_actuator_addr_handler
+    config_handler = default_config_handler
+
+    async def on_actuator_response(self, data):
+        '''receive metrics of changed actuators identified by node_id/sensor_id'''
+
+        c_responses_total.labels('actuator_response', METRICS_NAMESPACE).inc()
+        for gateway, nodes in json.loads(data).items():
+            for node_id, sensors in nodes.items():
+                await call_handler(self.actuator_handler, gateway, node_id, sensors)
+
+    async def on_actuator_addr_response(self, data):
+        '''receive metrics of changed actuators identified by node_addr/key'''
+
+        c_responses_total.labels('actuator_addr_response', METRICS_NAMESPACE).inc()
+        for gateway, nodes in json.loads(data).items():
+            for node_addr, keys in nodes.items():
+                await call_handler(self.actuator_addr_handler, gateway, node_addr, keys)
+
+    async def on_config_response(self, data):
+        '''receive sensor configuration from laporte (after room join)'''
+
+        c_responses_total.labels('config_response', METRICS_NAMESPACE).inc()
+        await call_handler(self.config_handler, data)
+
+    @staticmethod
+    async def on_status_response(data):
+        '''receive and log status message from laporte'''
+
+        c_responses_total.labels('status_response', METRICS_NAMESPACE).inc()
+        logger.info("Laporte %s namespace status response: %s", METRICS_NAMESPACE, data)
+
+    async def __join_gateways(self):
+        '''join Socket.IO rooms called as same as gateways'''
+
+        for gw_name in self.gateways:
+            await self.emit("join", {'room': gw_name})
+
+    async def on_connect(self):
+        '''fired upon a successful connection'''
+
+        await self.__join_gateways()
+
+
+class AsyncEventsNamespace(socketio.AsyncClientNamespace):
+    '''class-based asyncio Socket.IO event handlers for events'''
+    @staticmethod
+    async def default_init_handler(nodes):
+        '''
+        Default coroutine launched upon an init response.
+
+        Args:
+            nodes (Dict[str: Dict[str: Dict[str: Any]]]):
+                dicts of node_ids with dict of sensor_ids with dicts of changed metrics
+        '''
+
+        logger.debug("empty default_init_handler for %d nodes", len(nodes))
+
+    @staticmethod
+    async def default_update_handler(node_id, sensors):
+        '''
+        Default coroutine launched upon an update response.
+
+        Args:
+            node_id (str):
+                a node with changed metrics
+            sensors (Dict[str: Dict[str: Any]]):
+                dict of sensor_ids with dicts of changed metrics
+        '''
+
+        logger.debug("empty default_update_handler for %s with %s chenged metrics",
+                     node_id, len(sensors))
+
+    init_handler = default_init_handler
+    update_handler = default_update_handler
+
+    async def on_init_response(self, data):
+        '''receive update of nodes from laporte'''
+
+        c_responses_total.labels('init_response', EVENTS_NAMESPACE).inc()
+        await call_handler(self.init_handler, json.loads(data))
+
+    async def on_update_response(self, data):
+        '''receive update of nodes from laporte'''
+
+        c_responses_total.labels('update_response', EVENTS_NAMESPACE).inc()
+        for node_id, metrics in json.loads(data).items():
+            await call_handler(self.update_handler, node_id, metrics)
+
+    @staticmethod
+    async def on_status_response(data):
+        '''receive and log status message from laporte'''
+
+        c_responses_total.labels('status_response', EVENTS_NAMESPACE).inc()
+        logger.info("Laporte %s namespace status response: %s", EVENTS_NAMESPACE, data)
+
+
+class AsyncDefaultNamespace(socketio.AsyncClientNamespace):
+    '''class-based asyncio Socket.IO event handlers for default responses'''
+    @staticmethod
+    async def on_connect():
+        '''fired upon a successful connection'''
+
+        logger.info("Laporte connected OK")
+        c_connects_total.labels('laporte').inc()
+
+    @staticmethod
+    async def on_disconnect(*_):
+        '''fired upon a disconnection'''
+
+        logger.info("Laporte disconnected")
+
+    @staticmethod
+    async def on_status_response(data):
+        '''receive and log status message from laporte'''
+
+        c_responses_total.labels('status_response', '/').inc()
+        logger.info("Laporte status response: %s", data)
+
+    @staticmethod
+    async def on_reload_response(data):
+        '''receive reload response from laporte'''
+
+        del data  # Ignored parameter
+        c_responses_total.labels('reload_response', '/').inc()
+        logger.info("Laporte was reloaded")
+
+
+class AsyncEmitBuffer(EmitBuffer):
+    '''
+    asyncio variant of the EmitBuffer.
+
+    Values are merged the same way, flush and backpressure are coroutines.
+    '''
+    def __init__(self, sio, max_size=100, max_delay=0.1, max_pending=10000):
+        super().__init__(sio,
+                         max_size=max_size,
+                         max_delay=max_delay,
+                         max_pending=max_pending)
+        self.cond = asyncio.Condition()
+
+    async def add(self, response, message):
+        '''add a {node:{key:value}} message, flush it if the buffer is full'''
+
+        async with self.cond:
+            while self.size >= self.max_pending and not self.sio.connected:
+                logger.debug("emit buffer full (%d values), waiting for connection",
+                             self.size)
+                try:
+                    await asyncio.wait_for(self.cond.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._merge(response, message)
+        if self.size >= self.max_size:
+            await self.flush()
+
+    async def flush(self):
+        '''emit all buffered values, return the number of emitted values'''
+
+        if not self.pending or not self.sio.connected:
+            return 0
+
+        pending = self.pending
+        size = self.size
+        self.pending = {}
+        self.size = 0
+        self.first_timestamp = None
+
+        failed = False
+        for response, message in pending.items():
+            if not failed:
+                try:
+                    await self.sio.emit(response, message, namespace=METRICS_NAMESPACE)
+                    self.c_emits[response].inc()
+                    continue
+                except socketio.exceptions.SocketIOError as exc:
+                    logger.warning("Laporte batch emit failed: %s", exc)
+                    failed = True
+            # keep newer values buffered in the meantime
+            self._merge(response, message, overwrite=False)
+
+        if failed:
+            return 0
+
+        h_emit_batch_size.observe(size)
+        async with self.cond:
+            self.cond.notify_all()
+
+        return size
+
+    async def loop(self):
+        '''background task flushing values on time limit'''
+
+        while True:
+            await asyncio.sleep(self.max_delay / 2)
+            if self.is_due():
+                await self.flush()
+
+
+class AsyncLaporteClient():
+    '''Object containing asyncio Socket.IO client with registered namespaces.'''
+    def __init__(self,
+                 addr,
+                 port,
+                 gateways=None,
+                 events=False,
+                 batch_size=None,
+                 batch_delay=0.1,
+                 batch_max_pending=10000,
+                 reconnect_delay=1,
+                 reconnect_delay_max=60):
+        '''
+        Prepare a client of the laporte server, connect it with connect().
+
+            addr (str):
+                Hostname or IP of laporte server.
+            port (int):
+                 Port of laporte server.
+            gateways (Optional[List[str]]):
+                List of gateways to be joined in.
+                Defaults to None. Register metrics namespece if set.
+            events (Optional[bool]):
+                Register events namespace. Defaults to False.
+            batch_size (Optional[int]):
+                Buffer sensor_response and sensor_addr_response emits and send
+                them in batches of this size. Defaults to None (no buffering).
+            batch_delay (Optional[float]):
+                Max time in seconds a buffered value waits for emit.
+                Defaults to 0.1.
+            batch_max_pending (Optional[int]):
+                Max number of buffered values while disconnected, emit waits
+                above this limit. Defaults to 10000.
+            reconnect_delay (Optional[float]):
+                Initial delay in seconds between connection attempts, doubled
+                after each failure and randomized by +-50 %. Defaults to 1.
+            reconnect_delay_max (Optional[float]):
+                Max delay in seconds between connection attempts. Defaults to 60.
+        '''
+
+        self.url = 'http://{}:{}'.format(addr, port)
+        self.namespaces = []
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_delay_max = reconnect_delay_max
+        self.sio = socketio.AsyncClient(reconnection_delay=reconnect_delay,
+                                        reconnection_delay_max=reconnect_delay_max,
+                                        randomization_factor=0.5)
+        self.ns_default = AsyncDefaultNamespace('/')
+        self.ns_metrics = AsyncMetricsNamespace(METRICS_NAMESPACE)
+        self.ns_events = AsyncEventsNamespace(EVENTS_NAMESPACE)
+        self.sio.register_namespace(self.ns_default)
+
+        if isinstance(gateways, list):
+            self.namespaces.append(METRICS_NAMESPACE)
+            self.ns_metrics.gateways = gateways
+            self.sio.register_namespace(self.ns_metrics)
+
+        if events:
+            self.namespaces.append(EVENTS_NAMESPACE)
+            self.sio.register_namespace(self.ns_events)
+
+        self.buffer = None
+        if batch_size:
+            self.buffer = AsyncEmitBuffer(self.sio,
+                                          max_size=batch_size,
+                                          max_delay=batch_delay,
+                                          max_pending=batch_max_pending)
+        self.buffer_task = None
+
+    async def connect(self):
+        '''connect to the Laporte, retry with jittered exponential backoff'''
+
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self.sio.connect(self.url, namespaces=self.namespaces)
+            except socketio.exceptions.ConnectionError as exc:
+                wait = uniform(delay / 2, delay * 1.5)
+                logger.error("%s: %s, retry in %.1fs", self.url, exc, wait)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.reconnect_delay_max)
+            else:
+                break
+
+        if self.buffer is not None and self.buffer_task is None:
+            self.buffer_task = asyncio.ensure_future(self.buffer.loop())
+
+    async def loop(self):
+        '''main loop for asyncio Socket.IO client'''
+
+        await self.sio.wait()
+
+    async def run(self):
+        '''connect to the Laporte and wait until disconnected'''
+
+        await self.connect()
+        await self.loop()
+
+    async def disconnect(self):
+        '''flush buffered values and disconnect from the Laporte'''
+
+        await self.flush()
+        if self.buffer_task is not None:
+            self.buffer_task.cancel()
+            self.buffer_task = None
+        await self.sio.disconnect()
+
+    async def emit(self, response, message, namespace=METRICS_NAMESPACE):
+        '''emit custom response to the Laporte'''
+
+        if (self.buffer is not None and namespace == METRICS_NAMESPACE
+                and response in BATCHED_RESPONSES):
+            await self.buffer.add(response, message)
+            return
+
+        logger.info("Laporte emit: %s %s", response, message)
+        c_emits_total.labels(response, namespace).inc()
+        await self.sio.emit(response, message, namespace=namespace)
+
+    async def flush(self):
+        '''emit all buffered values now'''
+
+        if self.buffer is not None:
+            await self.buffer.flush()
+
+
+async def connect_all(clients):
+    '''connect several AsyncLaporteClient objects concurrently'''
+
+    await asyncio.gather(*[client.connect() for client in clients])
+
+
+async def run_all(clients):
+    '''connect several AsyncLaporteClient objects and wait until all disconnect'''
+
+    await asyncio.gather(*[client.run() for client in clients])
@@ -3,8 +3,9 @@
 
 import logging
 import os
-from argparse import ArgumentParser, ArgumentTypeError
+from argparse import ArgumentParser, ArgumentTypeError, Action, SUPPRESS
 from laporte.version import __version__, get_build_info
+from laporte.logs import LOG_FORMATS
 
 _LOG_LEVEL_STRINGS = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG']
 
@@ -25,6 +26,46 @@ def log_level_string_to_int(arg_string):
     return log_level_int
 
 
+def log_levels_string_to_dict(arg_string):
+    '''get {logger name: log level int} from "name=LEVEL,name=LEVEL" string'''
+
+    ret = {}
+    for item in arg_string.split(','):
+        if not item.strip():
+            continue
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            message = 'invalid logger level: {0} (use name=LEVEL)'.format(item)
+            raise ArgumentTypeError(message)
+        ret[name.strip()] = log_level_string_to_int(level.strip())
+
+    return ret
+
+
+def urls_string_to_list(arg_string):
+    '''get list of URLs from "url,url" string'''
+
+    return [url.strip() for url in arg_string.split(',') if url.strip()]
+
+
+class BuildInfoAction(Action):
+    '''print build info and exit, build info is resolved only if requested'''
+    # pylint: disable=redefined-builtin
+    def __init__(self,
+                 option_strings,
+                 dest=SUPPRESS,
+                 default=SUPPRESS,
+                 help=None):
+        super().__init__(option_strings=option_strings,
+                         dest=dest,
+                         default=default,
+                         nargs=0,
+                         help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message='{}\n'.format(get_build_info()))
+
+
 def get_pars():
     '''get parameters from from command line arguments'''
 
@@ -35,6 +76,51 @@ def get_pars():
         'LISTEN_PORT': {
             'default': 9128
         },
+        'BACKLOG': {
+            'default': 1024
+        },
+        'REUSE_PORT': {
+            'default': False
+        },
+        'POOL_SIZE': {
+            'default': 0
+        },
+        'NO_KEEP_ALIVE': {
+            'default': False
+        },
+        'PING_INTERVAL': {
+            'default': 25
+        },
+        'PING_TIMEOUT': {
+            'default': 20
+        },
+        'MAX_BUFFER_SIZE': {
+            'default': 1000000
+        },
+        'INGEST_QUEUE_SIZE': {
+            'default': 0
+        },
+        'MESSAGE_QUEUE': {
+            'default': ''
+        },
+        'MESSAGE_QUEUE_CHANNEL': {
+            'default': 'laporte'
+        },
+        'FRONT_END': {
+            'default': False
+        },
+        'SHM_PATH': {
+            'default': ''
+        },
+        'CLUSTER_PEERS': {
+            'default': ''
+        },
+        'CLUSTER_NODE_ID': {
+            'default': ''
+        },
+        'CLUSTER_LOG_SIZE': {
+            'default': 10000
+        },
         'CONFIG_FILE': {
             'default': 'conf/sensors.yml'
         },
@@ -48,7 +134,25 @@ def get_pars():
             'default': 'en-US'
         },
         'LOG_LEVEL': {
-            'default': 'DEBUG'
+            'default': 'INFO'
+        },
+        'LOG_LEVELS': {
+            'default': ''
+        },
+        'LOG_FORMAT': {
+            'default': 'text'
+        },
+        'LOG_RATE': {
+            'default': 0
+        },
+        'LOG_SAMPLE': {
+            'default': 1
+        },
+        'STAGE_METRICS': {
+            'default': False
+        },
+        'EVAL_METRICS': {
+            'default': False
         },
     }
 
@@ -79,6 +183,116 @@ def get_pars():
                             env_vars['LISTEN_PORT']['default']),
                         type=int,
                         **env_vars['LISTEN_PORT'])
+    parser.add_argument('--backlog',
+                        action='store',
+                        dest='backlog',
+                        help='listen backlog of pending connections '
+                        '(default {0})'.format(env_vars['BACKLOG']['default']),
+                        type=int,
+                        **env_vars['BACKLOG'])
+    parser.add_argument('--reuse-port',
+                        action='store_true',
+                        dest='reuse_port',
+                        help='listen with SO_REUSEPORT, more processes can share '
+                        'the port (e.g. during a rolling restart)',
+                        **env_vars['REUSE_PORT'])
+    parser.add_argument('--pool-size',
+                        action='store',
+                        dest='pool_size',
+                        help='max number of concurrent connections (greenlets), '
+                        '0 is unlimited (default {0})'.format(
+                            env_vars['POOL_SIZE']['default']),
+                        type=int,
+                        **env_vars['POOL_SIZE'])
+    parser.add_argument('--no-keep-alive',
+                        action='store_true',
+                        dest='no_keep_alive',
+                        help='close HTTP connections after each request',
+                        **env_vars['NO_KEEP_ALIVE'])
+    parser.add_argument('--ping-interval',
+                        action='store',
+                        dest='ping_interval',
+                        help='Socket.IO ping interval in seconds (default {0})'.format(
+                            env_vars['PING_INTERVAL']['default']),
+                        type=int,
+                        **env_vars['PING_INTERVAL'])
+    parser.add_argument('--ping-timeout',
+                        action='store',
+                        dest='ping_timeout',
+                        help='Socket.IO ping timeout in seconds (default {0})'.format(
+                            env_vars['PING_TIMEOUT']['default']),
+                        type=int,
+                        **env_vars['PING_TIMEOUT'])
+    parser.add_argument('--max-buffer-size',
+                        action='store',
+                        dest='max_buffer_size',
+                        help='max size of a Socket.IO message in bytes '
+                        '(default {0})'.format(env_vars['MAX_BUFFER_SIZE']['default']),
+                        type=int,
+                        **env_vars['MAX_BUFFER_SIZE'])
+    parser.add_argument('--ingest-queue-size',
+                        action='store',
+                        dest='ingest_queue_size',
+                        help='queue received values and set them in batches, '
+                        'max number of values waiting to be set (per priority), '
+                        'requests above it are rejected, 0 sets values directly '
+                        'without queues (default {0})'.format(
+                            env_vars['INGEST_QUEUE_SIZE']['default']),
+                        type=int,
+                        **env_vars['INGEST_QUEUE_SIZE'])
+    parser.add_argument('--message-queue',
+                        action='store',
+                        dest='message_queue',
+                        help='publish Socket.IO emits to a bus shared with front '
+                        'ends delivering them to their clients: memory:// '
+                        '(in-process) or redis://host:port (Redis or laporte-bus) '
+                        '(default no bus)',
+                        type=str,
+                        **env_vars['MESSAGE_QUEUE'])
+    parser.add_argument('--message-queue-channel',
+                        action='store',
+                        dest='message_queue_channel',
+                        help='bus channel of the processes (default {0})'.format(
+                            env_vars['MESSAGE_QUEUE_CHANNEL']['default']),
+                        type=str,
+                        **env_vars['MESSAGE_QUEUE_CHANNEL'])
+    parser.add_argument('--front-end',
+                        action='store_true',
+                        dest='front_end',
+                        help='serve Socket.IO clients only, without sensors: forward '
+                        'their messages through the bus (--message-queue) to the '
+                        'process with sensors',
+                        **env_vars['FRONT_END'])
+    parser.add_argument('--shm-path',
+                        action='store',
+                        dest='shm_path',
+                        help='export numeric sensor state to a memory-mapped file '
+                        '(e.g. /dev/shm/laporte) with an index in <path>.index.json '
+                        'for local readers (default no export)',
+                        type=str,
+                        **env_vars['SHM_PATH'])
+    parser.add_argument('--cluster-peers',
+                        action='store',
+                        dest='cluster_peers',
+                        help='comma separated URLs of other cluster nodes '
+                        '(e.g. http://node2:9128), values are replicated to them '
+                        '(default no cluster)',
+                        type=urls_string_to_list,
+                        **env_vars['CLUSTER_PEERS'])
+    parser.add_argument('--cluster-node-id',
+                        action='store',
+                        dest='cluster_node_id',
+                        help='unique name of this cluster node (default hostname:port)',
+                        type=str,
+                        **env_vars['CLUSTER_NODE_ID'])
+    parser.add_argument('--cluster-log-size',
+                        action='store',
+                        dest='cluster_log_size',
+                        help='number of replication log entries kept for peers '
+                        'catching up (default {0})'.format(
+                            env_vars['CLUSTER_LOG_SIZE']['default']),
+                        type=int,
+                        **env_vars['CLUSTER_LOG_SIZE'])
     parser.add_argument('-c',
                         '--config-file',
                         action='store',
@@ -110,10 +324,21 @@ def get_pars():
                             env_vars['TIME_LOCALE']['default']),
                         type=str,
                         **env_vars['TIME_LOCALE'])
+    parser.add_argument('--stage-metrics',
+                        action='store_true',
+                        dest='stage_metrics',
+                        help='measure durations of ingest stages '
+                        '(parse, set, eval, propagate, diff, ttl, emit)',
+                        **env_vars['STAGE_METRICS'])
+    parser.add_argument('--eval-metrics',
+                        action='store_true',
+                        dest='eval_metrics',
+                        help='export eval profile of sensors as Prometheus metrics',
+                        **env_vars['EVAL_METRICS'])
     parser.add_argument('-V',
                         '--version',
-                        action='version',
-                        version=str(get_build_info()))
+                        action=BuildInfoAction,
+                        help="show program's version number and exit")
     parser.add_argument('-l',
                         '--log-level',
                         action='store',
@@ -123,4 +348,33 @@ def get_pars():
                                                    env_vars['LOG_LEVEL']['default']),
                         type=log_level_string_to_int,
                         **env_vars['LOG_LEVEL'])
+    parser.add_argument('--log-levels',
+                        action='store',
+                        dest='log_levels',
+                        help='set logging levels of subsystems, '
+                        'e.g. laporte.sensors=DEBUG,engineio=ERROR',
+                        type=log_levels_string_to_dict,
+                        **env_vars['LOG_LEVELS'])
+    parser.add_argument('--log-format',
+                        action='store',
+                        dest='log_format',
+                        help='logging output format {0} (default {1})'.format(
+                            list(LOG_FORMATS), env_vars['LOG_FORMAT']['default']),
+                        choices=LOG_FORMATS,
+                        **env_vars['LOG_FORMAT'])
+    parser.add_argument('--log-rate',
+                        action='store',
+                        dest='log_rate',
+                        help='max log messages per second of one log statement, '
+                        '0 is unlimited (default {0})'.format(
+                            env_vars['LOG_RATE']['default']),
+                        type=float,
+                        **env_vars['LOG_RATE'])
+    parser.add_argument('--log-sample',
+                        action='store',
+                        dest='log_sample',
+                        help='log every n-th DEBUG/INFO message of one log statement '
+                        '(default {0})'.format(env_vars['LOG_SAMPLE']['default']),
+                        type=int,
+                        **env_vars['LOG_SAMPLE'])
     return parser.parse_args()
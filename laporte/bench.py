@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+'''
+load generator and soak test for a Laporte instance
+
+Simulates gateways with nodes sending sensor values and subscribers of
+the events namespace, measures end-to-end latency from ingest to
+update_response receipt and actuator round-trip time.
+'''
+
+import logging
+import json
+import sys
+from argparse import ArgumentParser
+from random import Random
+from threading import Thread, Event, Lock
+from time import time, sleep, monotonic
+from urllib.request import Request, urlopen
+from urllib.parse import urlencode
+from urllib.error import URLError
+from yaml import safe_dump
+from laporte.client import LaporteClient
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+VALUE_SENSOR = 'bench_value'
+VALUE_KEY = 'v'
+ACTUATOR = 'bench_cmd'
+
+
+def get_gateway_name(gw):
+    return 'bench{}'.format(gw)
+
+
+def get_node_id(gw, node):
+    return 'bench{}_n{}'.format(gw, node)
+
+
+def get_config(gateways, nodes):
+    '''
+    config for the benchmarked Laporte instance: each node has a value sensor
+    (its value is a send timestamp) and an actuator copying the value
+    '''
+
+    config = {}
+    for gw in range(gateways):
+        gw_config = {}
+        for node in range(nodes):
+            node_id = get_node_id(gw, node)
+            gw_config[node_id] = {
+                'addr': node_id,
+                'sensors': {
+                    VALUE_SENSOR: {
+                        'type': 'gauge',
+                        'key': VALUE_KEY
+                    }
+                },
+                'actuators': {
+                    ACTUATOR: {
+                        'type': 'gauge',
+                        'key': ACTUATOR,
+                        'eval': {
+                            'require': {
+                                'x': [VALUE_SENSOR, 'value']
+                            },
+                            'code': 'x'
+                        }
+                    }
+                }
+            }
+        config[get_gateway_name(gw)] = gw_config
+    return config
+
+
+class LatencyRecorder():
+    '''thread-safe store of latencies'''
+    def __init__(self):
+        self.lock = Lock()
+        self.values = []
+
+    def add(self, value):
+        with self.lock:
+            self.values.append(value)
+
+    def get_stats(self):
+        with self.lock:
+            values = sorted(self.values)
+
+        def percentile(q):
+            return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+        if not values:
+            return {'count': 0}
+        return {
+            'count': len(values),
+            'avg': sum(values) / len(values),
+            'p50': percentile(50),
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': values[-1]
+        }
+
+
+class Bench():
+    '''simulated gateways and event subscribers'''
+    def __init__(self, pars):
+        self.pars = pars
+        self.url = 'http://{}:{}'.format(pars.addr, pars.port)
+        self.stop = Event()
+        self.start_time = time()
+        self.lock = Lock()  # counters are updated by gateway threads
+        self.sent = 0
+        self.errors = 0
+        self.e2e = LatencyRecorder()
+        self.rtt = LatencyRecorder()
+        self.gateways = []
+        self.subscribers = []
+
+    def __on_update(self, node_id, sensors):
+        del node_id  # Ignored parameter
+        now = time()
+        value = sensors.get(VALUE_SENSOR, {}).get('value')
+        if isinstance(value, float) and value >= self.start_time:
+            self.e2e.add(now - value)
+
+    def __on_actuator(self, gateway, node, keys):
+        del gateway, node  # Ignored parameters
+        now = time()
+        for key in (ACTUATOR, ):
+            # actuator state sent on join carries timestamps of previous runs
+            if isinstance(keys.get(key), float) and keys[key] >= self.start_time:
+                self.rtt.add(now - keys[key])
+
+    def connect(self):
+        '''connect simulated gateways and subscribers'''
+
+        for gw in range(self.pars.gateways):
+            client = LaporteClient(self.pars.addr,
+                                   self.pars.port,
+                                   gateways=[get_gateway_name(gw)],
+                                   batch_size=self.pars.batch_size)
+            client.ns_metrics.actuator_handler = self.__on_actuator
+            self.gateways.append(client)
+
+        for _ in range(self.pars.subscribers):
+            client = LaporteClient(self.pars.addr, self.pars.port, events=True)
+            client.ns_events.update_handler = self.__on_update
+            self.subscribers.append(client)
+
+    def __pick_node(self, rnd):
+        '''pick a node index using the configured distribution'''
+
+        if self.pars.distribution == 'zipf':
+            return min(self.pars.nodes - 1, int(rnd.paretovariate(1.2)) - 1)
+        return rnd.randrange(self.pars.nodes)
+
+    def __get_intervals(self, rnd):
+        '''yield delays between messages of one gateway'''
+
+        interval = 1 / self.pars.rate
+        while True:
+            if self.pars.arrival == 'poisson':
+                yield rnd.expovariate(self.pars.rate)
+            elif self.pars.arrival == 'burst':
+                for _ in range(self.pars.burst - 1):
+                    yield 0
+                yield interval * self.pars.burst
+            else:
+                yield interval
+
+    def __send(self, gw, client, node, protocol):
+        node_id = get_node_id(gw, node)
+        value = time()
+
+        if protocol == 'http':
+            req = Request('{}/api/metrics/{}'.format(self.url, node_id),
+                          data=urlencode({VALUE_SENSOR: value}).encode(),
+                          method='PUT')
+            with urlopen(req) as resp:
+                resp.read()
+        elif protocol == 'addr':
+            client.emit('sensor_addr_response', {node_id: {VALUE_KEY: value}})
+        else:
+            client.emit('sensor_response', {node_id: {VALUE_SENSOR: value}})
+
+    def gateway_loop(self, gw):
+        '''send messages of one simulated gateway'''
+
+        rnd = Random(self.pars.seed + gw)
+        client = self.gateways[gw]
+        protocols = self.pars.protocol.split(',')
+        next_t = monotonic()
+
+        for interval in self.__get_intervals(rnd):
+            if self.stop.is_set():
+                break
+            try:
+                self.__send(gw, client, self.__pick_node(rnd), rnd.choice(protocols))
+                with self.lock:
+                    self.sent += 1
+            except (URLError, ConnectionError, OSError) as exc:
+                logger.warning("send error: %s", exc)
+                with self.lock:
+                    self.errors += 1
+
+            next_t += interval
+            delay = next_t - monotonic()
+            if delay > 0:
+                sleep(delay)
+
+    def get_report(self, seconds):
+        with self.lock:
+            sent, errors = self.sent, self.errors
+        return {
+            'seconds': seconds,
+            'sent': sent,
+            'sent_per_second': sent / seconds if seconds else None,
+            'errors': errors,
+            'e2e_latency_seconds': self.e2e.get_stats(),
+            'actuator_rtt_seconds': self.rtt.get_stats(),
+        }
+
+    def run(self):
+        '''run the load for the configured duration, return a report'''
+
+        self.start_time = time()
+        self.connect()
+        threads = [
+            Thread(target=self.gateway_loop, args=(gw, ), daemon=True)
+            for gw in range(self.pars.gateways)
+        ]
+
+        start_t = monotonic()
+        for thread in threads:
+            thread.start()
+
+        while monotonic() - start_t < self.pars.duration:
+            sleep(min(self.pars.report_interval,
+                      max(0, self.pars.duration - (monotonic() - start_t))))
+            logger.warning("%s", json.dumps(self.get_report(monotonic() - start_t)))
+
+        self.stop.set()
+        for thread in threads:
+            thread.join()
+        for client in self.gateways:
+            client.flush()
+
+        # wait for in-flight responses
+        sleep(self.pars.drain)
+        report = self.get_report(monotonic() - start_t - self.pars.drain)
+
+        for client in self.gateways + self.subscribers:
+            client.sio.disconnect()
+
+        return report
+
+
+def get_pars():
+    '''get parameters from from command line arguments'''
+
+    parser = ArgumentParser(description='Laporte load generator and soak test')
+    parser.add_argument('-a', '--addr', default='localhost', help='Laporte address')
+    parser.add_argument('-p', '--port', type=int, default=9128, help='Laporte port')
+    parser.add_argument('-g',
+                        '--gateways',
+                        type=int,
+                        default=4,
+                        help='number of simulated gateways (default %(default)s)')
+    parser.add_argument('-n',
+                        '--nodes',
+                        type=int,
+                        default=25,
+                        help='number of nodes per gateway (default %(default)s)')
+    parser.add_argument('-s',
+                        '--subscribers',
+                        type=int,
+                        default=1,
+                        help='number of /events subscribers (default %(default)s)')
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        default=10,
+                        help='messages per second per gateway (default %(default)s)')
+    parser.add_argument('--arrival',
+                        choices=['constant', 'poisson', 'burst'],
+                        default='constant',
+                        help='distribution of message arrivals (default %(default)s)')
+    parser.add_argument('--burst',
+                        type=int,
+                        default=10,
+                        help='messages in a burst (default %(default)s)')
+    parser.add_argument('--distribution',
+                        choices=['uniform', 'zipf'],
+                        default='uniform',
+                        help='distribution of nodes hit (default %(default)s)')
+    parser.add_argument('--protocol',
+                        default='socketio',
+                        help='comma separated protocols to mix: socketio, addr, http '
+                        '(default %(default)s)')
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=None,
+                        help='use buffered LaporteClient emits with this batch size')
+    parser.add_argument('-d',
+                        '--duration',
+                        type=float,
+                        default=60,
+                        help='duration of the test in seconds (default %(default)s)')
+    parser.add_argument('--report-interval',
+                        type=float,
+                        default=10,
+                        help='interval of interim reports in seconds (default %(default)s)')
+    parser.add_argument('--drain',
+                        type=float,
+                        default=2,
+                        help='seconds to wait for in-flight responses (default %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--write-config',
+                        metavar='FILE',
+                        help='write a Laporte config for the simulated gateways and exit')
+    parser.add_argument('-o', '--output', help='write JSON report to a file')
+    return parser.parse_args()
+
+
+def run_bench():
+    '''entry point of laporte-bench'''
+
+    logging.basicConfig(format='%(levelname)s %(module)s: %(message)s',
+                        level=logging.WARNING)
+    for name in ('socketio.client', 'engineio.client'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    pars = get_pars()
+
+    if pars.write_config:
+        with open(pars.write_config, 'w') as f:
+            safe_dump(get_config(pars.gateways, pars.nodes), f)
+        return
+
+    report = Bench(pars).run()
+    report['parameters'] = vars(pars)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if pars.output:
+        with open(pars.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    run_bench()
@@ -3,15 +3,17 @@
 
 import logging
 import json
-from time import sleep
+from threading import Condition
+from time import sleep, monotonic
 import socketio
-from prometheus_client import Counter
+from prometheus_client import Counter, Histogram
 
 METRICS_NAMESPACE = '/metrics'
 EVENTS_NAMESPACE = '/events'
 
 # create logger
-logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 c_responses_total = Counter('laporte_responses_total',
                             'Total count of Socket.IO responses',
@@ -20,6 +22,11 @@ c_emits_total = Counter('laporte_emits_total', 'Total count of Socket.IO emits',
                         ['response', 'namespace'])
 c_connects_total = Counter('laporte_connects_total',
                            'Total count of connects/reconnects', ['service'])
+h_emit_batch_size = Histogram('laporte_emit_batch_size',
+                              'Number of sensor values emitted in one batch',
+                              buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+
+BATCHED_RESPONSES = ('sensor_response', 'sensor_addr_response')
 
 
 class MetricsNamespace(socketio.ClientNamespace):
@@ -32,22 +39,22 @@ class MetricsNamespace(socketio.ClientNamespace):
         '''default function launched upon an actuator response node_id/sensor_id'''
 
         del sensors  # Ignored parameter
-        logging.debug("empty default_actuator_handler for %s in %s", node_id, gateway)
+        logger.debug("empty default_actuator_handler for %s in %s", node_id, gateway)
 
     @staticmethod
     def default_actuator_addr_handler(gateway, node_addr, keys):
         '''default function launched upon an actuator response node_addr/key'''
 
         del keys  # Ignored parameter
-        logging.debug("empty default_actuator_addr_handler for %s in %s", node_addr,
-                      gateway)
+        logger.debug("empty default_actuator_addr_handler for %s in %s", node_addr,
+                     gateway)
 
     @staticmethod
     def default_config_handler(data):
         '''default function launched upon an gateway config response'''
 
         gateway = next(iter(data))
-        logging.debug("empty default_config_handler for %s", gateway)
+        logger.debug("empty default_config_handler for %s", gateway)
 
     actuator_handler = default_actuator_handler
     actuator_addr_handler = default_actuator_addr_handler
@@ -80,7 +87,7 @@ class MetricsNamespace(socketio.ClientNamespace):
         '''receive and log status message from laporte'''
 
         c_responses_total.labels('status_response', METRICS_NAMESPACE).inc()
-        logging.info("Laporte %s namespace status response: %s", METRICS_NAMESPACE, data)
+        logger.info("Laporte %s namespace status response: %s", METRICS_NAMESPACE, data)
 
     def __join_gateways(self):
         '''join Socket.IO rooms called as same as gateways'''
@@ -111,7 +118,7 @@ class EventsNamespace(socketio.ClientNamespace):
                 dicts of node_ids with dict of sensor_ids with dicts of changed metrics
         '''
 
-        logging.debug("empty default_init_handler for %d nodes", len(nodes))
+        logger.debug("empty default_init_handler for %d nodes", len(nodes))
 
     @staticmethod
     def default_update_handler(node_id, sensors):
@@ -125,8 +132,8 @@ class EventsNamespace(socketio.ClientNamespace):
                 dict of sensor_ids with dicts of changed metrics
         '''
 
-        logging.debug("empty default_update_handler for %s with %s chenged metrics",
-                      node_id, len(sensors))
+        logger.debug("empty default_update_handler for %s with %s chenged metrics",
+                     node_id, len(sensors))
 
     init_handler = default_init_handler
     update_handler = default_update_handler
@@ -149,7 +156,7 @@ class EventsNamespace(socketio.ClientNamespace):
         '''receive and log status message from laporte'''
 
         c_responses_total.labels('status_response', EVENTS_NAMESPACE).inc()
-        logging.info("Laporte %s namespace status response: %s", METRICS_NAMESPACE, data)
+        logger.info("Laporte %s namespace status response: %s", METRICS_NAMESPACE, data)
 
 
 class DefaultNamespace(socketio.ClientNamespace):
@@ -158,34 +165,34 @@ class DefaultNamespace(socketio.ClientNamespace):
     def on_connect():
         '''fired upon a successful connection'''
 
-        logging.info("Laporte connected OK")
+        logger.info("Laporte connected OK")
         c_connects_total.labels('laporte').inc()
 
     @staticmethod
     def on_reconnect():
         '''fired upon a successful reconnection'''
 
-        logging.info("Laporte reconnected OK")
+        logger.info("Laporte reconnected OK")
         c_connects_total.labels('laporte').inc()
 
     @staticmethod
     def on_disconnect():
         '''fired upon a disconnection'''
 
-        logging.info("Laporte disconnected")
+        logger.info("Laporte disconnected")
 
     @staticmethod
     def on_error():
         '''fired upon a connection error'''
 
-        logging.error("Socket.IO connection error")
+        logger.error("Socket.IO connection error")
 
     @staticmethod
     def on_status_response(data):
         '''receive and log status message from laporte'''
 
         c_responses_total.labels('status_response', '/').inc()
-        logging.info("Laporte status response: %s", data)
+        logger.info("Laporte status response: %s", data)
 
     @staticmethod
     def on_reload_response(data):
@@ -193,12 +200,137 @@ class DefaultNamespace(socketio.ClientNamespace):
 
         del data  # Ignored parameter
         c_responses_total.labels('reload_response   ', '/').inc()
-        logging.info("Laporte was reloaded")
+        logger.info("Laporte was reloaded")
+
+
+class EmitBuffer():
+    '''
+    Buffer of sensor values waiting to be emitted to the Laporte.
+
+    Values are merged by response / node / key, so only the latest value of each
+    key is kept. The buffer is flushed as one packet per response when it holds
+    max_size values or when the oldest value is older than max_delay seconds.
+    '''
+    def __init__(self, sio, max_size=100, max_delay=0.1, max_pending=10000):
+        '''
+        Create an empty buffer.
+
+            sio (socketio.Client):
+                Connected Socket.IO client used for a flush.
+            max_size (int):
+                Flush when this number of values is buffered. Defaults to 100.
+            max_delay (float):
+                Flush values older than this number of seconds. Defaults to 0.1.
+            max_pending (int):
+                Block the producer when the connection is down and this number
+                of values is buffered. Defaults to 10000.
+        '''
+
+        self.sio = sio
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.pending = {}
+        self.size = 0
+        self.first_timestamp = None
+        self.cond = Condition()
+        self.c_emits = {
+            response: c_emits_total.labels(response, METRICS_NAMESPACE)
+            for response in BATCHED_RESPONSES
+        }
+
+    def _merge(self, response, message, overwrite=True):
+        '''merge {node:{key:value}} message into pending values (call with lock held)'''
+
+        nodes = self.pending.setdefault(response, {})
+        for node, values in message.items():
+            node_values = nodes.setdefault(node, {})
+            for key, value in values.items():
+                if key not in node_values:
+                    self.size += 1
+                elif not overwrite:
+                    continue
+                node_values[key] = value
+
+        if self.first_timestamp is None:
+            self.first_timestamp = monotonic()
+
+    def add(self, response, message):
+        '''add a {node:{key:value}} message, flush it if the buffer is full'''
+
+        with self.cond:
+            while self.size >= self.max_pending and not self.sio.connected:
+                logger.debug("emit buffer full (%d values), waiting for connection",
+                             self.size)
+                self.cond.wait(self.max_delay)
+
+            self._merge(response, message)
+            full = self.size >= self.max_size
+
+        if full:
+            self.flush()
+
+    def is_due(self):
+        '''return True if the oldest buffered value waits longer than max_delay'''
+
+        first_timestamp = self.first_timestamp
+        return (first_timestamp is not None
+                and monotonic() - first_timestamp >= self.max_delay)
+
+    def flush(self):
+        '''emit all buffered values, return the number of emitted values'''
+
+        with self.cond:
+            if not self.pending or not self.sio.connected:
+                return 0
+            pending = self.pending
+            size = self.size
+            self.pending = {}
+            self.size = 0
+            self.first_timestamp = None
+
+        failed = False
+        for response, message in pending.items():
+            if not failed:
+                try:
+                    self.sio.emit(response, message, namespace=METRICS_NAMESPACE)
+                    self.c_emits[response].inc()
+                    continue
+                except socketio.exceptions.SocketIOError as exc:
+                    logger.warning("Laporte batch emit failed: %s", exc)
+                    failed = True
+            with self.cond:
+                # keep newer values buffered in the meantime
+                self._merge(response, message, overwrite=False)
+
+        if failed:
+            return 0
+
+        h_emit_batch_size.observe(size)
+        with self.cond:
+            self.cond.notify_all()
+
+        return size
+
+    def loop(self):
+        '''background task flushing values on time limit'''
+
+        while True:
+            self.sio.sleep(self.max_delay / 2)
+            if self.is_due():
+                self.flush()
 
 
 class LaporteClient():
     '''Object containing Socket.IO client with registered namespaces.'''
-    def __init__(self, addr, port, gateways=None, events=False):
+    def __init__(self,
+                 addr,
+                 port,
+                 gateways=None,
+                 events=False,
+                 batch_size=None,
+                 batch_delay=0.1,
+                 batch_max_pending=10000):
         '''
         Connect to the laporte server.
 
@@ -211,6 +343,15 @@ class LaporteClient():
                 Defaults to None. Register metrics namespece if set.
             events (Optional[bool]):
                 Register events namespace. Defaults to False.
+            batch_size (Optional[int]):
+                Buffer sensor_response and sensor_addr_response emits and send
+                them in batches of this size. Defaults to None (no buffering).
+            batch_delay (Optional[float]):
+                Max time in seconds a buffered value waits for emit.
+                Defaults to 0.1.
+            batch_max_pending (Optional[int]):
+                Max number of buffered values while disconnected, emit blocks
+                above this limit. Defaults to 10000.
         '''
 
         namespaces = []
@@ -234,11 +375,19 @@ class LaporteClient():
                 self.sio.connect('http://{}:{}'.format(addr, port),
                                  namespaces=namespaces)
             except socketio.exceptions.ConnectionError as exc:
-                logging.error("%s", exc)
+                logger.error("%s", exc)
                 sleep(10)
             else:
                 break
 
+        self.buffer = None
+        if batch_size:
+            self.buffer = EmitBuffer(self.sio,
+                                     max_size=batch_size,
+                                     max_delay=batch_delay,
+                                     max_pending=batch_max_pending)
+            self.sio.start_background_task(self.buffer.loop)
+
     def loop(self):
         '''main loop for Socket.IO client'''
 
@@ -247,6 +396,17 @@ class LaporteClient():
     def emit(self, response, message, namespace=METRICS_NAMESPACE):
         '''emit custom response to the Laporte'''
 
-        logging.info("Laporte emit: %s %s", response, message)
+        if (self.buffer is not None and namespace == METRICS_NAMESPACE
+                and response in BATCHED_RESPONSES):
+            self.buffer.add(response, message)
+            return
+
+        logger.info("Laporte emit: %s %s", response, message)
         c_emits_total.labels(response, namespace).inc()
         self.sio.emit(response, message, namespace=namespace)
+
+    def flush(self):
+        '''emit all buffered values now'''
+
+        if self.buffer is not None:
+            self.buffer.flush()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+'''
+active-active cluster of Laporte servers - accepted sensor values are
+exchanged through replication logs with last-writer-wins versions
+'''
+
+import logging
+from collections import deque
+from hashlib import sha1
+from time import time
+import socketio
+from laporte.sensors import METRICS_NAMESPACE
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+CLUSTER_NAMESPACE = '/cluster'
+
+# seconds between announcements of joined gateways (also a heartbeat)
+ANNOUNCE_INTERVAL = 5
+
+# seconds between attempts to connect a peer
+CONNECT_INTERVAL = 2
+
+
+def get_rank(gw, node_id):
+    '''rendezvous hash of a gateway and a cluster node'''
+
+    return sha1('{}/{}'.format(gw, node_id).encode()).hexdigest()
+
+
+class Peer():
+    '''
+    Socket.IO client connected to another cluster node, receives
+    entries of its replication log and its joined gateways.
+    '''
+    def __init__(self, cluster, url):
+        self.cluster = cluster
+        self.url = url
+        self.node_id = None
+        self.gateways = set()
+        self.epoch = None
+        self.last_seq = None
+        self.syncing = False
+        self.client = socketio.Client(reconnection=True)
+        self.client.on('connect', self.on_connect, namespace=CLUSTER_NAMESPACE)
+        self.client.on('disconnect', self.on_disconnect, namespace=CLUSTER_NAMESPACE)
+        self.client.on('replicate', self.on_replicate, namespace=CLUSTER_NAMESPACE)
+        self.client.on('members', self.on_members, namespace=CLUSTER_NAMESPACE)
+
+    @property
+    def connected(self):
+        return self.client.connected and self.node_id is not None
+
+    def loop(self):
+        '''background task connecting the peer until the first success'''
+
+        while not self.client.connected:
+            try:
+                self.client.connect(self.url, namespaces=[CLUSTER_NAMESPACE])
+            except socketio.exceptions.ConnectionError as exc:
+                logger.debug("peer %s not available: %s", self.url, exc)
+                self.cluster.sio.sleep(CONNECT_INTERVAL)
+
+    def sync(self):
+        '''request entries missed since the last received one'''
+
+        if self.syncing:
+            return  # entries received meanwhile are in the response
+        self.syncing = True
+        self.client.emit('sync', {
+            'epoch': self.epoch,
+            'seq': self.last_seq
+        },
+                         namespace=CLUSTER_NAMESPACE,
+                         callback=self.on_sync)
+
+    def on_connect(self):
+        logger.info("connected to peer %s", self.url)
+        self.syncing = False
+        self.sync()
+
+    def on_disconnect(self, *_):
+        logger.warning("disconnected from peer %s (%s)", self.url, self.node_id)
+        self.cluster.update_leadership()
+
+    def on_members(self, message):
+        self.node_id = message['node_id']
+        self.gateways = set(message['gateways'])
+        self.cluster.update_leadership()
+
+    def on_sync(self, message):
+        self.on_members(message)
+        self.epoch = message['epoch']
+        for entry in message['entries']:
+            self.cluster.apply(entry)
+            self.last_seq = entry['seq']
+        self.syncing = False
+
+    def on_replicate(self, entry):
+        if self.syncing:
+            return
+        if entry['epoch'] != self.epoch:
+            logger.warning("peer %s restarted, sync", entry['origin'])
+            self.sync()
+            return
+        if self.last_seq is not None and entry['seq'] <= self.last_seq:
+            return  # duplicate
+        if self.last_seq is not None and entry['seq'] != self.last_seq + 1:
+            logger.warning("gap in log of %s (%s after %s), sync", self.node_id,
+                           entry['seq'], self.last_seq)
+            self.sync()
+            return
+        self.cluster.apply(entry)
+        self.last_seq = entry['seq']
+
+
+class Cluster():
+    '''
+    Replication of accepted sensor values between cluster nodes.
+
+    Values applied by this node (received from gateways or REST, not
+    swallowed by debounce or hold, trailing edges of debounce windows) are
+    appended to a bounded replication log and emitted to peers connected
+    to the cluster namespace. Peers apply a value only if its version (timestamp,
+    origin node) is newer than the version they know, so all nodes converge
+    to the last written value. Evals, TTLs and cron jobs run on every node.
+
+    Actuator values of a gateway are sent only by its leader, the node with
+    the highest rendezvous hash among nodes where the gateway is joined.
+    '''
+    def __init__(self, sio, sensors, node_id, peers, log_size=10000):
+        '''
+        Create an empty log and start connecting peers.
+
+            sio (flask_socketio.SocketIO):
+                Socket.IO server.
+            sensors (Sensors):
+                Sensors container.
+            node_id (str):
+                Unique name of this cluster node.
+            peers (list):
+                URLs of the other cluster nodes.
+            log_size (int):
+                Number of entries kept for peers catching up, a peer missing
+                older entries gets a snapshot. Defaults to 10000.
+        '''
+
+        self.sio = sio
+        self.sensors = sensors
+        self.node_id = node_id
+        self.epoch = time()  # distinguishes logs of restarted nodes
+        self.log = deque(maxlen=log_size)
+        self.seq = 0
+        self.versions = {}  # (node_id, sensor_id) -> (timestamp, origin, value)
+        self.led = set()  # gateways led by this node
+        self.applied_total = 0
+        self.stale_total = 0
+        self.peers = [Peer(self, url) for url in peers]
+        for peer in self.peers:
+            sio.start_background_task(peer.loop)
+        self.task = sio.start_background_task(self.loop)
+
+    def publish(self, sensor_values):
+        '''replicate (sensor, value) pairs applied by this node'''
+
+        timestamp = time()
+        values = []
+        for sensor, value in sensor_values:
+            key = (sensor.node_id, sensor.sensor_id)
+            self.versions[key] = (timestamp, self.node_id, value)
+            values.append([sensor.node_id, sensor.sensor_id, value])
+
+        self.seq += 1
+        entry = {
+            'origin': self.node_id,
+            'epoch': self.epoch,
+            'seq': self.seq,
+            'timestamp': timestamp,
+            'values': values
+        }
+        self.log.append(entry)
+        self.sio.emit('replicate', entry, namespace=CLUSTER_NAMESPACE)
+
+    def get_snapshot(self):
+        '''entry with all known values and their versions'''
+
+        return {
+            'origin': self.node_id,
+            'seq': self.seq,
+            'snapshot': [[node_id, sensor_id, value, timestamp, origin]
+                         for (node_id, sensor_id), (timestamp, origin,
+                                                    value) in self.versions.items()]
+        }
+
+    def get_sync(self, epoch, seq):
+        '''
+        return members info and log entries after seq,
+        or a snapshot if some of them are no longer in the log
+        (or seq is from a log before restart)
+        '''
+
+        if epoch == self.epoch and (not self.log or seq >= self.log[0]['seq'] - 1):
+            entries = [entry for entry in self.log if entry['seq'] > seq]
+        else:
+            entries = [self.get_snapshot()]
+
+        return {**self.get_members(), 'epoch': self.epoch, 'entries': entries}
+
+    def apply(self, entry):
+        '''apply values of a peer entry newer than the known versions'''
+
+        if 'snapshot' in entry:
+            values = entry['snapshot']
+        else:
+            values = [[node_id, sensor_id, value, entry['timestamp'], entry['origin']]
+                      for node_id, sensor_id, value in entry['values']]
+
+        sensor_values = []
+        for node_id, sensor_id, value, timestamp, origin in values:
+            key = (node_id, sensor_id)
+            known = self.versions.get(key)
+            if known is not None and (known[0], known[1]) >= (timestamp, origin):
+                self.stale_total += 1
+                continue
+            self.versions[key] = (timestamp, origin, value)
+            try:
+                sensor_values += self.sensors.coerce_values(
+                    {node_id: {sensor_id: value}})
+            except (KeyError, ValueError) as exc:
+                logger.warning("skip %s.%s from %s: %s", node_id, sensor_id,
+                               origin, exc)
+
+        if sensor_values:
+            self.applied_total += len(sensor_values)
+            self.sensors.set_sensors_values(sensor_values, replicated=True)
+
+    def get_gateways(self):
+        '''return gateways joined to this node'''
+
+        rooms = self.sio.server.manager.rooms.get(METRICS_NAMESPACE, {})
+        sids = rooms.get(None, {})
+        return {room for room in rooms if room is not None and room not in sids}
+
+    def get_members(self):
+        return {'node_id': self.node_id, 'gateways': sorted(self.get_gateways())}
+
+    def announce(self):
+        '''emit joined gateways to peers'''
+
+        self.sio.emit('members', self.get_members(), namespace=CLUSTER_NAMESPACE)
+        self.update_leadership()
+
+    def is_leader(self, gw, gateways=None):
+        '''return True if this node sends actuator values to the gateway'''
+
+        if gateways is None:
+            gateways = self.get_gateways()
+
+        candidates = [
+            peer.node_id for peer in self.peers if peer.connected and gw in peer.gateways
+        ]
+        if gw not in gateways:
+            return not candidates  # nobody has joined the gateway
+
+        candidates.append(self.node_id)
+        return max(candidates, key=lambda node_id: get_rank(gw, node_id)) == self.node_id
+
+    def update_leadership(self):
+        '''resend actuator state of gateways this node has started to lead'''
+
+        gateways = self.get_gateways()
+        led = {gw for gw in gateways if self.is_leader(gw, gateways)}
+        for gw in led - self.led:
+            logger.info("leader of gateway %s", gw)
+            self.led.add(gw)
+            self.sensors.resend_actuators(gw)
+        self.led &= led
+
+    def loop(self):
+        '''background task announcing joined gateways'''
+
+        while True:
+            self.sio.sleep(ANNOUNCE_INTERVAL)
+            self.announce()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''conversion of received values to the value type of a sensor'''
+
+from types import MappingProxyType
+
+# strings accepted as a state of a binary sensor
+BINARY_VALUES = MappingProxyType({
+    'True': True,
+    'true': True,
+    'ON': True,
+    'On': True,
+    'on': True,
+    'OK': True,
+    'Yes': True,
+    'yes': True,
+    '1': True,
+    'False': False,
+    'false': False,
+    'OFF': False,
+    'Off': False,
+    'off': False,
+    'LOW': False,
+    'No': False,
+    'no': False,
+    '0': False
+})
+
+
+def to_number(value):
+    '''gauge and counter value, strings are parsed as float'''
+
+    if isinstance(value, str):
+        return float(value)
+    return value
+
+
+def to_binary(value):
+    '''binary value, known strings are looked up, other strings are tested as bool'''
+
+    if isinstance(value, str):
+        ret = BINARY_VALUES.get(value)
+        return bool(value) if ret is None else ret
+    return value
+
+
+def to_message(value):
+    '''message value is kept as it is'''
+
+    return value
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+'''dataset groups - required sensors forming a complete sample of an eval'''
+
+import logging
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class DatasetGroup():
+    '''
+    Sensors required by an eval that form a complete sample.
+
+    The eval is skipped until all members are set since the last use
+    of the group or until the completion timeout expires. Marking
+    a member costs O(1), a reset of the group O(number of members).
+    '''
+    def __init__(self, sensor, timeout=None, started=None):
+        '''
+        Create a group without members.
+
+            sensor (Sensor):
+                Sensor with eval code using the group.
+            timeout (float):
+                Seconds to wait for missing members after the first member
+                is set, then eval with the last values. Defaults to None (no timeout).
+            started (set):
+                The group is added to this set when the first member of a sample
+                is set (to schedule the timeout).
+        '''
+
+        self.sensor = sensor
+        self.timeout = timeout
+        self.started = started
+        self.members = set()
+        self.ready = set()
+        self.expired = False
+        self.timeout_job = None
+
+    def add_member(self, member):
+        if member.dataset_groups is None:
+            member.dataset_groups = []
+        member.dataset_groups.append(self)
+        self.members.add(member)
+        logger.debug("dataset %s.%s: add member %s.%s", self.sensor.node_id,
+                     self.sensor.sensor_id, member.node_id, member.sensor_id)
+
+    def mark(self, member):
+        '''a member has been set'''
+
+        if not self.ready and self.timeout is not None:
+            self.started.add(self)
+        self.ready.add(member)
+
+    def discard(self, member):
+        '''a member has been reset'''
+
+        self.ready.discard(member)
+
+    def is_complete(self):
+        return self.expired or len(self.ready) == len(self.members)
+
+    def reset(self):
+        '''start a new sample'''
+
+        self.ready.clear()
+        self.expired = False
+        if self.timeout_job is not None:
+            self.timeout_job.remove()
+            self.timeout_job = None
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+fast path for simple eval code - a restricted expression compiled
+to a Python code object, asteval is used for everything else
+'''
+
+import ast
+import builtins
+import logging
+from numbers import Number
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# functions callable from a compiled expression
+FUNCTIONS = (
+    'abs', 'min', 'max', 'round', 'int', 'float', 'str', 'bool', 'len', 'sum',
+    'sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan', 'floor', 'ceil'
+)
+
+# functions identical to Python builtins in the asteval symbol table, the other
+# ones (numpy ufuncs) are taken from asteval to get identical results
+BUILTIN_FUNCTIONS = {
+    name: getattr(builtins, name)
+    for name in ('min', 'max', 'int', 'float', 'str', 'bool', 'len')
+}
+
+# nodes of the safe expression subset
+NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.BinOp, ast.Add, ast.Sub,
+    ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UnaryOp, ast.Not, ast.USub,
+    ast.UAdd, ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In,
+    ast.NotIn, ast.Is, ast.IsNot, ast.IfExp, ast.Call, ast.keyword, ast.Name, ast.Load,
+    ast.Constant, ast.Tuple, ast.List
+)
+
+# limits of asteval against denial of service
+MAX_EXPONENT = 10000
+MAX_STR_LEN = 2 << 17
+
+
+def safe_pow(base, exp):
+    if isinstance(exp, Number):
+        if exp > MAX_EXPONENT:
+            raise RuntimeError(
+                "Invalid exponent, max exponent is {}".format(MAX_EXPONENT))
+        return base**exp
+    # pylint: disable=import-outside-toplevel
+    from asteval.astutils import safe_pow as asteval_safe_pow
+    return asteval_safe_pow(base, exp)  # numpy array
+
+
+def safe_mult(arg1, arg2):
+    if isinstance(arg1, str) and isinstance(arg2, int) and len(arg1) * arg2 > MAX_STR_LEN:
+        raise RuntimeError(
+            "String length exceeded, max string length is {}".format(MAX_STR_LEN))
+    return arg1 * arg2
+
+
+def safe_add(arg1, arg2):
+    if isinstance(arg1, str) and isinstance(arg2, str) and len(arg1) + len(
+            arg2) > MAX_STR_LEN:
+        raise RuntimeError(
+            "String length exceeded, max string length is {}".format(MAX_STR_LEN))
+    return arg1 + arg2
+
+
+# operators checked against denial of service like in asteval
+SAFE_OPERATORS = {ast.Add: '_safe_add', ast.Mult: '_safe_mult', ast.Pow: '_safe_pow'}
+
+GLOBALS = {
+    '__builtins__': {},
+    '_safe_add': safe_add,
+    '_safe_mult': safe_mult,
+    '_safe_pow': safe_pow
+}
+
+_functions = None
+
+
+def get_functions():
+    '''
+    return FUNCTIONS of the asteval symbol table (created on the first use,
+    asteval imports numpy)
+    '''
+
+    global _functions  # pylint: disable=global-statement
+    if _functions is None:
+        from asteval import make_symbol_table  # pylint: disable=import-outside-toplevel
+        symtable = make_symbol_table(use_numpy=True)
+        _functions = {name: symtable[name] for name in FUNCTIONS if name in symtable}
+    return _functions
+
+
+class SafeOperators(ast.NodeTransformer):
+    '''replace +, * and ** with asteval safe functions'''
+    def visit_BinOp(self, node):  # pylint: disable=invalid-name
+        self.generic_visit(node)
+        if type(node.op) in SAFE_OPERATORS:
+            return ast.copy_location(
+                ast.Call(func=ast.Name(id=SAFE_OPERATORS[type(node.op)], ctx=ast.Load()),
+                         args=[node.left, node.right],
+                         keywords=[]), node)
+        return node
+
+
+class Expression():
+    '''eval code compiled to a Python code object'''
+    def __init__(self, code, code_obj, functions):
+        self.code = code
+        self.code_obj = code_obj
+        self.functions = functions  # names of used functions
+
+    def __repr__(self):
+        return '<Expression {!r}>'.format(self.code)
+
+    def __deepcopy__(self, memo):
+        # immutable, shared by sensors cloned from a template
+        return self
+
+    def eval(self, symbols):
+        '''
+        evaluate with a dict of symbols,
+        return (result, None) or (None, (exception name, message))
+        '''
+
+        if self.functions <= BUILTIN_FUNCTIONS.keys():
+            namespace = {**BUILTIN_FUNCTIONS, **symbols}
+        else:
+            namespace = {**get_functions(), **symbols}
+        try:
+            return eval(self.code_obj, GLOBALS, namespace), None  # pylint: disable=eval-used
+        except Exception as exc:  # pylint: disable=broad-except
+            return None, (type(exc).__name__, str(exc))
+
+
+def compile_expression(code, names):
+    '''
+    Compile eval code if it is a single expression of the safe subset.
+
+        code (str):
+            Eval code.
+        names (set):
+            Names of symbols available to the code (required vars, metrics).
+
+    Return an Expression or None if asteval is needed.
+    '''
+
+    if not isinstance(code, str):
+        return None
+
+    try:
+        tree = ast.parse(code.strip(), mode='eval')
+    except SyntaxError:
+        return None
+
+    functions = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, NODES):
+            return None
+        if isinstance(node, ast.Name) and node.id not in names:
+            if node.id not in FUNCTIONS:
+                return None
+            functions.add(node.id)
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name)
+                                               and node.func.id in FUNCTIONS):
+            return None
+        if isinstance(node, ast.keyword) and node.arg is None:
+            return None  # **kwargs
+
+    tree = ast.fix_missing_locations(SafeOperators().visit(tree))
+    logger.debug("eval code %r compiled", code)
+    return Expression(code, compile(tree, '<eval>', 'eval'), functions)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+'''
+fan-out of Socket.IO emits through a message bus - an emit is published once
+and every process on the bus delivers it to its own clients and rooms
+
+Front ends (processes without sensor state) forward messages of their
+clients through the bus to the state process, the one process on the bus
+(channel) with sensors.
+'''
+
+import logging
+import socket
+from argparse import ArgumentParser
+from queue import Queue
+from threading import Lock
+from time import sleep
+from urllib.parse import urlparse
+import socketio
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+DEFAULT_CHANNEL = 'laporte'
+DEFAULT_PORT = 6379
+
+# max seconds between attempts to reconnect the bus
+MAX_RETRY_SLEEP = 60
+
+# method of bus messages forwarded by front ends to the state process
+FORWARD = 'laporte_forward'
+
+
+def encode_bulk(arg):
+    '''encode a str or bytes as a RESP bulk string'''
+
+    if isinstance(arg, str):
+        arg = arg.encode()
+    return b'$%d\r\n%s\r\n' % (len(arg), arg)
+
+
+def encode_command(*args):
+    '''encode a command as a RESP array of bulk strings'''
+
+    return b'*%d\r\n' % len(args) + b''.join(encode_bulk(arg) for arg in args)
+
+
+def read_reply(rfile):
+    '''read one RESP reply from a file object, return None on EOF'''
+
+    line = rfile.readline()
+    if not line:
+        return None
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest
+    if kind == b'-':
+        raise ConnectionError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        data = rfile.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        return [read_reply(rfile) for _ in range(int(rest))]
+    raise ConnectionError('invalid reply {!r}'.format(line))
+
+
+class BusManager(socketio.PubSubManager):
+    '''Socket.IO client manager of a bus, base of bus implementations'''
+
+    published_total = 0
+    received_total = 0
+
+    # func(event, data, sid) handling messages forwarded by front ends,
+    # set in the state process only
+    forward_handler = None
+
+    def forward(self, event, data, sid):
+        '''forward a message of a client (sid) to the state process'''
+
+        self._publish({'method': FORWARD, 'event': event, 'data': data, 'sid': sid})
+
+    def _received(self, data):
+        '''count a message, handle it if forwarded, return True if handled'''
+
+        self.received_total += 1
+        if not isinstance(data, dict) or data.get('method') != FORWARD:
+            return False
+        if self.forward_handler is not None:
+            try:
+                self.forward_handler(data['event'], data['data'], data['sid'])
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("forwarded %s failed", data['event'])
+        return True
+
+
+class LocalManager(BusManager):
+    '''in-process bus of managers in one process (memory://)'''
+
+    name = 'memory'
+    channels = {}  # channel -> queues of listening managers
+
+    def _publish(self, data):
+        self.published_total += 1
+        for queue in self.channels.get(self.channel, []):
+            queue.put(data)
+
+    def _listen(self):
+        queue = Queue()
+        if self.channel not in self.channels:
+            self.channels[self.channel] = []
+        self.channels[self.channel].append(queue)
+        while True:
+            data = queue.get()
+            if not self._received(data):
+                yield data
+
+
+class RespManager(BusManager):
+    '''
+    Bus on a server speaking the Redis protocol (redis://host:port),
+    a Redis server or the laporte-bus broker. Messages are JSON encoded
+    like in the RedisManager of python-socketio.
+    '''
+
+    name = 'resp'
+
+    def __init__(self, url, channel=DEFAULT_CHANNEL, write_only=False):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or DEFAULT_PORT)
+        self.lock = Lock()
+        self.conn = None
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def __connect(self):
+        conn = socket.create_connection(self.address)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, conn.makefile('rb')
+
+    def _publish(self, data):
+        message = encode_command('PUBLISH', self.channel, self.json.dumps(data))
+        with self.lock:
+            for retries_left in (1, 0):
+                try:
+                    if self.conn is None:
+                        self.conn = self.__connect()
+                    self.conn[0].sendall(message)
+                    read_reply(self.conn[1])
+                    self.published_total += 1
+                    return
+                except (OSError, ConnectionError) as exc:
+                    self.conn = None
+                    logger.error("cannot publish to %s:%s%s: %s", *self.address,
+                                 ', retrying' if retries_left else '', exc)
+
+    def _listen(self):
+        retry_sleep = 1
+        channel = self.channel.encode()
+        while True:
+            try:
+                conn, rfile = self.__connect()
+                conn.sendall(encode_command('SUBSCRIBE', self.channel))
+                logger.info("subscribed to %s:%s channel %s", *self.address,
+                            self.channel)
+                retry_sleep = 1
+                while True:
+                    reply = read_reply(rfile)
+                    if reply is None:
+                        raise ConnectionError('connection closed')
+                    if reply[0] != b'message' or reply[1] != channel:
+                        continue
+                    try:
+                        data = self.json.loads(reply[2])
+                    except ValueError:
+                        logger.warning("invalid message on %s:%s", *self.address)
+                        continue
+                    if not self._received(data):
+                        yield data
+            except (OSError, ConnectionError) as exc:
+                logger.error("cannot receive from %s:%s, retrying in %s s: %s",
+                             *self.address, retry_sleep, exc)
+                sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, MAX_RETRY_SLEEP)
+
+
+def get_client_manager(url, channel=DEFAULT_CHANNEL, write_only=False):
+    '''
+    Create a Socket.IO client manager publishing emits to a bus.
+
+        url (str):
+            memory:// (in-process bus) or redis://host:port.
+        channel (str):
+            Bus channel shared by the processes. Defaults to laporte.
+        write_only (bool):
+            Only publish emits (a process without Socket.IO clients).
+
+    Raise ValueError if the URL scheme is not supported.
+    '''
+
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return LocalManager(channel=channel, write_only=write_only, logger=logger)
+    if scheme == 'redis':
+        return RespManager(url, channel=channel, write_only=write_only)
+    raise ValueError('unsupported message queue {} (use memory:// or redis://)'.format(
+        url))
+
+
+class Broker():
+    '''
+    Minimal pub/sub server speaking the Redis protocol
+    (SUBSCRIBE, UNSUBSCRIBE, PUBLISH, PING, QUIT), a local stand-in
+    for a Redis server shared by Laporte processes.
+    '''
+    def __init__(self):
+        self.channels = {}  # channel -> {socket: lock}
+
+    def publish(self, channel, payload):
+        message = encode_command('message', channel, payload)
+        subscribers = list(self.channels.get(channel, {}).items())
+        for conn, lock in subscribers:
+            try:
+                with lock:
+                    conn.sendall(message)
+            except OSError:
+                pass  # removed by its handler
+        return len(subscribers)
+
+    def handle(self, conn, address):
+        '''serve one client connection'''
+
+        # pylint: disable=import-outside-toplevel
+        from gevent.lock import Semaphore
+
+        logger.debug("bus client %s connected", address)
+        lock = Semaphore()
+        subscribed = set()
+        rfile = conn.makefile('rb')
+
+        def reply(data):
+            with lock:
+                conn.sendall(data)
+
+        try:
+            while True:
+                command = read_reply(rfile)
+                if not isinstance(command, list) or not command:
+                    break
+                name = command[0].upper()
+                if name == b'PUBLISH' and len(command) == 3:
+                    reply(b':%d\r\n' % self.publish(command[1], command[2]))
+                elif name in (b'SUBSCRIBE', b'UNSUBSCRIBE'):
+                    for channel in command[1:]:
+                        if name == b'SUBSCRIBE':
+                            subscribed.add(channel)
+                            if channel not in self.channels:
+                                self.channels[channel] = {}
+                            self.channels[channel][conn] = lock
+                        else:
+                            subscribed.discard(channel)
+                            self.channels.get(channel, {}).pop(conn, None)
+                        reply(b'*3\r\n' + encode_bulk(name.lower()) +
+                              encode_bulk(channel) + b':%d\r\n' % len(subscribed))
+                elif name == b'PING':
+                    reply(b'+PONG\r\n')
+                elif name == b'QUIT':
+                    reply(b'+OK\r\n')
+                    break
+                else:
+                    reply(b'-ERR unknown command\r\n')
+        except (OSError, ConnectionError, ValueError) as exc:
+            logger.debug("bus client %s: %s", address, exc)
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, {}).pop(conn, None)
+            logger.debug("bus client %s disconnected", address)
+
+
+def run_broker():
+    '''start the pub/sub broker (laporte-bus)'''
+
+    parser = ArgumentParser(description='Laporte pub/sub bus (Redis protocol subset)')
+    parser.add_argument('-a',
+                        '--address',
+                        action='store',
+                        dest='listen_addr',
+                        help='listen address (default 127.0.0.1)',
+                        type=str,
+                        default='127.0.0.1')
+    parser.add_argument('-p',
+                        '--port',
+                        action='store',
+                        dest='listen_port',
+                        help='listen port (default {0})'.format(DEFAULT_PORT),
+                        type=int,
+                        default=DEFAULT_PORT)
+    pars = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from gevent.server import StreamServer
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info("bus listen %s:%s", pars.listen_addr, pars.listen_port)
+    StreamServer((pars.listen_addr, pars.listen_port), Broker().handle).serve_forever()
+
+
+if __name__ == '__main__':
+    run_broker()
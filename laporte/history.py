@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''fixed-size history of sensor values with windowed aggregate functions'''
+
+from time import time
+
+np = None  # numpy, imported upon the first History
+
+# max number of samples of one sensor history
+MAX_HISTORY_SIZE = 1000000
+
+
+class History():
+    '''
+    Ring buffer of (timestamp, value) samples backed by NumPy arrays.
+
+    Aggregate functions take an optional window in seconds (samples not older
+    than window, all stored samples if None) and return None if there is no
+    sample in the window. They are available in eval code as methods of the
+    history object, e.g. history.avg(60) or t.percentile(95, 3600).
+    '''
+    def __init__(self, size):
+        if not isinstance(size, int) or not 0 < size <= MAX_HISTORY_SIZE:
+            raise ValueError('history size must be 1..{}'.format(MAX_HISTORY_SIZE))
+
+        global np  # pylint: disable=global-statement
+        if np is None:
+            import numpy as np  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+        self.size = size
+        self.timestamps = np.zeros(size)
+        self.values = np.zeros(size)
+        self.appended = 0
+
+    def __repr__(self):
+        return '<History {}/{} samples>'.format(min(self.appended, self.size), self.size)
+
+    def append(self, timestamp, value):
+        '''store a new sample, overwrite the oldest one if full'''
+
+        i = self.appended % self.size
+        self.timestamps[i] = timestamp
+        self.values[i] = value
+        self.appended += 1
+
+    def replace_last(self, value):
+        '''replace value of the last sample (value corrected by eval)'''
+
+        if self.appended:
+            self.values[(self.appended - 1) % self.size] = value
+
+    def clear(self):
+        self.appended = 0
+
+    def get_info(self):
+        '''return size, number of stored samples and memory usage'''
+
+        return {
+            'size': self.size,
+            'samples': min(self.appended, self.size),
+            'bytes': self.timestamps.nbytes + self.values.nbytes
+        }
+
+    def __select(self, window=None):
+        '''return (timestamps, values) of samples in the window, unordered'''
+
+        n = min(self.appended, self.size)
+        timestamps = self.timestamps[:n]
+        values = self.values[:n]
+
+        if window is not None:
+            mask = timestamps >= time() - window
+            timestamps = timestamps[mask]
+            values = values[mask]
+
+        return timestamps, values
+
+    def count(self, window=None):
+        return int(self.__select(window)[1].size)
+
+    def sum(self, window=None):
+        values = self.__select(window)[1]
+        return float(values.sum()) if values.size else None
+
+    def avg(self, window=None):
+        values = self.__select(window)[1]
+        return float(values.mean()) if values.size else None
+
+    def min(self, window=None):
+        values = self.__select(window)[1]
+        return float(values.min()) if values.size else None
+
+    def max(self, window=None):
+        values = self.__select(window)[1]
+        return float(values.max()) if values.size else None
+
+    def stddev(self, window=None):
+        values = self.__select(window)[1]
+        return float(values.std()) if values.size else None
+
+    def percentile(self, q, window=None):
+        values = self.__select(window)[1]
+        return float(np.percentile(values, q)) if values.size else None
+
+    def delta(self, window=None):
+        '''difference between the last and the first value in the window'''
+
+        timestamps, values = self.__select(window)
+        if values.size < 2:
+            return None
+        return float(values[timestamps.argmax()] - values[timestamps.argmin()])
+
+    def rate(self, window=None):
+        '''per-second change between the first and the last value in the window'''
+
+        timestamps, values = self.__select(window)
+        if values.size < 2:
+            return None
+        first = timestamps.argmin()
+        last = timestamps.argmax()
+        if timestamps[last] == timestamps[first]:
+            return None
+        return float(
+            (values[last] - values[first]) / (timestamps[last] - timestamps[first]))
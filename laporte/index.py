@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+'''secondary indexes of the sensor registry'''
+
+import logging
+from fnmatch import fnmatchcase
+from laporte.sensor import SENSOR, ACTUATOR, GAUGE, COUNTER, BINARY, MESSAGE
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+TYPES = {'gauge': GAUGE, 'counter': COUNTER, 'binary': BINARY, 'message': MESSAGE}
+MODES = {'sensor': SENSOR, 'actuator': ACTUATOR}
+
+
+def is_glob(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+class SensorIndex():
+    '''
+    Sensors indexed by gateway, node_id, sensor_id, type, mode,
+    export labels and node_addr/key.
+
+    Every index maps a key to an insertion ordered dict used as a set of sensors,
+    so query results keep the order of sensor registration.
+    '''
+    def __init__(self):
+        self.sensors = {}
+        self.by_gw = {}
+        self.by_node = {}
+        self.by_sensor = {}
+        self.by_type = {}
+        self.by_mode = {}
+        self.by_label = {}  # (label, label_value) -> sensors
+        self.by_addr = {}  # (node_addr, key) -> the first sensor
+
+    @staticmethod
+    def __add(index, key, sensor):
+        if key not in index:
+            index[key] = {}
+        index[key][sensor] = None
+
+    def add(self, sensor):
+        self.sensors[sensor] = None
+        self.__add(self.by_gw, sensor.gw, sensor)
+        self.__add(self.by_node, sensor.node_id, sensor)
+        self.__add(self.by_sensor, sensor.sensor_id, sensor)
+        self.__add(self.by_type, sensor.get_type(), sensor)
+        self.__add(self.by_mode, sensor.mode, sensor)
+        for label in sensor.export_labels.items():
+            self.__add(self.by_label, label, sensor)
+        if (sensor.node_addr, sensor.key) not in self.by_addr:
+            self.by_addr[(sensor.node_addr, sensor.key)] = sensor
+
+    def find_addr(self, node_addr, key):
+        '''return a sensor with given node_addr and key'''
+
+        return self.by_addr.get((node_addr, key))
+
+    def get_gw(self, gw):
+        return list(self.by_gw.get(gw, {}))
+
+    def get_first_of_sensor_ids(self):
+        '''yield sensor_id and the first sensor with this sensor_id'''
+
+        for sensor_id, sensors in self.by_sensor.items():
+            yield sensor_id, next(iter(sensors))
+
+    @staticmethod
+    def __match(index, pattern):
+        '''return sensors with a key matching a glob pattern'''
+
+        if not is_glob(pattern):
+            return index.get(pattern, {})
+
+        ret = {}
+        for key, sensors in index.items():
+            if fnmatchcase(str(key), pattern):
+                ret.update(sensors)
+        return ret
+
+    def query(self, gw=None, node=None, sensor=None, sensor_type=None, mode=None,
+              labels=None):
+        '''
+        Return a list of sensors matching all given conditions.
+
+            gw (str):
+                Gateway.
+            node (str):
+                node_id or its glob pattern.
+            sensor (str):
+                sensor_id or its glob pattern.
+            sensor_type (str):
+                gauge, counter, binary or message.
+            mode (str):
+                sensor or actuator.
+            labels (dict):
+                Export labels and their values.
+
+        Only the smallest candidate set is iterated, the other conditions
+        are checked by lookups in their indexes.
+        '''
+
+        candidates = []
+        if gw is not None:
+            candidates.append(self.by_gw.get(gw, {}))
+        if node is not None:
+            candidates.append(self.__match(self.by_node, node))
+        if sensor is not None:
+            candidates.append(self.__match(self.by_sensor, sensor))
+        if sensor_type is not None:
+            candidates.append(self.by_type.get(TYPES.get(sensor_type), {}))
+        if mode is not None:
+            candidates.append(self.by_mode.get(MODES.get(mode), {}))
+        for label in (labels or {}).items():
+            candidates.append(self.by_label.get(label, {}))
+
+        if not candidates:
+            return list(self.sensors)
+
+        candidates.sort(key=len)
+        smallest, others = candidates[0], candidates[1:]
+        return [s for s in smallest if all(s in other for other in others)]
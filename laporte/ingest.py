@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''bounded ingest queues applying received values in prioritized batches'''
+
+import logging
+from threading import Event, Lock
+from laporte.sensor import ACTUATOR
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+HIGH = 0
+LOW = 1
+PRIORITIES = {HIGH: 'high', LOW: 'low'}
+
+
+class Overloaded(Exception):
+    '''an ingest queue is full, values were rejected'''
+
+
+class Batch():
+    '''values of one queue applied together with one diff and emit'''
+    def __init__(self, increment):
+        self.increment = increment
+        self.values = {}  # sensor -> converted value
+        self.done = Event()
+        self.result = {}
+
+
+class IngestQueue():
+    '''
+    Received values wait in bounded queues and a background task applies
+    them in batches. A request with a value of an actuator (command) is
+    queued with high priority and applied before requests with values of
+    sensors only (bulk data); the task yields between batches, so scrapes
+    and emits are not starved. Values of one request stay in one batch.
+    Queued low priority batches with values of the same sensors as a high
+    priority request are moved ahead of it, so values of a sensor are
+    applied in the order they were received.
+
+    Requests are added to the last batch unless it has a value of the same
+    sensor, so every received value is applied. Only if a queue is full,
+    a value replaces a queued value of the same sensor in the last batch
+    (superseded values are coalesced). Requests that do not fit in a full
+    queue are rejected as a whole (Overloaded).
+    '''
+    def __init__(self, sio, sensors, max_size=10000):
+        '''
+        Create empty queues and start the background task.
+
+            sio (flask_socketio.SocketIO):
+                Socket.IO server used to start the background task.
+            sensors (Sensors):
+                Sensors container applying the values.
+            max_size (int):
+                Max number of queued values of each priority. Defaults to 10000.
+        '''
+
+        self.sio = sio
+        self.sensors = sensors
+        self.max_size = max_size
+        self.queues = {HIGH: [], LOW: []}
+        self.sizes = {HIGH: 0, LOW: 0}
+        self.accepted_total = {HIGH: 0, LOW: 0}
+        self.coalesced_total = {HIGH: 0, LOW: 0}
+        self.dropped_total = {HIGH: 0, LOW: 0}
+        self.batches_total = 0
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.task = sio.start_background_task(self.loop)
+
+    def put(self, sensor_values, increment=False):
+        '''
+        Queue (sensor, converted value) pairs of one request,
+        return batches to wait for. Raise Overloaded before any value is queued.
+        '''
+
+        values = dict(sensor_values)
+        if not values:
+            return []
+        priority = HIGH if any(sensor.mode == ACTUATOR for sensor in values) else LOW
+
+        with self.lock:
+            promoted = self.__get_promoted(values) if priority == HIGH else 0
+            queue = self.queues[priority]
+            last = queue[-1] if queue and queue[-1].increment == increment else None
+            if promoted:
+                last = None  # the request is applied after the promoted batches
+            same = sum(1 for sensor in values if sensor in last.values) if last else 0
+            size = self.sizes[priority] + len(values)
+
+            if size <= self.max_size:
+                self.__promote(promoted)
+                if last is None or same:
+                    last = Batch(increment)
+                    queue.append(last)
+                self.sizes[priority] += len(values)
+            elif last is not None and not increment and size - same <= self.max_size:
+                # full queue, replace superseded values of the last batch
+                self.coalesced_total[priority] += same
+                self.sizes[priority] += len(values) - same
+            else:
+                self.dropped_total[priority] += len(values)
+                raise Overloaded('ingest queue {} is full'.format(PRIORITIES[priority]))
+
+            last.values.update(values)
+            self.accepted_total[priority] += len(values)
+
+        self.wakeup.set()
+        return [last]
+
+    @staticmethod
+    def wait(batches):
+        '''wait until batches are applied, return their merged changes'''
+
+        ret = {}
+        for batch in batches:
+            batch.done.wait()
+            for node_id, sensors_dict in batch.result.items():
+                if node_id not in ret:
+                    ret[node_id] = {}
+                ret[node_id].update(sensors_dict)
+        return ret
+
+    def get_depth(self, priority):
+        return self.sizes[priority]
+
+    def __get_promoted(self, values):
+        '''
+        return number of low priority batches up to the last one
+        with a value of the same sensors
+        '''
+
+        ret = 0
+        for i, batch in enumerate(self.queues[LOW]):
+            if not batch.values.keys().isdisjoint(values):
+                ret = i + 1
+        return ret
+
+    def __promote(self, count):
+        '''move the first count low priority batches to the high priority queue'''
+
+        batches = self.queues[LOW][:count]
+        del self.queues[LOW][:count]
+        for batch in batches:
+            self.sizes[LOW] -= len(batch.values)
+            self.sizes[HIGH] += len(batch.values)
+        self.queues[HIGH].extend(batches)
+
+    def __pop_batch(self):
+        with self.lock:
+            for priority in (HIGH, LOW):
+                if self.queues[priority]:
+                    batch = self.queues[priority].pop(0)
+                    self.sizes[priority] -= len(batch.values)
+                    return batch
+        return None
+
+    def apply_pending(self):
+        '''apply queued batches until the queues are empty'''
+
+        batch = self.__pop_batch()
+        while batch is not None:
+            # skip sensors replaced by a config reload
+            values = [(sensor, value) for sensor, value in batch.values.items()
+                      if sensor in self.sensors.index.sensors]
+            try:
+                batch.result = self.sensors.set_sensors_values(values,
+                                                               increment=batch.increment)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("ingest: batch of %d values failed", len(values))
+            self.batches_total += 1
+            batch.done.set()
+
+            self.sio.sleep(0)
+            batch = self.__pop_batch()
+
+    def loop(self):
+        '''background task applying queued batches'''
+
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.apply_pending()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''low-overhead primitives for measuring the Laporte hot path'''
+
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+# upper bounds of duration histogram buckets (seconds)
+DURATION_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ingest stages that can be measured
+STAGES = ('parse', 'set', 'eval', 'propagate', 'diff', 'ttl', 'emit')
+
+
+class DurationHistogram():
+    '''pre-allocated histogram of durations with a fixed label set'''
+
+    __slots__ = ('labels', 'buckets', 'count', 'sum')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, duration):
+        self.buckets[bisect_left(DURATION_BUCKETS, duration)] += 1
+        self.count += 1
+        self.sum += duration
+
+    def get_cumulative_buckets(self):
+        '''return [(le, cumulative count)] as needed by HistogramMetricFamily'''
+
+        ret = []
+        total = 0
+        for le, count in zip(DURATION_BUCKETS + (float('inf'), ), self.buckets):
+            total += count
+            ret.append(('+Inf' if le == float('inf') else str(le), total))
+        return ret
+
+
+class CountValue():
+    '''counter with a fixed label set'''
+
+    __slots__ = ('labels', 'total')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.total = 0
+
+    def inc(self):
+        self.total += 1
+
+
+def stage(name):
+    '''
+    tag a method as an ingest stage, the method itself is left untouched
+    (it is wrapped only if stage measuring is enabled)
+    '''
+
+    assert name in STAGES
+
+    def decorator(func):
+        func.stage = name
+        return func
+
+    return decorator
+
+
+def timed(func, histogram):
+    '''wrap func so each call duration is observed in histogram'''
+    @wraps(func)
+    def _time_it(*args, **kwargs):
+        start_t = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start_t)
+
+    return _time_it
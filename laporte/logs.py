@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+'''
+logging setup of the Laporte server - records are written by a background
+listener, hot call sites can be sampled and rate limited
+'''
+
+import atexit
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from time import monotonic
+
+LOG_FORMAT = '%(levelname)s %(module)s: %(message)s'
+LOG_FORMATS = ('text', 'json')
+
+
+class Lazy():
+    '''log argument built only if the record is emitted'''
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class ThrottleFilter(logging.Filter):
+    '''
+    Sampling and rate limit of records per call site (logger, file and line).
+
+    Only every sample-th DEBUG and INFO record of a call site passes,
+    warnings and errors are not sampled. A token bucket limits records
+    of a call site to rate per second (all levels), the number of dropped
+    records is added to the next passed record of the call site.
+    '''
+    def __init__(self, rate=0, sample=1):
+        '''
+        Create a filter without call sites.
+
+            rate (float):
+                Max records per second of one call site. Defaults to 0 (unlimited).
+            sample (int):
+                Pass every sample-th DEBUG/INFO record. Defaults to 1 (all).
+        '''
+
+        super().__init__()
+        self.rate = rate
+        self.burst = max(rate, 1)
+        self.sample = max(sample, 1)
+        self.sites = {}  # (name, pathname, lineno) -> [tokens, last time, seen, dropped]
+
+    def filter(self, record):
+        key = (record.name, record.pathname, record.lineno)
+        now = monotonic()
+        site = self.sites.get(key)
+        if site is None:
+            site = [self.burst, now, 0, 0]
+            self.sites[key] = site
+
+        site[2] += 1
+        if record.levelno < logging.WARNING and (site[2] - 1) % self.sample:
+            return False
+
+        if self.rate:
+            site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+            site[1] = now
+            if site[0] < 1:
+                site[3] += 1
+                return False
+            site[0] -= 1
+
+        if site[3]:
+            record.suppressed = site[3]
+            site[3] = 0
+        return True
+
+
+class RecordQueueHandler(QueueHandler):
+    '''
+    Queue handler passing records to the formatter of the listener.
+
+    QueueHandler.prepare formats the whole record into the message, so
+    the formatter of the listener gets a traceback as a part of the message.
+    Here only the message is merged with its arguments and the traceback
+    is rendered to exc_text.
+    '''
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            text += ' ({} similar messages suppressed)'.format(suppressed)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    '''one JSON object per line'''
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            data['suppressed'] = suppressed
+        return json.dumps(data, default=str)
+
+
+def setup_logging(level, levels=None, log_format='text', rate=0, sample=1):
+    '''
+    Log through a queue to a stderr handler run by a background listener.
+
+        level (int):
+            Level of the root logger.
+        levels (dict):
+            Levels of subsystem loggers (e.g. laporte.sensors, engineio).
+        log_format (str):
+            text or json.
+        rate (float):
+            Max records per second of one call site. Defaults to 0 (unlimited).
+        sample (int):
+            Pass every sample-th DEBUG/INFO record of a call site. Defaults to 1.
+
+    Return the started QueueListener.
+    '''
+
+    handler = logging.StreamHandler()
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter(LOG_FORMAT))
+
+    log_queue = SimpleQueue()
+    queue_handler = RecordQueueHandler(log_queue)
+    if rate or sample > 1:
+        queue_handler.addFilter(ThrottleFilter(rate=rate, sample=sample))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    for name, subsystem_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+'''per-gateway outbound queues delivering actuator changes with acknowledgements'''
+
+import logging
+import json
+from random import uniform
+from threading import Event, Lock
+from time import time
+from socketio import PubSubManager
+from laporte.sensors import METRICS_NAMESPACE
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class GatewayOutbox():
+    '''
+    Bounded queue of actuator values waiting for delivery to one gateway.
+
+    Values are coalesced by response / node / key, so only the latest value
+    of each actuator is kept. A background task emits queued values to every
+    client joined in the gateway room, waits for Socket.IO acknowledgements
+    and retries unacknowledged values with jittered exponential backoff.
+    '''
+    def __init__(self,
+                 sio,
+                 gw,
+                 max_size=1000,
+                 ack_timeout=5,
+                 retry_delay=1,
+                 retry_delay_max=30):
+        '''
+        Create an empty outbox and start its delivery task.
+
+            sio (flask_socketio.SocketIO):
+                Socket.IO server used for emits.
+            gw (str):
+                Gateway (room) name.
+            max_size (int):
+                Max number of queued values, the oldest value is dropped
+                above this limit. Defaults to 1000.
+            ack_timeout (float):
+                Seconds to wait for acknowledgements. Defaults to 5.
+            retry_delay (float):
+                Initial delay in seconds before a retry. Defaults to 1.
+            retry_delay_max (float):
+                Max delay in seconds before a retry. Defaults to 30.
+        '''
+
+        self.sio = sio
+        self.gw = gw
+        self.max_size = max_size
+        self.ack_timeout = ack_timeout
+        self.retry_delay = retry_delay
+        self.retry_delay_max = retry_delay_max
+        self.pending = {}
+        self.order = {}  # (response, node, key) of queued values, the oldest first
+        self.size = 0
+        self.lock = Lock()
+        self.wakeup = Event()
+
+        # stats exported by PrometheusMetrics
+        self.sent_total = 0
+        self.retries_total = 0
+        self.dropped_total = 0
+        self.ack_count = 0
+        self.ack_sum = 0.0
+
+        self.task = sio.start_background_task(self.loop)
+
+    def __drop_oldest(self):
+        '''drop the least recently queued value of all responses (call with lock held)'''
+
+        item = next(iter(self.order))
+        del self.order[item]
+        response, node, key = item
+        nodes = self.pending[response]
+        del nodes[node][key]
+        if not nodes[node]:
+            del nodes[node]
+        self.size -= 1
+        self.dropped_total += 1
+
+    def __merge(self, response, data):
+        '''merge {node:{key:value}} data into queued values (call with lock held)'''
+
+        nodes = self.pending.setdefault(response, {})
+        for node, values in data.items():
+            for key, value in values.items():
+                item = (response, node, key)
+                node_values = nodes.get(node, {})
+                if key in node_values:
+                    # an overwritten value is the newest one
+                    node_values[key] = value
+                    del self.order[item]
+                    self.order[item] = None
+                    continue
+
+                if self.size >= self.max_size:
+                    logger.warning("outbox %s full, dropping the oldest value",
+                                   self.gw)
+                    self.__drop_oldest()
+
+                nodes.setdefault(node, {})[key] = value
+                self.order[item] = None
+                self.size += 1
+
+    def __requeue(self, pending, order):
+        '''
+        queue values of a failed delivery in front of values queued in the meantime,
+        values replaced in the meantime are skipped (call with lock held)
+        '''
+
+        requeued = []
+        # the newest values are kept if the outbox is full
+        for item in reversed(order):
+            response, node, key = item
+            if response not in pending:
+                continue
+            nodes = self.pending.setdefault(response, {})
+            if key in nodes.get(node, {}):
+                continue
+            if self.size >= self.max_size:
+                self.dropped_total += 1
+                continue
+
+            nodes.setdefault(node, {})[key] = pending[response][node][key]
+            requeued.append(item)
+            self.size += 1
+
+        self.order = {**dict.fromkeys(reversed(requeued)), **self.order}
+
+    def put(self, response, data):
+        '''queue {node:{key:value}} data for delivery, newer values replace queued'''
+
+        with self.lock:
+            self.__merge(response, data)
+        self.wakeup.set()
+
+    def __deliver(self, response, data):
+        '''emit data to all clients in the gateway room, wait for their acks'''
+
+        sids = [
+            sid for sid, _ in self.sio.server.manager.get_participants(
+                METRICS_NAMESPACE, self.gw)
+        ]
+        message = json.dumps({self.gw: data})
+
+        if not sids:
+            if isinstance(self.sio.server.manager, PubSubManager):
+                # the gateway may be joined to a front end of the bus,
+                # the room is known only there, so publish without acks
+                self.sio.emit(response,
+                              message,
+                              room=self.gw,
+                              namespace=METRICS_NAMESPACE)
+                self.sent_total += 1
+                return True
+            logger.debug("outbox %s: no client joined, delivery postponed", self.gw)
+            return False
+
+        remaining = set(sids)
+        done = Event()
+        start = time()
+
+        def get_callback(sid):
+            def callback(*_):
+                self.ack_count += 1
+                self.ack_sum += time() - start
+                remaining.discard(sid)
+                if not remaining:
+                    done.set()
+
+            return callback
+
+        for sid in sids:
+            self.sio.emit(response,
+                          message,
+                          to=sid,
+                          namespace=METRICS_NAMESPACE,
+                          callback=get_callback(sid))
+
+        done.wait(self.ack_timeout)
+        if remaining:
+            logger.warning("outbox %s: %s not acknowledged by %d clients", self.gw,
+                           response, len(remaining))
+            return False
+
+        self.sent_total += 1
+        return True
+
+    def loop(self):
+        '''background task delivering queued values'''
+
+        delay = self.retry_delay
+        timeout = None
+
+        while True:
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+
+            with self.lock:
+                pending, order = self.pending, self.order
+                self.pending, self.order = {}, {}
+                self.size = 0
+
+            failed = {}
+            for response, data in pending.items():
+                if not data:
+                    continue
+                if failed or not self.__deliver(response, data):
+                    failed[response] = data
+
+            if failed:
+                with self.lock:
+                    # keep newer values queued in the meantime
+                    self.__requeue(failed, order)
+                self.retries_total += 1
+                timeout = uniform(delay / 2, delay * 1.5)
+                delay = min(delay * 2, self.retry_delay_max)
+            else:
+                timeout = None
+                delay = self.retry_delay
+
+
+class Outboxes():
+    '''container of per-gateway outboxes'''
+    def __init__(self, sio, **kwargs):
+        '''
+        Create an empty container.
+
+            sio (flask_socketio.SocketIO):
+                Socket.IO server used for emits.
+            kwargs:
+                GatewayOutbox parameters.
+        '''
+
+        self.sio = sio
+        self.kwargs = kwargs
+        self.gateways = {}
+
+    def get(self, gw):
+        '''get outbox of a gateway, create it if not exists'''
+
+        if gw not in self.gateways:
+            self.gateways[gw] = GatewayOutbox(self.sio, gw, **self.kwargs)
+        return self.gateways[gw]
+
+    def put(self, gw, response, data):
+        '''queue {node:{key:value}} data for delivery to a gateway'''
+
+        self.get(gw).put(response, data)
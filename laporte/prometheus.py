@@ -4,16 +4,18 @@ objects for Prometheus metrics
 '''
 
 import logging
-from operator import itemgetter
-from time import time
 from functools import wraps
 from prometheus_client.core import (InfoMetricFamily, GaugeMetricFamily,
-                                    CounterMetricFamily, SummaryMetricFamily)
+                                    CounterMetricFamily, SummaryMetricFamily,
+                                    HistogramMetricFamily)
 from laporte.sensor import COUNTER
+from laporte.instrument import DurationHistogram, CountValue, timed
 from laporte.version import __version__
+from laporte.ingest import PRIORITIES
 
 # create logger
-logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 EXPORTER_NAME = 'laporte'
 
@@ -22,52 +24,52 @@ class PrometheusMetrics:
     durations = {}
     counters = {}
 
-    def __init__(self, sensors):
+    def __init__(self, sensors, eval_metrics=False):
         self.sensors = sensors
+        self.eval_metrics = eval_metrics
 
-    def func_measure(self, labels):
-        '''
-        update duration (summary) of any function with this decorator is called
-        '''
-        def decorator(func):
-            @wraps(func)
-            def _time_it(*args, **kwargs):
-                start_t = time()
-                try:
-                    return func(*args, **kwargs)
-                finally:
-                    labels_key = 'duration_' + str(
-                        list(map(itemgetter(0), labels.items())))
-                    values_key = str(list(map(itemgetter(1), labels.items())))
+    def get_histogram(self, labels):
+        '''get (create) duration histogram with given labels'''
 
-                    if labels_key not in self.durations:
-                        self.durations[labels_key] = {}
-                    if values_key not in self.durations[labels_key]:
-                        self.durations[labels_key][values_key] = {
-                            'count': 0,
-                            'sum': 0.0,
-                            'labels': labels
-                        }
+        labels_key = tuple(labels)
+        values_key = tuple(labels.values())
+        labels_data = self.durations.setdefault(labels_key, {})
+        if values_key not in labels_data:
+            labels_data[values_key] = DurationHistogram(labels)
+        return labels_data[values_key]
 
-                    duration = time() - start_t
-                    logging.debug("duration: %fs", duration)
+    def get_counter(self, labels):
+        '''get (create) counter with given labels'''
 
-                    self.durations[labels_key][values_key]['count'] += 1
-                    self.durations[labels_key][values_key]['sum'] += duration
+        labels_key = tuple(labels)
+        values_key = tuple(labels.values())
+        labels_data = self.counters.setdefault(labels_key, {})
+        if values_key not in labels_data:
+            labels_data[values_key] = CountValue(labels)
+        return labels_data[values_key]
 
-            return _time_it
+    def func_measure(self, labels):
+        '''
+        update duration (histogram) of any function with this decorator is called
+        '''
+        histogram = self.get_histogram(labels)
+
+        def decorator(func):
+            return timed(func, histogram)
 
         return decorator
 
     def func_count(self, labels):
         '''update number of times any function with this decorator is called'''
+        counter = self.get_counter(labels)
+
         def decorator(func):
             @wraps(func)
             def _inc_count(*args, **kwargs):
                 try:
                     return func(*args, **kwargs)
                 finally:
-                    self.counter_inc(labels)
+                    counter.inc()
 
             return _inc_count
 
@@ -75,15 +77,24 @@ class PrometheusMetrics:
 
     def counter_inc(self, labels):
         '''update counter'''
-        labels_key = 'counts_' + str(list(map(itemgetter(0), labels.items())))
-        values_key = str(list(map(itemgetter(1), labels.items())))
 
-        if labels_key not in self.counters:
-            self.counters[labels_key] = {}
-        if values_key not in self.counters[labels_key]:
-            self.counters[labels_key][values_key] = {'total': 0, 'labels': labels}
+        self.get_counter(labels).inc()
+
+    def instrument_stages(self, obj):
+        '''
+        measure durations of ingest stages (methods tagged with @stage)
+        of a class or an object, untagged methods are not affected
+        '''
 
-        self.counters[labels_key][values_key]['total'] += 1
+        cls = obj if isinstance(obj, type) else type(obj)
+        for name in dir(cls):
+            stage_name = getattr(getattr(cls, name, None), 'stage', None)
+            if stage_name is None:
+                continue
+            histogram = self.get_histogram({'stage': stage_name})
+            setattr(obj, name, timed(getattr(obj, name), histogram))
+            logger.debug("instrumented stage %s: %s.%s", stage_name, cls.__name__,
+                         name)
 
     class CustomCollector():
         def __init__(self, inner_metrics):
@@ -101,45 +112,162 @@ class PrometheusMetrics:
 
             # dump stored durations
             for labels_key, labels_data in self.metrics.durations.items():
-                for _, values_data in labels_data.items():  # unused values_key
-                    count = values_data['count']
-                    summ = values_data['sum']
-                    labels = values_data['labels']
-
-                    if labels_key not in families:
-                        label_keys = list(map(itemgetter(0), labels.items()))
-
-                        met = SummaryMetricFamily(EXPORTER_NAME + '_duration_seconds',
-                                                  'counter and duration of runs of '
-                                                  'function with labels ' +
-                                                  str(label_keys),
-                                                  labels=label_keys)
-                        families[labels_key] = met
-                    else:
-                        met = families[labels_key]
-
-                    label_values = list(map(itemgetter(1), labels.items()))
-                    met.add_metric(label_values, count, summ)
+                met = HistogramMetricFamily(EXPORTER_NAME + '_duration_seconds',
+                                            'histogram of duration of runs of '
+                                            'function with labels ' +
+                                            str(list(labels_key)),
+                                            labels=labels_key)
+                for values_key, histogram in labels_data.items():
+                    met.add_metric(values_key, histogram.get_cumulative_buckets(),
+                                   histogram.sum)
+                families['duration_' + ','.join(labels_key)] = met
 
             # dump stored counters
             for labels_key, labels_data in self.metrics.counters.items():
-                for _, values_data in labels_data.items():  # unused values_key
-                    total = values_data['total']
-                    labels = values_data['labels']
-
-                    if labels_key not in families:
-                        label_keys = list(map(itemgetter(0), labels.items()))
-
-                        met = CounterMetricFamily(EXPORTER_NAME + '_count_total',
-                                                  'counter of something with labels ' +
-                                                  str(label_keys),
-                                                  labels=label_keys)
-                        families[labels_key] = met
-                    else:
-                        met = families[labels_key]
-
-                    label_values = list(map(itemgetter(1), labels.items()))
-                    met.add_metric(label_values, total)
+                met = CounterMetricFamily(EXPORTER_NAME + '_count_total',
+                                          'counter of something with labels ' +
+                                          str(list(labels_key)),
+                                          labels=labels_key)
+                for values_key, counter in labels_data.items():
+                    met.add_metric(values_key, counter.total)
+                families['counts_' + ','.join(labels_key)] = met
+
+            # dump actuator outboxes
+            outboxes = self.metrics.sensors.outboxes
+            if outboxes is not None and outboxes.gateways:
+                depth = GaugeMetricFamily(EXPORTER_NAME + '_outbox_depth',
+                                          'number of actuator values waiting '
+                                          'for delivery to a gateway',
+                                          labels=['gateway'])
+                sent = CounterMetricFamily(EXPORTER_NAME + '_outbox_sent_total',
+                                           'acknowledged actuator responses',
+                                           labels=['gateway'])
+                retries = CounterMetricFamily(EXPORTER_NAME + '_outbox_retries_total',
+                                              'actuator response delivery retries',
+                                              labels=['gateway'])
+                dropped = CounterMetricFamily(EXPORTER_NAME + '_outbox_dropped_total',
+                                              'actuator values dropped from a full '
+                                              'outbox',
+                                              labels=['gateway'])
+                ack = SummaryMetricFamily(EXPORTER_NAME + '_outbox_ack_seconds',
+                                          'latency of actuator response '
+                                          'acknowledgements',
+                                          labels=['gateway'])
+                for gw, outbox in outboxes.gateways.items():
+                    depth.add_metric([gw], outbox.size)
+                    sent.add_metric([gw], outbox.sent_total)
+                    retries.add_metric([gw], outbox.retries_total)
+                    dropped.add_metric([gw], outbox.dropped_total)
+                    ack.add_metric([gw], outbox.ack_count, outbox.ack_sum)
+                families['outbox_depth'] = depth
+                families['outbox_sent'] = sent
+                families['outbox_retries'] = retries
+                families['outbox_dropped'] = dropped
+                families['outbox_ack'] = ack
+
+            # dump ingest queues
+            ingest = self.metrics.sensors.ingest
+            if ingest is not None:
+                depth = GaugeMetricFamily(EXPORTER_NAME + '_ingest_queue_depth',
+                                          'number of received values waiting to be set',
+                                          labels=['priority'])
+                accepted = CounterMetricFamily(EXPORTER_NAME + '_ingest_accepted_total',
+                                               'received values accepted to a queue',
+                                               labels=['priority'])
+                coalesced = CounterMetricFamily(
+                    EXPORTER_NAME + '_ingest_coalesced_total',
+                    'queued values replaced by a newer value of the same sensor',
+                    labels=['priority'])
+                dropped = CounterMetricFamily(EXPORTER_NAME + '_ingest_dropped_total',
+                                              'received values rejected by a full queue',
+                                              labels=['priority'])
+                for priority, name in PRIORITIES.items():
+                    depth.add_metric([name], ingest.get_depth(priority))
+                    accepted.add_metric([name], ingest.accepted_total[priority])
+                    coalesced.add_metric([name], ingest.coalesced_total[priority])
+                    dropped.add_metric([name], ingest.dropped_total[priority])
+                families['ingest_depth'] = depth
+                families['ingest_accepted'] = accepted
+                families['ingest_coalesced'] = coalesced
+                families['ingest_dropped'] = dropped
+                families['ingest_batches'] = CounterMetricFamily(
+                    EXPORTER_NAME + '_ingest_batches_total',
+                    'batches of queued values applied',
+                    value=ingest.batches_total)
+
+            # dump cluster replication
+            cluster = self.metrics.sensors.cluster
+            if cluster is not None:
+                peers = GaugeMetricFamily(EXPORTER_NAME + '_cluster_peer_connected',
+                                          'cluster peer connected to this node',
+                                          labels=['peer'])
+                for peer in cluster.peers:
+                    peers.add_metric([peer.url], int(peer.connected))
+                leader = GaugeMetricFamily(EXPORTER_NAME + '_cluster_leader',
+                                           'gateways led by this node',
+                                           labels=['gateway'])
+                for gw in cluster.led:
+                    leader.add_metric([gw], 1)
+                families['cluster_peer'] = peers
+                families['cluster_leader'] = leader
+                families['cluster_log_seq'] = GaugeMetricFamily(
+                    EXPORTER_NAME + '_cluster_log_seq',
+                    'sequence number of the last replication log entry',
+                    value=cluster.seq)
+                families['cluster_applied'] = CounterMetricFamily(
+                    EXPORTER_NAME + '_cluster_applied_total',
+                    'values replicated from peers and applied',
+                    value=cluster.applied_total)
+                families['cluster_stale'] = CounterMetricFamily(
+                    EXPORTER_NAME + '_cluster_stale_total',
+                    'values replicated from peers older than the known version',
+                    value=cluster.stale_total)
+
+            # dump live Socket.IO connections
+            sio_server = getattr(self.metrics.sensors.sio, 'server', None)
+            if sio_server is not None:
+                connections = GaugeMetricFamily(EXPORTER_NAME + '_socketio_connections',
+                                                'connected Socket.IO clients',
+                                                labels=['namespace'])
+                room_clients = GaugeMetricFamily(
+                    EXPORTER_NAME + '_socketio_room_clients',
+                    'Socket.IO clients joined in a room (gateway)',
+                    labels=['namespace', 'room'])
+                namespaces = dict.fromkeys(sio_server.namespace_handlers)
+                namespaces.update(dict.fromkeys(sio_server.manager.rooms))
+                for namespace in namespaces:
+                    rooms = sio_server.manager.rooms.get(namespace, {})
+                    sids = rooms.get(None, {})
+                    connections.add_metric([namespace], len(sids))
+                    for room, members in list(rooms.items()):
+                        if room is not None and room not in sids:  # not a sid room
+                            room_clients.add_metric([namespace, str(room)], len(members))
+                families['socketio_connections'] = connections
+                families['socketio_room_clients'] = room_clients
+
+                # dump bus of Socket.IO front ends
+                manager = sio_server.manager
+                if hasattr(manager, 'published_total'):
+                    families['bus_published'] = CounterMetricFamily(
+                        EXPORTER_NAME + '_bus_published_total',
+                        'messages (emits, forwarded messages) published to the bus',
+                        value=manager.published_total)
+                    families['bus_received'] = CounterMetricFamily(
+                        EXPORTER_NAME + '_bus_received_total',
+                        'messages received from the bus',
+                        value=manager.received_total)
+
+            # dump memory usage of sensor histories
+            history_info = self.metrics.sensors.get_history_info()
+            if history_info['sensors']:
+                families['history_bytes'] = GaugeMetricFamily(
+                    EXPORTER_NAME + '_history_bytes',
+                    'memory used by sensor histories',
+                    value=history_info['bytes'])
+                families['history_samples'] = GaugeMetricFamily(
+                    EXPORTER_NAME + '_history_samples',
+                    'number of samples stored in sensor histories',
+                    value=history_info['samples'])
 
             # dump laporte sensors
             for sensor in self.metrics.sensors.sensor_index:
@@ -147,7 +275,8 @@ class PrometheusMetrics:
                     continue
 
                 for (name, metric_type, value, labels, labels_data,
-                     prefix) in sensor.get_promexport_data():
+                     prefix) in sensor.get_promexport_data(
+                         eval_metrics=self.metrics.eval_metrics):
                     uniqname = name + '_' + '_'.join(labels)
                     if uniqname not in families:
                         if prefix is None:
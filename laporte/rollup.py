@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''incrementally maintained aggregates of sensor values across nodes'''
+
+import logging
+from fnmatch import fnmatchcase
+from heapq import heappush, heappop
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+FUNCTIONS = ('sum', 'avg', 'min', 'max', 'count')
+
+
+class Rollup():
+    '''
+    Aggregate (sum, avg, min, max or count) of values of member sensors
+    selected by node_id / sensor_id globs and export labels.
+
+    A member change is applied in O(1) (sum, avg, count) or O(log n)
+    (min, max - heaps with lazy deletion), members are never rescanned.
+    '''
+    def __init__(self, sensor, config, dirty):
+        '''
+        Create an empty rollup.
+
+            sensor (Sensor):
+                Sensor that stores the result.
+            config (dict):
+                function, node (glob), sensor (glob) and labels (dict) selector.
+            dirty (set):
+                Rollups with changed members are added to this set.
+        '''
+
+        self.sensor = sensor
+        self.function = config.get('function', 'avg')
+        if self.function not in FUNCTIONS:
+            raise ValueError('unknown aggregate function {}'.format(self.function))
+        self.node_glob = str(config.get('node', '*'))
+        self.sensor_glob = str(config.get('sensor', '*'))
+        self.labels = config.get('labels', {})
+        self.dirty = dirty
+
+        self.values = {}  # member sensor -> value
+        self.seqs = {}  # member sensor -> seq of its heap entries
+        self.seq = 0
+        self.sum = 0.0
+        self.min_heap = []
+        self.max_heap = []
+
+    def matches(self, sensor):
+        '''return True if the sensor is selected as a member'''
+
+        if sensor is self.sensor or sensor.aggregate is not None:
+            return False
+        if not isinstance(sensor.node_id, str):
+            return False  # template
+        if not fnmatchcase(sensor.node_id, self.node_glob):
+            return False
+        if not fnmatchcase(sensor.sensor_id, self.sensor_glob):
+            return False
+        for label, label_value in self.labels.items():
+            if sensor.export_labels.get(label) != label_value:
+                return False
+        return True
+
+    def add_member(self, sensor):
+        if sensor.rollups is None:
+            sensor.rollups = []
+        sensor.rollups.append(self)
+        self.update(sensor, sensor.value)
+        logger.debug("rollup %s.%s: add member %s.%s", self.sensor.node_id,
+                     self.sensor.sensor_id, sensor.node_id, sensor.sensor_id)
+
+    def update(self, member, value):
+        '''apply a new value of a member'''
+
+        if isinstance(value, str):
+            value = None
+
+        old = self.values.pop(member, None)
+        if old is not None:
+            self.sum -= old
+
+        if value is not None:
+            self.values[member] = value
+            self.sum += value
+            if self.function in ('min', 'max'):
+                self.seq += 1
+                self.seqs[member] = self.seq
+                heap = self.min_heap if self.function == 'min' else self.max_heap
+                heappush(heap, (value if self.function == 'min' else -value, self.seq,
+                                member))
+                self.__compact(heap)
+
+        if not self.values:
+            self.sum = 0.0  # drop accumulated rounding errors
+
+        self.dirty.add(self)
+
+    def __is_valid(self, entry):
+        '''heap entry is valid if it is the latest entry of a current member'''
+
+        _, seq, member = entry
+        return member in self.values and self.seqs.get(member) == seq
+
+    def __compact(self, heap):
+        '''rebuild heap if there are too many stale entries'''
+
+        if len(heap) > 2 * len(self.values) + 16:
+            valid = [entry for entry in heap if self.__is_valid(entry)]
+            heap[:] = []
+            for entry in valid:
+                heappush(heap, entry)
+
+    def __get_top(self, heap):
+        while heap and not self.__is_valid(heap[0]):
+            heappop(heap)
+        return heap[0][0] if heap else None
+
+    def get_result(self):
+        count = len(self.values)
+
+        if self.function == 'count':
+            return count
+        if self.function == 'sum':
+            return self.sum
+        if not count:
+            return None
+        if self.function == 'avg':
+            return self.sum / count
+        if self.function == 'min':
+            return self.__get_top(self.min_heap)
+        top = self.__get_top(self.max_heap)
+        return -top if top is not None else None
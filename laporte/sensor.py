@@ -3,15 +3,22 @@
 
 import logging
 import re
+import io
+from cProfile import Profile
+from pstats import Stats
 from copy import deepcopy
 from abc import ABC, abstractmethod
-from time import time
+from time import time, perf_counter
 from datetime import datetime
-from asteval import Interpreter, make_symbol_table
 from apscheduler.job import Job
+from laporte.instrument import stage
+from laporte.history import History
+from laporte.expression import compile_expression
+from laporte.coerce import to_number, to_binary, to_message
 
 # create logger
-logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 SENSOR = 1
 ACTUATOR = 2
@@ -21,10 +28,38 @@ COUNTER = 2
 BINARY = 3
 MESSAGE = 4
 
+# functions aggregating values received within a debounce window
+DEBOUNCE_AGGREGATES = ('last', 'mean', 'max', 'min')
+
+# internal references of a sensor, slots kept out of the instance dict
+# (not returned by get_data), None until set
+INTERNAL = (
+    'eval_expression',  # eval code compiled by compile_expression
+    'debounce_flushes',  # set of sensors waiting for a trailing edge flush
+    'rollups',
+    'dataset_group',  # group of required sensors of the eval
+    'dataset_groups',  # groups the sensor is a member of
+    'eval_profiler')
+
+# metrics of the sensor available in eval code
+EVAL_METRICS = {
+    'value', 'prev_value', 'hits_total', 'hit_timestamp', 'duration_seconds', 'history',
+    'increase', 'increase_total', 'rate', 'resets_total'
+}
+
 
 class Sensor(ABC):
     '''abstract base class for Gauge, Counter, Binary and Message class'''
 
+    __slots__ = ('__dict__', ) + INTERNAL
+
+    def __new__(cls, *args, **kwargs):
+        del args, kwargs  # Ignored parameters
+        self = super().__new__(cls)
+        for name in INTERNAL:
+            setattr(self, name, None)
+        return self
+
     # config attributes:
     node_addr = None
     key = None
@@ -37,18 +72,23 @@ class Sensor(ABC):
     debounce_hits = None
     debounce_dataset = None
     debounce_value = None
+    debounce_edge = None  # leading (default), trailing or both
+    debounce_aggregate = None  # last (default), mean, max or min
     ttl = None
     export_sensor_id = None
     export_node_id = None
     export_labels = None
     export_hidden = None
     export_prefix = None
+    export_rate = None
     eval_require = None
     eval_code = None
     eval_skip_expired = None
     eval_break_value = None
+    eval_dataset = None
     group = None  # not used
     cron = None
+    aggregate = None
     desc = None  # not used
     node_id = None
     gw = None
@@ -59,20 +99,46 @@ class Sensor(ABC):
     hits_total = None
     hit_timestamp = None
     duration_seconds = None
-    dataset_ready = None
-    dataset_used = None
     hold = None
     hit_timestamp = None
     duration_seconds = None
     hits_total = None
     debounce_hits_remaining = None
+    debounce_window_end = None
+    debounce_samples = 0
+    debounce_sample = None
     parent_export = None
     export = None
     ttl_job = None
     cron_jobs = None
-
-    def setup(self, sensor_id, node_addr, key, mode, default, debounce, ttl, export,
-              parent_export, pyeval, group, cron, desc, node_id, gw):
+    history = None
+
+    # eval profile attributes
+    eval_count = None
+    eval_seconds_total = None
+    eval_seconds_max = None
+    eval_errors_total = None
+    eval_no_result_total = None
+    eval_profile_samples = None
+
+    def setup(self,
+              sensor_id,
+              node_addr,
+              key,
+              mode,
+              default,
+              debounce,
+              ttl,
+              export,
+              parent_export,
+              pyeval,
+              group,
+              cron,
+              desc,
+              node_id,
+              gw,
+              history=None,
+              aggregate=None):
         '''assign values to the data members of the class'''
 
         self.node_addr = node_addr
@@ -92,6 +158,9 @@ class Sensor(ABC):
         self.__set_default(default)
         self.__set_debounce(debounce)
         self.__set_eval(pyeval)
+        self.__set_history(history)
+        if isinstance(aggregate, dict):
+            self.aggregate = aggregate
 
     def set_export(self, export, parent_export):
         '''set export related attributes  - labels and others'''
@@ -109,6 +178,9 @@ class Sensor(ABC):
             if 'prefix' in parent_export:
                 self.export_prefix = parent_export['prefix']
 
+            if 'rate' in parent_export:
+                self.export_rate = parent_export['rate']
+
             if 'labels' in parent_export:
                 for label, label_value in parent_export['labels'].items():
                     if isinstance(label_value, int):
@@ -125,6 +197,9 @@ class Sensor(ABC):
             if 'prefix' in export:
                 self.export_prefix = export['prefix']
 
+            if 'rate' in export:
+                self.export_rate = export['rate']
+
             if 'labels' in export:
                 for label, label_value in export['labels'].items():
                     if isinstance(label_value, int):
@@ -148,6 +223,53 @@ class Sensor(ABC):
                 self.debounce_dataset = debounce['dataset']
             if 'value' in debounce:
                 self.debounce_value = debounce['value']
+            if 'rate' in debounce:
+                # max rate of values per second
+                self.debounce_time = 1 / debounce['rate']
+            if 'edge' in debounce:
+                if debounce['edge'] not in ('leading', 'trailing', 'both'):
+                    raise ValueError('unknown debounce edge {}'.format(debounce['edge']))
+                self.debounce_edge = debounce['edge']
+            if 'aggregate' in debounce:
+                if debounce['aggregate'] not in DEBOUNCE_AGGREGATES:
+                    raise ValueError('unknown debounce aggregate {}'.format(
+                        debounce['aggregate']))
+                self.debounce_aggregate = debounce['aggregate']
+
+    def has_trailing_edge(self):
+        return bool(self.debounce_time) and self.debounce_edge in ('trailing', 'both')
+
+    def __add_debounce_sample(self, value):
+        '''aggregate a value received within a debounce window'''
+
+        if not self.debounce_samples and self.debounce_flushes is not None:
+            self.debounce_flushes.add(self)
+
+        self.debounce_samples += 1
+        aggregate = self.debounce_aggregate
+        if (self.debounce_samples == 1 or aggregate in (None, 'last')
+                or not isinstance(value, (int, float))
+                or not isinstance(self.debounce_sample, (int, float))):
+            self.debounce_sample = value
+        elif aggregate == 'mean':
+            self.debounce_sample += value  # sum until pop
+        elif aggregate == 'max':
+            self.debounce_sample = max(self.debounce_sample, value)
+        elif aggregate == 'min':
+            self.debounce_sample = min(self.debounce_sample, value)
+
+    def pop_debounce_value(self):
+        '''return the aggregated value of a debounce window (None if empty)'''
+
+        if not self.debounce_samples:
+            return None
+
+        value = self.debounce_sample
+        if self.debounce_aggregate == 'mean' and isinstance(value, (int, float)):
+            value = value / self.debounce_samples
+        self.debounce_samples = 0
+        self.debounce_sample = None
+        return value
 
     def __set_default(self, default):
         '''set default config related attributes'''
@@ -170,6 +292,18 @@ class Sensor(ABC):
                 self.eval_skip_expired = pyeval['skip_expired']
             if 'break_value' in pyeval:
                 self.eval_break_value = pyeval['break_value']
+            if 'dataset' in pyeval:
+                self.eval_dataset = pyeval['dataset']
+
+            # fast path for simple expressions
+            names = EVAL_METRICS | {'origin'} | set(self.eval_require or {})
+            self.eval_expression = compile_expression(self.eval_code, names)
+
+    def __set_history(self, history):
+        '''set history related attributes'''
+
+        if isinstance(history, dict) and 'size' in history:
+            self.history = History(history['size'])
 
     def clone(self, new_node_id):
         '''
@@ -197,34 +331,41 @@ class Sensor(ABC):
         return self.mode == ACTUATOR
 
     def get_data(self, skip_None=False, selected=None):
-        if selected is None:
-            # because {} is dangerous default value
-            selected = {}
-        z = {**self.__dict__, **{'type': self.get_type()}}
-        for key, value in z.items():
-            if (not selected) or (key in selected):
-                if key == 'cron_jobs':
-                    next_ts = None
-                    if isinstance(value, list):
-                        for item in value:
-                            if isinstance(item, Job) and hasattr(item, 'next_run_time'):
-                                ts = datetime.timestamp(item.next_run_time)
-                                if not isinstance(next_ts, float):
-                                    next_ts = ts
-                                elif ts < next_ts:
-                                    next_ts = ts
-                    key = 'cron_timestamp'
-                    value = next_ts
-                if key == 'ttl_job':
-                    next_ts = None
-                    if isinstance(value, Job) and hasattr(value, 'next_run_time'):
-                        next_ts = datetime.timestamp(value.next_run_time)
-                    key = 'exp_timestamp'
-                    value = next_ts
-                if not (value is None and skip_None):
-                    yield key, value
-
-    def get_promexport_data(self):
+        data = self.__dict__
+        if selected:
+            keys = [key for key in selected if key in data]
+        else:
+            keys = list(data)
+
+        for key in keys:
+            value = data[key]
+            if key == 'cron_jobs':
+                next_ts = None
+                if isinstance(value, list):
+                    for item in value:
+                        if isinstance(item, Job) and hasattr(item, 'next_run_time'):
+                            ts = datetime.timestamp(item.next_run_time)
+                            if not isinstance(next_ts, float):
+                                next_ts = ts
+                            elif ts < next_ts:
+                                next_ts = ts
+                key = 'cron_timestamp'
+                value = next_ts
+            elif key == 'history' and value is not None and not selected:
+                value = value.get_info()
+            elif key == 'ttl_job':
+                next_ts = None
+                if isinstance(value, Job) and hasattr(value, 'next_run_time'):
+                    next_ts = datetime.timestamp(value.next_run_time)
+                key = 'exp_timestamp'
+                value = next_ts
+            if not (value is None and skip_None):
+                yield key, value
+
+        if not selected or 'type' in selected:
+            yield 'type', self.get_type()
+
+    def get_promexport_data(self, eval_metrics=False):
         t = self.get_type()
         labels = []
         label_values = []
@@ -245,19 +386,42 @@ class Sensor(ABC):
                 'node', 'sensor'
             ] + labels, [self.export_node_id, self.export_sensor_id
                          ] + label_values, self.export_prefix
+        if eval_metrics and self.eval_count:
+            for name, metric_type, value in (
+                ('eval_total', COUNTER, self.eval_count),
+                ('eval_seconds_total', COUNTER, self.eval_seconds_total),
+                ('eval_seconds_max', GAUGE, self.eval_seconds_max),
+                ('eval_errors_total', COUNTER, self.eval_errors_total),
+                ('eval_no_result_total', COUNTER, self.eval_no_result_total),
+            ):
+                yield name, metric_type, value, ['node', 'sensor'] + labels, [
+                    self.export_node_id, self.export_sensor_id
+                ] + label_values, self.export_prefix
+
+    def notify_rollups(self):
+        '''apply the current value to rollups this sensor is a member of'''
+
+        for rollup in self.rollups:
+            rollup.update(self, self.value)
 
     def sensor_reset(self):
         changed = False
         if self.value != self.default_value:
             self.value = self.default_value
             changed = True
+            if self.rollups:
+                self.notify_rollups()
 
-        self.dataset_ready = False
-        self.dataset_used = False
+        if self.dataset_groups:
+            for group in self.dataset_groups:
+                group.discard(self)
         self.debounce_hits_remaining = 0
+        self.debounce_window_end = None
+        self.debounce_samples = 0
+        self.debounce_sample = None
         if isinstance(self.ttl_job, Job):
-            logging.debug("scheduler: remove TTL job for %s.%s", self.node_id,
-                          self.sensor_id)
+            logger.debug("scheduler: remove TTL job for %s.%s", self.node_id,
+                         self.sensor_id)
             self.ttl_job.remove()
             self.ttl_job = None
         return changed
@@ -266,9 +430,8 @@ class Sensor(ABC):
     def reset(self):
         pass
 
-    @abstractmethod
-    def fix_value(self, value):
-        pass
+    # converter of received values chosen by the sensor type
+    fix_value = None
 
     def count_hit(self):
         if self.hits_total is None:
@@ -281,34 +444,51 @@ class Sensor(ABC):
             self.duration_seconds = timestamp - self.hit_timestamp
         self.hit_timestamp = timestamp
 
-    def set(self, value, update=True, increment=False):
+    @stage('set')
+    def set(self, value, update=True, increment=False, flush=False):
 
         if self.hold:
             return False
 
-        value = self.fix_value(value)
-
         if (value is not None) and (value == self.debounce_value):
-            logging.debug("debounce: skip value %s", value)
+            logger.debug("debounce: skip value %s", value)
             return False
 
         if (value == self.value) and self.debounce_changed:
-            logging.debug("debounce: value not changed")
+            logger.debug("debounce: value not changed")
             return False
 
-        if self.debounce_time and isinstance(self.hit_timestamp, float):
+        if self.debounce_time and not flush:
             timestamp = time()
-            if timestamp < self.hit_timestamp + self.debounce_time:
-                logging.debug("debounce: time %fs remaining",
-                              self.hit_timestamp + self.debounce_time - timestamp)
+            if self.debounce_edge in (None, 'leading'):
+                if isinstance(self.hit_timestamp,
+                              float) and timestamp < self.hit_timestamp + self.debounce_time:
+                    logger.debug("debounce: time %fs remaining",
+                                 self.hit_timestamp + self.debounce_time - timestamp)
+                    return False
+            elif self.debounce_window_end is not None and timestamp < self.debounce_window_end:
+                logger.debug("debounce: value buffered, time %fs remaining",
+                             self.debounce_window_end - timestamp)
+                self.__add_debounce_sample(value)
+                return False
+            elif self.debounce_edge == 'trailing':
+                # the first value opens a window, it is applied at the end of the window
+                self.debounce_window_end = timestamp + self.debounce_time
+                self.__add_debounce_sample(value)
+                return False
+            else:
+                self.debounce_window_end = timestamp + self.debounce_time
+        elif flush and update and self.debounce_time:
+            # a trailing edge opens a new window
+            self.debounce_window_end = time() + self.debounce_time
+
+        if not flush:  # flushed values have passed the debounce already
+            if self.debounce_hits_remaining:
+                logger.debug("debounce: %d hits remaining", self.debounce_hits_remaining)
+                self.debounce_hits_remaining -= 1
                 return False
 
-        if self.debounce_hits_remaining:
-            logging.debug("debounce: %d hits remaining", self.debounce_hits_remaining)
-            self.debounce_hits_remaining -= 1
-            return False
-
-        self.debounce_hits_remaining = self.debounce_hits
+            self.debounce_hits_remaining = self.debounce_hits
 
         if (increment and self.value is not None):
             value += self.value
@@ -319,17 +499,36 @@ class Sensor(ABC):
         self.value = value
 
         if update:  # update metadata
+            prev_timestamp = self.hit_timestamp
             self.count_hit()
+            if prev_timestamp is not None:
+                self.count_value(interval=self.hit_timestamp - prev_timestamp)
+            else:
+                self.count_value()
+        else:
+            self.count_value(update=False)
 
-            if self.debounce_dataset:
-                self.dataset_ready = True
+        if self.history is not None and isinstance(value, (int, float)):
+            if update:
+                self.history.append(self.hit_timestamp, value)
+            else:
+                self.history.replace_last(value)
+
+        if update:
+            if self.dataset_groups:
+                for group in self.dataset_groups:
+                    group.mark(self)
 
             if isinstance(self.ttl_job, Job) and (
                     self.value == self.default_value) and not self.default_return_ttl:
                 self.sensor_reset()
 
+        if self.rollups:
+            self.notify_rollups()
+
         return True
 
+    @stage('eval')
     def do_eval(self, vars_dict=None, origin_list=None, update=True):
 
         # because {} is dangerous default value
@@ -348,43 +547,92 @@ class Sensor(ABC):
             def write(self, *_):
                 pass
 
-        syms = make_symbol_table(
-            use_numpy=True,
+        start_t = perf_counter()
+        symbols = {
             **vars_dict,
             **{"origin": origin_list},
-            **dict(
-                self.get_data(selected={
-                    'value', 'prev_value', 'hits_total', 'hit_timestamp',
-                    'duration_seconds'
-                })),
-            re=re)
+            **dict(self.get_data(selected=EVAL_METRICS)), 're': re
+        }
 
-        aeval = Interpreter(writer=Devnull(), err_writer=Devnull(), symtable=syms)
+        if self.eval_expression is not None:
+            func, args = self.eval_expression.eval, (symbols, )
+        else:
+            # imported here - asteval imports numpy, load it only if an eval needs it
+            # pylint: disable=import-outside-toplevel
+            from asteval import Interpreter, make_symbol_table
+            syms = make_symbol_table(use_numpy=True, **symbols)
+            aeval = Interpreter(writer=Devnull(), err_writer=Devnull(), symtable=syms)
+            func, args = aeval.eval, (self.eval_code, )
+
+        if self.eval_profile_samples:
+            result = self.eval_profiler.runcall(func, *args)
+            self.eval_profile_samples -= 1
+        else:
+            result = func(*args)
 
-        result = aeval.eval(self.eval_code)
+        if self.eval_expression is not None:
+            result, error = result
+            errors = [error] if error is not None else []
+        else:
+            errors = [err.get_error() for err in aeval.error]
+
+        self.count_eval(perf_counter() - start_t)
 
         if result is not None:
-            logging.info("eval %s.%s: OK, result = %s", self.node_id, self.sensor_id,
+            logger.debug("eval %s.%s: OK, result = %s", self.node_id, self.sensor_id,
                          result)
-            return self.set(result, update=update)
-
-        if len(aeval.error) > 0:
-            logging.error("eval %s.%s: ERROR", self.node_id, self.sensor_id)
-            for err in aeval.error:
-                logging.error(err.get_error())
+            # a correction of an applied value is not debounced again
+            return self.set(self.fix_value(result), update=update, flush=not update)
+
+        if len(errors) > 0:
+            self.eval_errors_total += 1
+            logger.error("eval %s.%s: ERROR", self.node_id, self.sensor_id)
+            for err in errors:
+                logger.error(err)
         else:
-            logging.debug("eval %s.%s: no result", self.node_id, self.sensor_id)
+            self.eval_no_result_total += 1
+            logger.debug("eval %s.%s: no result", self.node_id, self.sensor_id)
 
         return False
 
-    def dataset_use(self):
-        if self.debounce_dataset:
-            self.dataset_used = True
+    def count_eval(self, duration):
+        '''update eval profile attributes'''
 
-    def dataset_reset(self):
-        if self.debounce_dataset:
-            self.dataset_ready = False
-            self.dataset_used = False
+        if self.eval_count is None:
+            self.eval_count = 0
+            self.eval_seconds_total = 0.0
+            self.eval_seconds_max = 0.0
+            self.eval_errors_total = 0
+            self.eval_no_result_total = 0
+
+        self.eval_count += 1
+        self.eval_seconds_total += duration
+        if duration > self.eval_seconds_max:
+            self.eval_seconds_max = duration
+
+    def capture_eval_profile(self, samples):
+        '''run next evals (samples) under cProfile'''
+
+        self.eval_profiler = Profile()
+        self.eval_profile_samples = samples
+
+    def get_eval_profile(self, lines=20):
+        '''return cProfile stats of captured evals as text'''
+
+        if self.eval_profiler is None:
+            return None
+
+        stream = io.StringIO()
+        try:
+            stats = Stats(self.eval_profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(lines)
+        except TypeError:
+            # nothing captured yet
+            return None
+        return stream.getvalue()
+
+    def count_value(self, update=True, interval=None):
+        '''update state derived from value changes (nothing by default)'''
 
     def set_hold(self, release=False):
         self.hold = not release
@@ -401,10 +649,7 @@ class Gauge(Sensor):
     def reset(self):
         return self.sensor_reset()
 
-    def fix_value(self, value):
-        if isinstance(value, str):
-            value = float(value)
-        return value
+    fix_value = staticmethod(to_number)
 
     def __init__(self,
                  sensor_id=None,
@@ -421,7 +666,9 @@ class Gauge(Sensor):
                  cron=None,
                  desc=None,
                  node_id=None,
-                 gw=None):
+                 gw=None,
+                 history=None,
+                 aggregate=None):
 
         self.export_hidden = False
         self.default_value = None
@@ -429,7 +676,8 @@ class Gauge(Sensor):
         self.eval_skip_expired = True
 
         self.setup(sensor_id, node_addr, key, mode, default, debounce, ttl, export,
-                   parent_export, pyeval, group, cron, desc, node_id, gw)
+                   parent_export, pyeval, group, cron, desc, node_id, gw, history,
+                   aggregate)
 
         self.hits_total = 0
         self.reset()
@@ -439,17 +687,73 @@ class Counter(Sensor):
     '''An object that collects state and metadata of the Counter type sensor.
        A counter is a cumulative metric that represents a single monotonically
        increasing counter whose value can only increase or be reset to zero.
+       Counter keeps reset-aware increase and rate (per second) of its value.
     '''
+
+    # state attributes
+    increase = None
+    increase_total = None
+    rate = None
+    resets_total = None
+    counter_reset = None
+    counter_interval = None
+
     def get_type(self):
         return COUNTER
 
     def reset(self):
+        self.increase = None
+        self.rate = None
         return self.sensor_reset()
 
-    def fix_value(self, value):
-        if isinstance(value, str):
-            value = float(value)
-        return value
+    def count_value(self, update=True, interval=None):
+        '''update reset-aware increase and rate of the counter'''
+
+        if update:
+            self.counter_interval = interval
+        elif self.increase is not None:
+            # value was corrected by eval, replace the last increase
+            self.increase_total -= self.increase
+            if self.counter_reset:
+                self.resets_total -= 1
+
+        if not isinstance(self.value, (int, float)) or not isinstance(
+                self.prev_value, (int, float)):
+            self.increase = None
+            self.rate = None
+            return
+
+        self.counter_reset = self.value < self.prev_value
+        if self.counter_reset:
+            # counter was reset, count from zero
+            self.increase = self.value
+            self.resets_total += 1
+        else:
+            self.increase = self.value - self.prev_value
+        self.increase_total += self.increase
+
+        if self.counter_interval:
+            self.rate = self.increase / self.counter_interval
+
+    def get_promexport_data(self, eval_metrics=False):
+        yield from super().get_promexport_data(eval_metrics=eval_metrics)
+
+        if not self.export_rate:
+            return
+
+        labels = ['node'] + list(self.export_labels)
+        label_values = [self.export_node_id] + list(self.export_labels.values())
+
+        for suffix, metric_type, value in (
+            ('_increase_total', COUNTER, self.increase_total),
+            ('_resets_total', COUNTER, self.resets_total),
+            ('_rate', GAUGE, self.rate),
+        ):
+            if value is not None:
+                yield (self.export_sensor_id + suffix, metric_type, value, labels,
+                       label_values, self.export_prefix)
+
+    fix_value = staticmethod(to_number)
 
     def __init__(self,
                  sensor_id=None,
@@ -466,7 +770,9 @@ class Counter(Sensor):
                  cron=None,
                  desc=None,
                  node_id=None,
-                 gw=None):
+                 gw=None,
+                 history=None,
+                 aggregate=None):
 
         self.export_hidden = False
         self.default_value = None
@@ -474,9 +780,12 @@ class Counter(Sensor):
         self.eval_skip_expired = True
 
         self.setup(sensor_id, node_addr, key, mode, default, debounce, ttl, export,
-                   parent_export, pyeval, group, cron, desc, node_id, gw)
+                   parent_export, pyeval, group, cron, desc, node_id, gw, history,
+                   aggregate)
 
         self.hits_total = 0
+        self.increase_total = 0.0
+        self.resets_total = 0
         self.reset()
 
 
@@ -492,35 +801,7 @@ class Binary(Sensor):
         self.count_hit()
         return self.sensor_reset()
 
-    def fix_value(self, value):
-        values_map = {
-            'True': True,
-            'true': True,
-            'ON': True,
-            'On': True,
-            'on': True,
-            'OK': True,
-            'Yes': True,
-            'yes': True,
-            '1': True,
-            'False': False,
-            'false': False,
-            'OFF': False,
-            'Off': False,
-            'off': False,
-            'LOW': False,
-            'No': False,
-            'no': False,
-            '0': False
-        }
-
-        if isinstance(value, str):
-            try:
-                value = values_map[value]
-            except KeyError:
-                value = bool(value)
-
-        return value
+    fix_value = staticmethod(to_binary)
 
     def __init__(self,
                  sensor_id=None,
@@ -537,7 +818,9 @@ class Binary(Sensor):
                  cron=None,
                  desc=None,
                  node_id=None,
-                 gw=None):
+                 gw=None,
+                 history=None,
+                 aggregate=None):
 
         self.export_hidden = False
         self.default_value = False
@@ -545,12 +828,11 @@ class Binary(Sensor):
         self.eval_skip_expired = False
 
         self.setup(sensor_id, node_addr, key, mode, default, debounce, ttl, export,
-                   parent_export, pyeval, group, cron, desc, node_id, gw)
+                   parent_export, pyeval, group, cron, desc, node_id, gw, history,
+                   aggregate)
 
         self.value = self.default_value
         self.prev_value = self.default_value
-        self.dataset_ready = False
-        self.dataset_used = False
         self.debounce_hits_remaining = 0
         self.hits_total = 0
 
@@ -566,8 +848,7 @@ class Message(Sensor):
     def reset(self):
         return self.sensor_reset()
 
-    def fix_value(self, value):
-        return value
+    fix_value = staticmethod(to_message)
 
     def __init__(self,
                  sensor_id=None,
@@ -584,7 +865,9 @@ class Message(Sensor):
                  cron=None,
                  desc=None,
                  node_id=None,
-                 gw=None):
+                 gw=None,
+                 history=None,
+                 aggregate=None):
 
         self.export_hidden = True
         self.default_value = ""
@@ -592,7 +875,8 @@ class Message(Sensor):
         self.eval_skip_expired = True
 
         self.setup(sensor_id, node_addr, key, mode, default, debounce, ttl, export,
-                   parent_export, pyeval, group, cron, desc, node_id, gw)
+                   parent_export, pyeval, group, cron, desc, node_id, gw, history,
+                   aggregate)
 
         self.hits_total = 0
         self.reset()
@@ -3,25 +3,31 @@
 
 import logging
 import json
+from time import time
 from datetime import datetime, timedelta
 from jinja2 import (Environment, FileSystemLoader, TemplateSyntaxError, TemplateNotFound)
 from yaml import safe_load, YAMLError
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.cron import CronTrigger
 from laporte.version import __version__
+from laporte.instrument import stage
 from laporte.sensor import Gauge, Counter, Binary, Message
+from laporte.rollup import Rollup
+from laporte.index import SensorIndex
+from laporte.dataset import DatasetGroup
 from laporte.sensor import SENSOR, ACTUATOR, GAUGE, COUNTER, BINARY
 
 # create logger
-logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 METRICS_NAMESPACE = '/metrics'
 EVENTS_NAMESPACE = '/events'
 
-METRICS = {
-    'value', 'hits_total', 'hit_timestamp', 'duration_seconds', 'ttl_job', 'cron_jobs'
-}
-SETUP = {'sensor_id', 'node_id', 'mode', 'node_addr', 'key'}
+# attributes returned by get_data (ordered)
+METRICS = ('value', 'hits_total', 'hit_timestamp', 'duration_seconds', 'ttl_job',
+           'cron_jobs', 'increase_total', 'rate')
+SETUP = ('sensor_id', 'node_id', 'mode', 'node_addr', 'key')
 
 
 class Sensors():
@@ -31,11 +37,28 @@ class Sensors():
         self.node_template_index = {}
         self.sensor_template_index = {}
         self.sensor_index = []
+        self.index = SensorIndex()
+        self.rollups = []
+        self.dirty_rollups = set()
+        self.cron_groups = {}
+        self.requiring_index = {}  # (node_id, sensor_id) -> sensors requiring it
+        self.gw_cache = {}  # gw -> (config of sensors, actuators)
+        self.dataset_groups = []
+        self.dataset_waiting = {}  # (node_id, sensor_id) -> groups waiting for it
+        self.started_datasets = set()
+        self.used_datasets = set()
+        self.debounce_flushes = set()
+        self.applied_values = []  # (sensor, value) set in this batch, for the cluster
 
     def __init__(self):
         self.reset()
         self.sio = None
         self.scheduler = None
+        self.outboxes = None
+        self.ingest = None
+        self.cluster = None
+        self.shm = None
+        self.timers = None
         self.prev_data = {}
 
     def __add_sensor(self,
@@ -56,7 +79,10 @@ class Sensors():
             'mode': mode
         }
 
-        for p in ['default', 'debounce', 'ttl', 'eval', 'group', 'desc', 'cron', 'key']:
+        for p in [
+                'default', 'debounce', 'ttl', 'eval', 'group', 'desc', 'cron', 'key',
+                'history', 'aggregate'
+        ]:
             if p in sensor_parent_config_dict:
                 # note: only ttl should pass now
                 param[p] = sensor_parent_config_dict[p]
@@ -91,13 +117,24 @@ class Sensors():
             sensor = Gauge(**param)
 
         if not template:
-            self.sensor_index.append(sensor)
-            self.node_id_index[node_id][sensor_id] = sensor
-            self.__add_cron_jobs(sensor)
+            self.__register_sensor(sensor)
         else:
             self.node_template_index[node_id][sensor_id] = sensor
             self.sensor_template_index[sensor_id] = node_id
 
+    def __register_sensor(self, sensor):
+        '''add a configured or cloned sensor to indexes, cron jobs and rollups'''
+
+        self.sensor_index.append(sensor)
+        self.node_id_index[sensor.node_id][sensor.sensor_id] = sensor
+        self.index.add(sensor)
+        self.gw_cache.pop(sensor.gw, None)
+        if sensor.has_trailing_edge():
+            sensor.debounce_flushes = self.debounce_flushes
+        self.__add_requirements(sensor)
+        self.__add_cron_jobs(sensor)
+        self.__add_rollups(sensor)
+
     def __add_node(self, node_id, gw, node_config_dict, template=False):
         '''set up node and its sensors'''
 
@@ -141,29 +178,139 @@ class Sensors():
     def add_sensors(self, config_dict):
         for gw, gw_config_dict in config_dict.items():
             self.__add_gw(gw, gw_config_dict)
+        self.__update_rollups()
         self.prev_data = {}
 
+    def __add_rollups(self, sensor):
+        '''
+        set up a rollup if the sensor is an aggregate
+        or add the sensor to matching rollups
+        '''
+
+        if sensor.aggregate is not None:
+            rollup = Rollup(sensor, sensor.aggregate, self.dirty_rollups)
+            self.rollups.append(rollup)
+            self.dirty_rollups.add(rollup)
+            for member in self.sensor_index:
+                if rollup.matches(member):
+                    rollup.add_member(member)
+        else:
+            for rollup in self.rollups:
+                if rollup.matches(sensor):
+                    rollup.add_member(sensor)
+
+    def __update_rollups(self):
+        '''set values of rollups with changed members, return True if changed'''
+
+        changed = False
+        while self.dirty_rollups:
+            rollup = self.dirty_rollups.pop()
+            result = rollup.get_result()
+            if result != rollup.sensor.value and rollup.sensor.set(result):
+                changed = True
+                self.__propagate(rollup.sensor)
+        return changed
+
+    @staticmethod
+    def __get_required_keys(sensor):
+        '''yield var, node_id, sensor_id and metric_name required by eval of the sensor'''
+
+        if sensor.eval_require is not None:
+            for var, metric_list in sensor.eval_require.items():
+                if len(metric_list) == 3:
+                    (node_id, sensor_id, metric_name) = tuple(metric_list)
+                elif len(metric_list) == 2:
+                    (sensor_id, metric_name) = tuple(metric_list)
+                    node_id = sensor.node_id
+                else:
+                    raise ValueError('{}.{}: error in eval_require {}'.format(
+                        sensor.node_id, sensor.sensor_id, sensor.eval_require))
+                yield var, node_id, sensor_id, metric_name
+
+    def __add_requirements(self, sensor):
+        '''
+        index sensors required by eval of the sensor, set up its dataset group
+        and add the sensor to dataset groups waiting for it
+        '''
+
+        for waiting_sensor, explicit in self.dataset_waiting.pop(
+            (sensor.node_id, sensor.sensor_id), []):
+            self.__add_dataset_member(waiting_sensor, sensor, explicit)
+
+        dataset_vars = None
+        if isinstance(sensor.eval_dataset, dict) and 'vars' in sensor.eval_dataset:
+            dataset_vars = sensor.eval_dataset['vars']
+
+        try:
+            required_keys = list(self.__get_required_keys(sensor))
+        except ValueError as exc:
+            logger.error(exc)
+            return
+
+        for var, node_id, sensor_id, _ in required_keys:
+            key = (node_id, sensor_id)
+            if key not in self.requiring_index:
+                self.requiring_index[key] = {}
+            self.requiring_index[key][sensor] = None
+
+            if dataset_vars is None or var in dataset_vars:
+                explicit = dataset_vars is not None
+                member = self.node_id_index.get(node_id, {}).get(sensor_id)
+                if member is None:
+                    if key not in self.dataset_waiting:
+                        self.dataset_waiting[key] = []
+                    self.dataset_waiting[key].append((sensor, explicit))
+                else:
+                    self.__add_dataset_member(sensor, member, explicit)
+
+    def __add_dataset_member(self, sensor, member, explicit):
+        '''
+        add a required sensor to the dataset group of the sensor
+        if it is listed in eval dataset vars or has debounce dataset set
+        '''
+
+        if not (explicit or member.debounce_dataset):
+            return
+
+        if sensor.dataset_group is None:
+            timeout = None
+            if isinstance(sensor.eval_dataset, dict):
+                timeout = sensor.eval_dataset.get('timeout')
+            sensor.dataset_group = DatasetGroup(sensor, timeout, self.started_datasets)
+            self.dataset_groups.append(sensor.dataset_group)
+
+        sensor.dataset_group.add_member(member)
+
     def __add_cron_jobs(self, sensor):
         if isinstance(sensor.cron, dict):
             for cron_str, value in sensor.cron.items():
-                time = cron_str.split()
-                if len(time) == 6:
-                    (second, minute, hour, day, month, day_of_week) = time
-                elif len(time) == 5:
+                cron_time = cron_str.split()
+                if len(cron_time) == 6:
+                    (second, minute, hour, day, month, day_of_week) = cron_time
+                elif len(cron_time) == 5:
                     second = '0'
-                    (minute, hour, day, month, day_of_week) = time
+                    (minute, hour, day, month, day_of_week) = cron_time
                 else:
                     raise TypeError
 
-                job = self.scheduler.add_job(func=self.sensor_cron_trigger,
-                                             trigger=CronTrigger(month=month,
-                                                                 day=day,
-                                                                 day_of_week=day_of_week,
-                                                                 hour=hour,
-                                                                 minute=minute,
-                                                                 second=second),
-                                             args=[sensor, value])
-                logging.debug("scheduler: add %s", job)
+                # sensors with the same schedule share one job
+                fields = (second, minute, hour, day, month, day_of_week)
+                if fields not in self.cron_groups:
+                    members = []
+                    job = self.scheduler.add_job(func=self.cron_group_trigger,
+                                                 trigger=CronTrigger(
+                                                     month=month,
+                                                     day=day,
+                                                     day_of_week=day_of_week,
+                                                     hour=hour,
+                                                     minute=minute,
+                                                     second=second),
+                                                 args=[members])
+                    logger.debug("scheduler: add %s", job)
+                    self.cron_groups[fields] = (job, members)
+
+                job, members = self.cron_groups[fields]
+                members.append((sensor, value))
                 if not isinstance(sensor.cron_jobs, list):
                     sensor.cron_jobs = [job]
                 else:
@@ -175,10 +322,7 @@ class Sensors():
     def __find_addr(self, node_addr, key):
         '''return a sensor with given node_addr and key'''
 
-        for sensor in self.sensor_index:
-            if (sensor.node_addr == node_addr) and (sensor.key == key):
-                return sensor
-        return None
+        return self.index.find_addr(node_addr, key)
 
     def get_metrics_of_sensor(self, node_id, sensor_id):
         sensor = self.__get_sensor(node_id, sensor_id)
@@ -224,24 +368,148 @@ class Sensors():
                 ret[sensor_id][node_id] = data
         return ret
 
-    def get_sensors_dump_dict(self):
+    @staticmethod
+    def nest_sensors_dump(items):
+        '''convert (gw, node_id, sensor_id, data) items to a gw / node / sensor dict'''
+
         ret = {}
-        for sensor in self.sensor_index:
-            if sensor.gw not in ret:
-                ret[sensor.gw] = {}
+        for gw, node_id, sensor_id, data in items:
+            if gw not in ret:
+                ret[gw] = {}
 
-            if sensor.node_id not in ret[sensor.gw]:
-                ret[sensor.gw][sensor.node_id] = {}
+            if node_id not in ret[gw]:
+                ret[gw][node_id] = {}
 
-            ret[sensor.gw][sensor.node_id][sensor.sensor_id] = dict(sensor.get_data())
+            ret[gw][node_id][sensor_id] = data
         return ret
 
+    def get_sensors_dump_dict(self):
+        return self.nest_sensors_dump(self.get_sensors_dump_page()[0])
+
+    def get_page(self, cursor=None, limit=None, **conditions):
+        '''
+        Return a list of sensors of one page and a cursor of the next page
+        (None if it is the last page).
+
+        Sensors are ordered by registration and indexes are append-only
+        until a config reload, so a cursor (position of the first sensor
+        of a page) stays valid when new nodes are spawned from templates.
+        Conditions are the same as in SensorIndex.query.
+        '''
+
+        if any(value for value in conditions.values()):
+            sensors = self.index.query(**conditions)
+        else:
+            sensors = self.sensor_index
+
+        start = cursor or 0
+        end = len(sensors) if limit is None else start + limit
+        next_cursor = end if end < len(sensors) else None
+
+        return sensors[start:end], next_cursor
+
+    def get_metrics_page(self, cursor=None, limit=None, skip_None=True, **conditions):
+        '''
+        return a generator of (node_id, sensor_id, metrics) of one page
+        and a cursor of the next page
+        '''
+
+        page, next_cursor = self.get_page(cursor, limit, **conditions)
+        items = ((sensor.node_id, sensor.sensor_id,
+                  dict(sensor.get_data(skip_None=skip_None, selected=METRICS)))
+                 for sensor in page)
+        return items, next_cursor
+
+    def get_sensors_dump_page(self, cursor=None, limit=None):
+        '''
+        return a generator of (gw, node_id, sensor_id, data) of one page
+        and a cursor of the next page
+        '''
+
+        page, next_cursor = self.get_page(cursor, limit)
+        items = ((sensor.gw, sensor.node_id, sensor.sensor_id, dict(sensor.get_data()))
+                 for sensor in page)
+        return items, next_cursor
+
+    def __get_gw_cache(self, gw):
+        '''
+        return config of sensors and actuators of a gateway,
+        built on the first join after a config load or a new sensor of the gateway
+        '''
+
+        cache = self.gw_cache.get(gw)
+        if cache is None:
+            sensors = self.index.get_gw(gw)
+            cache = ([dict(sensor.get_data(skip_None=True, selected=SETUP))
+                      for sensor in sensors],
+                     [sensor for sensor in sensors if sensor.mode == ACTUATOR])
+            self.gw_cache[gw] = cache
+        return cache
+
     def get_config_of_gw(self, gw):
+        '''return a (shared, not to be modified) list of sensor configs of a gateway'''
+
+        return self.__get_gw_cache(gw)[0]
+
+    def get_actuators_of_gw(self, gw):
+        '''
+        return current state of actuators of a gateway
+        as {node_id:{sensor_id:value}} and {node_addr:{key:value}} dicts
+        '''
+
+        actuator_id_values = {}
+        actuator_addr_values = {}
+        for sensor in self.__get_gw_cache(gw)[1]:
+            self.__add_actuator_value(sensor, actuator_id_values, actuator_addr_values)
+        return actuator_id_values.get(gw, {}), actuator_addr_values.get(gw, {})
+
+    def get_history_info(self):
+        '''return number of sensors with history, stored samples and memory usage'''
+
+        ret = {'sensors': 0, 'samples': 0, 'bytes': 0}
         for sensor in self.sensor_index:
-            if sensor.gw == gw:
-                yield dict(sensor.get_data(skip_None=True, selected=SETUP))
+            if sensor.history is not None:
+                info = sensor.history.get_info()
+                ret['sensors'] += 1
+                ret['samples'] += info['samples']
+                ret['bytes'] += info['bytes']
+        return ret
+
+    def get_eval_profile(self, top=None):
+        '''
+        return eval profile of sensors with eval code,
+        sorted by total eval time (the most expensive first)
+        '''
+
+        evaluated = [sensor for sensor in self.sensor_index if sensor.eval_count]
+        evaluated.sort(key=lambda sensor: sensor.eval_seconds_total, reverse=True)
+
+        for sensor in evaluated[:top]:
+            yield {
+                'node_id': sensor.node_id,
+                'sensor_id': sensor.sensor_id,
+                'code': sensor.eval_code,
+                'count': sensor.eval_count,
+                'seconds_total': sensor.eval_seconds_total,
+                'seconds_avg': sensor.eval_seconds_total / sensor.eval_count,
+                'seconds_max': sensor.eval_seconds_max,
+                'errors_total': sensor.eval_errors_total,
+                'no_result_total': sensor.eval_no_result_total,
+                'profile_samples_remaining': sensor.eval_profile_samples,
+                'profile': sensor.get_eval_profile()
+            }
+
+    def capture_eval_profile(self, top, samples):
+        '''run next evals of top most expensive sensors under cProfile'''
+
+        ret = []
+        for item in self.get_eval_profile(top=top):
+            sensor = self.__get_sensor(item['node_id'], item['sensor_id'])
+            sensor.capture_eval_profile(samples)
+            ret.append((sensor.node_id, sensor.sensor_id))
+        return ret
 
-    def __get_changed_nodes_dict(self, first=None, second=None, level=0):
+    def __diff_dicts(self, first=None, second=None, level=0):
         changed = {}
 
         # because {} is dangerous default value
@@ -250,95 +518,80 @@ class Sensors():
         if second is None:
             second = {}
 
-        if level == 0:
-            first = self.prev_data
-            second = self.get_metrics_dict_by_node(skip_None=False)
-
         for key in first:
             if first[key] != second[key]:  # changed
                 if level < 2:
-                    changed[key] = self.__get_changed_nodes_dict(first=first[key],
-                                                                 second=second[key],
-                                                                 level=level + 1)
+                    changed[key] = self.__diff_dicts(first=first[key],
+                                                     second=second[key],
+                                                     level=level + 1)
                 else:
                     changed[key] = second[key]
 
         for key in second:
             if key not in first:  # added
                 if level < 2:
-                    changed[key] = self.__get_changed_nodes_dict(second=second[key],
-                                                                 level=level + 1)
+                    changed[key] = self.__diff_dicts(second=second[key], level=level + 1)
                 else:
                     changed[key] = second[key]
 
-        if level == 0:
-            self.prev_data = second
+        return changed
+
+    @stage('diff')
+    def __get_changed_nodes_dict(self):
+        '''return metrics changed since the previous call'''
+
+        second = self.get_metrics_dict_by_node(skip_None=False)
+        changed = self.__diff_dicts(first=self.prev_data, second=second)
+        self.prev_data = second
 
         return changed
 
     def __get_sensor_required_vars_dict(self, sensor):
         ret = {}
-        used_list = []
 
-        if sensor.eval_require is not None:
+        group = sensor.dataset_group
+        if group is not None and not group.is_complete():
+            logger.debug("skip eval %s.%s: dataset not complete (%d/%d)", sensor.node_id,
+                         sensor.sensor_id, len(group.ready), len(group.members))
+            return {}
+
+        try:
+            required_keys = list(self.__get_required_keys(sensor))
+        except ValueError as exc:
+            logger.error(exc)
+            return {}
+
+        for var, node_id, sensor_id, metric_name in required_keys:
             try:
-                for var, metric_list in sensor.eval_require.items():
-                    if len(metric_list) == 3:
-                        (node_id, sensor_id, metric_name) = tuple(metric_list)
-                    elif len(metric_list) == 2:
-                        (sensor_id, metric_name) = tuple(metric_list)
-                        node_id = sensor.node_id
-                    else:
-                        logging.error("%s.%s: error in eval_require %s", node_id,
-                                      sensor_id, sensor.eval_require)
-                        return {}
-
-                    search_sensor = self.__get_sensor(node_id, sensor_id)
-
-                    if search_sensor.debounce_dataset and not search_sensor.dataset_ready:
-                        logging.debug("skip eval %s.%s: not ready %s.%s in dataset",
-                                      sensor.node_id, sensor.sensor_id,
-                                      search_sensor.node_id, search_sensor.sensor_id)
-                        return {}
-
-                    value = next(search_sensor.get_data(selected={metric_name}))[1]
-
-                    if value is not None:
-                        ret[var] = value
-                        used_list.append(self.__get_sensor(node_id, sensor_id))
-                    else:
-                        return {}
+                search_sensor = self.__get_sensor(node_id, sensor_id)
+                value = next(search_sensor.get_data(selected={metric_name}))[1]
             except KeyError:
-                logging.debug("skip eval %s.%s: required sensor %s.%s not found",
-                              sensor.node_id, sensor.sensor_id, node_id, sensor_id)
+                logger.debug("skip eval %s.%s: required sensor %s.%s not found",
+                             sensor.node_id, sensor.sensor_id, node_id, sensor_id)
                 return {}
             except StopIteration:
-                logging.debug("skip eval %s.%s: required metric %s of %s.%s not found",
-                              sensor.node_id, sensor.sensor_id, metric_name, node_id,
-                              sensor_id)
+                logger.debug("skip eval %s.%s: required metric %s of %s.%s not found",
+                             sensor.node_id, sensor.sensor_id, metric_name, node_id,
+                             sensor_id)
+                return {}
+
+            if value is None:
                 return {}
+            ret[var] = value
 
-        for s in used_list:
-            s.dataset_use()
+        if group is not None:
+            self.used_datasets.add(group)
 
         return ret
 
     def __get_requiring_sensors(self, sensor):
-        x = set()
-
-        for s in self.sensor_index:
-            if s.eval_require is not None:
-                for _, metric_list in s.eval_require.items():
-                    if len(metric_list) == 3:
-                        (node_id, sensor_id,
-                         _) = tuple(metric_list)  # unused metric_name
-                    elif len(metric_list) == 2:
-                        (sensor_id, _) = tuple(metric_list)  # unused metric_name
-                        node_id = s.node_id
-
-                    if node_id == sensor.node_id and sensor_id == sensor.sensor_id and s not in x:
-                        x.add(s)
-                        yield s
+        return self.requiring_index.get((sensor.node_id, sensor.sensor_id), {})
+
+    @stage('propagate')
+    def __propagate(self, sensor):
+        '''eval sensors requiring the sensor (and sensors requiring them ...)'''
+
+        self.__do_requiring_eval(sensor)
 
     def __do_requiring_eval(self, sensor, level=0, origin_sensors=None):
         if (level < 8) and (sensor.value != sensor.eval_break_value):
@@ -359,57 +612,129 @@ class Sensors():
                                              origin_sensors=new_origin_sensors)
 
     def __used_dataset_reset(self):
-        for s in self.sensor_index:
-            if s.dataset_used:
-                s.dataset_reset()
+        '''start new samples of dataset groups used by evals'''
+
+        while self.used_datasets:
+            self.used_datasets.pop().reset()
+
+    def __schedule_dataset_timeouts(self):
+        '''schedule completion timeouts of dataset groups with a new sample'''
 
-    def sensor_cron_trigger(self, sensor, value):
+        while self.started_datasets:
+            group = self.started_datasets.pop()
+            if group.ready and group.timeout_job is None:
+                group.timeout_job = self.scheduler.add_job(
+                    func=self.dataset_timeout,
+                    trigger=DateTrigger(run_date=datetime.now() +
+                                        timedelta(seconds=group.timeout)),
+                    args=[group])
+
+    def dataset_timeout(self, group):
         '''
-        called from scheduler when cron time has come
+        called from scheduler when a dataset group has not been completed in time,
+        eval with the last values of missing members
         '''
 
-        logging.info("scheduller run: %s.%s cron time has come", sensor.node_id,
-                     sensor.sensor_id)
+        group.timeout_job = None
+        if not group.ready:
+            return
 
-        # set the same value if None / null
-        if value is None:
-            x = sensor.value
-        else:
-            x = value
+        sensor = group.sensor
+        logger.info("dataset %s.%s: timeout, %d/%d members set", sensor.node_id,
+                    sensor.sensor_id, len(group.ready), len(group.members))
+        group.expired = True
+        self.used_datasets.add(group)
+
+        vars_dict = self.__get_sensor_required_vars_dict(sensor)
+        if sensor.do_eval(vars_dict=vars_dict):
+            self.__propagate(sensor)
+        self.__used_dataset_reset()
+        self.__process_changes()
+
+    def cron_group_trigger(self, members):
+        '''
+        called from scheduler when cron time of a group of sensors has come,
+        sets values of all (sensor, value) members as one batch,
+        members with an invalid value are skipped
+        '''
 
-        self.set_node_values(sensor.node_id, {sensor.sensor_id: x})
+        logger.info("scheduller run: cron time has come for %d sensors", len(members))
+
+        sensor_values = []
+        for sensor, value in members:
+            # set the same value if None / null
+            if value is None:
+                value = sensor.value
+            try:
+                sensor_values.append((sensor, sensor.fix_value(value)))
+            except (TypeError, ValueError):
+                logger.error("cron %s.%s: invalid value %r, skipped", sensor.node_id,
+                             sensor.sensor_id, value)
+
+        self.set_sensors_values(sensor_values)
+
+    def __remove_cron_jobs(self):
+        for job, _ in self.cron_groups.values():
+            logger.debug("scheduler: remove %s", job)
+            job.remove()
+        self.cron_groups = {}
 
     def sensor_expire(self, sensor):
         '''
         called from scheduler job when TTL expires
         '''
 
-        logging.info("scheduller run: %s.%s TTL expired", sensor.node_id,
-                     sensor.sensor_id)
+        logger.info("scheduller run: %s.%s TTL expired", sensor.node_id,
+                    sensor.sensor_id)
 
         sensor.ttl_job = None
         self.__reset_sensor(sensor)
 
-    def final_changes_processing(self, diff, call_after_expire=False):
-        '''
-        schedule remaining TTLs
-        final emit of changes to SocketIO
-          - changed data of sensors to 'events' namespace
-          - changed data for actuators to 'metrics' namespace
-        '''
+    @staticmethod
+    def __add_actuator_value(sensor, actuator_id_values, actuator_addr_values):
+        '''add actuator value to {gw:{node_id:{sensor_id:value}}} and
+           {gw:{node_addr:{key:value}}} dicts'''
+
+        if sensor.gw not in actuator_id_values:
+            actuator_id_values[sensor.gw] = {}
+        if sensor.node_id not in actuator_id_values[sensor.gw]:
+            actuator_id_values[sensor.gw][sensor.node_id] = {}
+        actuator_id_values[sensor.gw][sensor.node_id][sensor.sensor_id] = sensor.value
+        if (sensor.node_addr != '') and (sensor.key != ''):
+            if sensor.gw not in actuator_addr_values:
+                actuator_addr_values[sensor.gw] = {}
+            if sensor.node_addr not in actuator_addr_values[sensor.gw]:
+                actuator_addr_values[sensor.gw][sensor.node_addr] = {}
+            actuator_addr_values[sensor.gw][sensor.node_addr][sensor.key] = sensor.value
+
+    def __send_actuators(self, gateway, response, data):
+        '''queue actuator values to the gateway outbox or emit them to its room'''
+
+        if self.cluster is not None and not self.cluster.is_leader(gateway):
+            return  # sent by another cluster node
+        if self.outboxes is not None:
+            self.outboxes.put(gateway, response, data)
+        else:
+            self.sio.emit(response,
+                          json.dumps({gateway: data}),
+                          room=gateway,
+                          namespace=METRICS_NAMESPACE)
 
-        actuator_id_values = {}
-        actuator_addr_values = {}
+    def resend_actuators(self, gw):
+        '''send the current state of all actuators of a gateway'''
 
-        if isinstance(diff, dict):
-            if not diff:
-                logging.info('there are no changes')
-                return False
-        else:
-            raise TypeError("not a dict")
+        actuator_id_values, actuator_addr_values = self.get_actuators_of_gw(gw)
+        if actuator_id_values:
+            self.__send_actuators(gw, 'actuator_response', actuator_id_values)
+        if actuator_addr_values:
+            self.__send_actuators(gw, 'actuator_addr_response', actuator_addr_values)
+
+    @stage('ttl')
+    def __schedule_ttls(self, diff, call_after_expire=False):
+        '''schedule remaining TTLs of changed sensors, update exp_timestamp in diff'''
 
         for node_id in diff:
-            for sensor_id, metrics in diff[node_id].items():
+            for sensor_id in diff[node_id]:
                 sensor = self.__get_sensor(node_id, sensor_id)
 
                 if isinstance(sensor.ttl, int) and isinstance(sensor.hit_timestamp,
@@ -441,45 +766,64 @@ class Sensors():
                     if ttl_end_job:
                         diff[node_id][sensor_id]['exp_timestamp'] = None
 
+    @stage('emit')
+    def __emit_changes(self, diff):
+        '''
+        emit changes to SocketIO
+          - changed data of sensors to 'events' namespace
+          - changed data for actuators to 'metrics' namespace
+        '''
+
+        actuator_id_values = {}
+        actuator_addr_values = {}
+
+        for node_id in diff:
+            for sensor_id, metrics in diff[node_id].items():
+                sensor = self.__get_sensor(node_id, sensor_id)
                 if metrics and sensor.mode == ACTUATOR:
-                    if sensor.gw not in actuator_id_values:
-                        actuator_id_values[sensor.gw] = {}
-                    if node_id not in actuator_id_values[sensor.gw]:
-                        actuator_id_values[sensor.gw][node_id] = {}
-                    actuator_id_values[sensor.gw][node_id][sensor_id] = sensor.value
-                    if (sensor.node_addr != '') and (sensor.key != ''):
-                        if sensor.gw not in actuator_addr_values:
-                            actuator_addr_values[sensor.gw] = {}
-                        if sensor.node_addr not in actuator_addr_values[sensor.gw]:
-                            actuator_addr_values[sensor.gw][sensor.node_addr] = {}
-                        actuator_addr_values[sensor.gw][sensor.node_addr][
-                            sensor.key] = sensor.value
-
-        logging.info('final changes: %s', diff)
+                    self.__add_actuator_value(sensor, actuator_id_values,
+                                              actuator_addr_values)
+
+        logger.debug('final changes: %s', diff)
         self.sio.emit('update_response', json.dumps(diff), namespace=EVENTS_NAMESPACE)
 
-        if actuator_id_values:
-            for gateway, data in actuator_id_values.items():
-                logging.info('changed actuator ids: %s', data)
-                self.sio.emit('actuator_response',
-                              json.dumps({gateway: data}),
-                              room=gateway,
-                              namespace=METRICS_NAMESPACE)
+        for gateway, data in actuator_id_values.items():
+            logger.debug('changed actuator ids: %s', data)
+            self.__send_actuators(gateway, 'actuator_response', data)
 
-        if actuator_addr_values:
-            for gateway, data in actuator_addr_values.items():
-                logging.info('changed actuator addrs: %s', data)
-                self.sio.emit('actuator_addr_response',
-                              json.dumps({gateway: data}),
-                              room=gateway,
-                              namespace=METRICS_NAMESPACE)
+        for gateway, data in actuator_addr_values.items():
+            logger.debug('changed actuator addrs: %s', data)
+            self.__send_actuators(gateway, 'actuator_addr_response', data)
+
+    def final_changes_processing(self, diff, call_after_expire=False):
+        '''
+        schedule remaining TTLs
+        final emit of changes to SocketIO
+          - changed data of sensors to 'events' namespace
+          - changed data for actuators to 'metrics' namespace
+        '''
+
+        if isinstance(diff, dict):
+            if not diff:
+                logger.debug('there are no changes')
+                return False
+        else:
+            raise TypeError("not a dict")
+
+        self.__schedule_ttls(diff, call_after_expire=call_after_expire)
+        self.__emit_changes(diff)
+        if self.shm is not None:
+            self.shm.update(
+                self.__get_sensor(node_id, sensor_id) for node_id in diff
+                for sensor_id in diff[node_id])
 
         diff2 = self.__get_changed_nodes_dict()
         if diff2:
-            logging.debug("scheduler: new ttl jobs: %s", diff2)
+            logger.debug("scheduler: new ttl jobs: %s", diff2)
 
         return True
 
+    @stage('parse')
     def conv_addrs_to_ids(self, addrs_dict):
         '''
         convert {node_addr:{key:value}} dict
@@ -497,44 +841,158 @@ class Sensors():
                         ret[sensor.node_id] = {}
                     ret[sensor.node_id][sensor.sensor_id] = value
                 else:
-                    logging.warning("sensor %s:%s not found in node", node_addr, key)
+                    logger.warning("sensor %s:%s not found in node", node_addr, key)
         return ret
 
     def set_node_values(self, node_id, sensor_values_dict, increment=False):
-        changed = 0
+        return self.set_nodes_values({node_id: sensor_values_dict}, increment=increment)
+
+    def set_nodes_values(self, nodes_dict, increment=False):
+        '''
+        set sensors of several nodes as one batch with one diff and emit,
+        raise KeyError or ValueError before any sensor is set
+        if a sensor is not found or a value can't be converted
+        '''
 
-        for sensor_id in sensor_values_dict:
+        return self.set_sensors_values(self.coerce_values(nodes_dict), increment=increment)
 
-            # create new node if there is a template
-            if (node_id not in self.node_id_index) and (sensor_id
-                                                        in self.sensor_template_index):
-                logging.debug("setup new node %s from template.", node_id)
-                self.node_id_index[node_id] = {}
-                t = self.sensor_template_index[sensor_id]
-                for sx_id, sx in self.node_template_index[t].items():
-                    sensor = sx.clone(node_id)
-                    self.node_id_index[node_id][sx_id] = sensor
-                    self.sensor_index.append(sensor)
-                    self.__add_cron_jobs(sensor)
+    def set_sensors_values(self, sensor_values, increment=False, replicated=False):
+        '''
+        set (sensor, converted value) pairs as one batch with one diff and emit,
+        replicated values (applied by a cluster peer) are not debounced again
+        and not published to the cluster
+        '''
 
-            sensor = self.__get_sensor(node_id, sensor_id)
-            if sensor.set(sensor_values_dict[sensor_id], increment=increment):
-                changed = 1
+        changed = False
 
-                if sensor.eval_code is not None:
-                    vars_dict = self.__get_sensor_required_vars_dict(sensor)
-                    sensor.do_eval(vars_dict=vars_dict, update=False)
+        for sensor, value in sensor_values:
+            if self.__set_sensor(sensor,
+                                 value,
+                                 increment=increment,
+                                 flush=replicated,
+                                 publish=not replicated):
+                changed = True
 
-                self.__do_requiring_eval(sensor)
-                self.__used_dataset_reset()
+        return self.__process_changes(changed)
+
+    @stage('parse')
+    def coerce_values(self, nodes_dict):
+        '''
+        convert {node_id:{sensor_id:value}} dict
+        to
+        a list of (sensor, value converted to the sensor type)
+        '''
+
+        # convert all values first, nodes are spawned only if the whole batch is valid
+        spawned = {}
+        converted = []
+        for node_id, sensor_values_dict in nodes_dict.items():
+            for sensor_id, value in sensor_values_dict.items():
+                sensor = self.__get_sensor_or_template(node_id, sensor_id, spawned)
+                try:
+                    converted.append((node_id, sensor_id, sensor.fix_value(value)))
+                except (TypeError, ValueError) as exc:
+                    raise ValueError('{}.{}: invalid value {!r}'.format(
+                        node_id, sensor_id, value)) from exc
+
+        for node_id, template in spawned.items():
+            self.__spawn_node(node_id, template)
+
+        return [(self.__get_sensor(node_id, sensor_id), value)
+                for node_id, sensor_id, value in converted]
+
+    def __process_changes(self, changed=True, call_after_expire=False):
+        '''
+        finish a batch of changes - update rollups, schedule timers
+        and emit changed values, return the changes
+        '''
+
+        if self.applied_values:
+            self.cluster.publish(self.applied_values)
+            self.applied_values = []
+
+        if self.__update_rollups():
+            changed = True
+        self.__schedule_dataset_timeouts()
+        self.__schedule_debounce_flushes()
 
         changes = {}
         if changed:
             changes = self.__get_changed_nodes_dict()
-            self.final_changes_processing(changes)
+            self.final_changes_processing(changes, call_after_expire=call_after_expire)
 
         return changes
 
+    def __call_later(self, delay, func, *args):
+        '''call func(*args) after delay seconds using timers or the scheduler'''
+
+        if self.timers is not None:
+            self.timers.call_later(delay, func, *args)
+        else:
+            self.scheduler.add_job(func=func,
+                                   trigger=DateTrigger(run_date=datetime.now() +
+                                                       timedelta(seconds=delay)),
+                                   args=list(args))
+
+    def __schedule_debounce_flushes(self):
+        '''schedule trailing edges of debounce windows with buffered values'''
+
+        while self.debounce_flushes:
+            sensor = self.debounce_flushes.pop()
+            delay = max(0, sensor.debounce_window_end - time())
+            self.__call_later(delay, self.debounce_flush, sensor)
+
+    def debounce_flush(self, sensor):
+        '''called at the end of a debounce window, apply the aggregated value'''
+
+        value = sensor.pop_debounce_value()
+        if value is None:
+            return
+
+        logger.debug("debounce: flush %s.%s = %s", sensor.node_id, sensor.sensor_id,
+                     value)
+        changed = self.__set_sensor(sensor, value, flush=True)
+        self.__process_changes(changed)
+
+    def __set_sensor(self, sensor, value, increment=False, flush=False, publish=True):
+        '''set a sensor and propagate it, return True if changed'''
+
+        if not sensor.set(value, increment=increment, flush=flush):
+            return False
+
+        if self.cluster is not None and publish:
+            # publish the value applied (not swallowed by debounce) before eval
+            self.applied_values.append((sensor, sensor.value))
+
+        if sensor.eval_code is not None:
+            vars_dict = self.__get_sensor_required_vars_dict(sensor)
+            sensor.do_eval(vars_dict=vars_dict, update=False)
+
+        self.__propagate(sensor)
+        self.__used_dataset_reset()
+        return True
+
+    def __get_sensor_or_template(self, node_id, sensor_id, spawned):
+        '''
+        return a sensor, or a sensor of the template of a new node, which is
+        added to the spawned {node_id:template} dict (KeyError if unknown)
+        '''
+
+        if node_id in self.node_id_index:
+            return self.__get_sensor(node_id, sensor_id)
+
+        if node_id not in spawned:
+            spawned[node_id] = self.sensor_template_index[sensor_id]
+        return self.node_template_index[spawned[node_id]][sensor_id]
+
+    def __spawn_node(self, node_id, template):
+        '''create a new node from a template'''
+
+        logger.debug("setup new node %s from template.", node_id)
+        self.node_id_index[node_id] = {}
+        for sx in self.node_template_index[template].values():
+            self.__register_sensor(sx.clone(node_id))
+
     def __reset_sensor(self, sensor, skip_eval=False):
         sensor.reset()
 
@@ -543,23 +1001,22 @@ class Sensors():
                 vars_dict = self.__get_sensor_required_vars_dict(sensor)
                 sensor.do_eval(vars_dict=vars_dict, update=False)
 
-        self.__do_requiring_eval(sensor)
+        self.__propagate(sensor)
         self.__used_dataset_reset()
-        changes = self.__get_changed_nodes_dict()
-        self.final_changes_processing(changes, call_after_expire=True)
+        self.__process_changes(call_after_expire=True)
 
     def get_parser_arguments(self):
 
         d = {}
-        for sensor in self.sensor_index:
+        for sensor_id, sensor in self.index.get_first_of_sensor_ids():
             t = sensor.get_type()
 
             if t in (GAUGE, COUNTER):
-                d[sensor.sensor_id] = (float, 'decimal')
+                d[sensor_id] = (float, 'decimal')
             elif t == BINARY:
-                d[sensor.sensor_id] = (bool, 'boolean')
+                d[sensor_id] = (bool, 'boolean')
             else:
-                d[sensor.sensor_id] = (str, 'string')
+                d[sensor_id] = (str, 'string')
 
         for q in d:
             yield q, d[q][0], d[q][1]
@@ -567,6 +1024,12 @@ class Sensors():
     def default_values(self):
         for sensor in self.sensor_index:
             sensor.reset()
+            if sensor.history is not None:
+                sensor.history.clear()
+        for group in self.dataset_groups:
+            group.reset()
+        self.dirty_rollups.update(self.rollups)
+        self.__update_rollups()
 
         changes = self.__get_changed_nodes_dict()
         self.final_changes_processing(changes)
@@ -576,6 +1039,8 @@ class Sensors():
     def reset_values(self):
         for sensor in self.sensor_index:
             sensor.__init__()
+            if sensor.history is not None:
+                sensor.history.clear()
 
         changes = self.__get_changed_nodes_dict()
         self.final_changes_processing(changes)
@@ -605,11 +1070,14 @@ class Sensors():
             raise self.ConfigException("Cant't read config - {}".format(exc))
 
         self.add_sensors(config_dict)
+        if self.shm is not None:
+            self.shm.set_sensors(self.sensor_index)
         changes = self.__get_changed_nodes_dict()
         return changes
 
     def reload_config(self, pars):
         self.default_values()
+        self.__remove_cron_jobs()
         self.reset()
         changes = self.load_config(pars)
         self.final_changes_processing(changes)
@@ -7,19 +7,30 @@ monkey.patch_all()  # nopep8
 import logging
 import sys
 import json
+import socket
 from flask import Flask, Blueprint, request, Response, abort, render_template
+from werkzeug.exceptions import ServiceUnavailable
 from flask_restx import Api, Resource
 from flask_socketio import SocketIO, Namespace, emit, join_room, rooms
 from flask_bootstrap import Bootstrap
 from geventwebsocket.handler import WebSocketHandler
 from gevent.pywsgi import WSGIServer, LoggingLogAdapter
+from gevent.pool import Pool
 from apscheduler.schedulers.gevent import GeventScheduler
 from prometheus_client.core import REGISTRY
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from laporte.version import __version__, get_build_info
 from laporte.argparser import get_pars
+from laporte.logs import setup_logging, Lazy
+from laporte.sensor import Sensor
 from laporte.sensors import Sensors, METRICS_NAMESPACE, EVENTS_NAMESPACE
 from laporte.prometheus import PrometheusMetrics
+from laporte.outbox import Outboxes
+from laporte.timers import Timers
+from laporte.ingest import IngestQueue, Overloaded
+from laporte.cluster import Cluster, CLUSTER_NAMESPACE
+from laporte.fanout import get_client_manager
+from laporte.shm import SharedState
 
 # create logger
 logger = logging.getLogger(__name__)
@@ -28,18 +39,123 @@ logger = logging.getLogger(__name__)
 pars = get_pars()
 
 # set logger
-logging.basicConfig(format='%(levelname)s %(module)s: %(message)s', level=pars.log_level)
-logging.getLogger('apscheduler').setLevel(logging.WARNING)
 if pars.log_level == logging.DEBUG:
-    logging.getLogger('socketio').setLevel(logging.DEBUG)
-    logging.getLogger('engineio').setLevel(logging.DEBUG)
+    sio_log_level = logging.DEBUG
 else:
-    logging.getLogger('socketio').setLevel(logging.WARNING)
-    logging.getLogger('engineio').setLevel(logging.WARNING)
+    sio_log_level = logging.WARNING
+setup_logging(pars.log_level,
+              levels={
+                  'apscheduler': logging.WARNING,
+                  'socketio': sio_log_level,
+                  'engineio': sio_log_level,
+                  **pars.log_levels
+              },
+              log_format=pars.log_format,
+              rate=pars.log_rate,
+              sample=pars.log_sample)
 
 # create container objects
 sensors = Sensors()
-metrics = PrometheusMetrics(sensors)
+metrics = PrometheusMetrics(sensors, eval_metrics=pars.eval_metrics)
+if pars.stage_metrics:
+    metrics.instrument_stages(sensors)
+    metrics.instrument_stages(Sensor)
+
+
+# seconds a client should wait after a request rejected by a full ingest queue
+RETRY_AFTER = 1
+
+
+def put_values(sensor_values, increment=False):
+    '''
+    set received (sensor, converted value) pairs through the ingest queue
+    (if enabled), return batches to wait for or changes
+    '''
+
+    if sensors.ingest is None:
+        return sensors.set_sensors_values(sensor_values, increment=increment)
+    return sensors.ingest.put(sensor_values, increment=increment)
+
+
+def wait_values(ret):
+    '''wait for values put by put_values, return changes'''
+
+    if sensors.ingest is None:
+        return ret
+    return sensors.ingest.wait(ret)
+
+
+def put_message(nodes_dict, wait=True):
+    '''
+    set values of all nodes of a Socket.IO message at once (nodes with
+    an unknown sensor or an invalid value are skipped), return a NACK
+    if the ingest queue is full
+    '''
+
+    sensor_values = []
+    for node_id, request_form in nodes_dict.items():
+        logger.debug('SocketIO message: node_id=%s: data=%s', node_id, request_form)
+        try:
+            sensor_values += sensors.coerce_values({node_id: request_form})
+        except KeyError:
+            pass
+        except ValueError as exc:
+            logger.warning(exc)
+
+    try:
+        ret = put_values(sensor_values)
+    except Overloaded as exc:
+        logger.warning(exc)
+        return {'error': str(exc), 'retry_after': RETRY_AFTER}  # NACK
+    if wait:
+        wait_values(ret)
+    return None
+
+
+def emit_gw_state(gw, sid):
+    '''emit config and current state of actuators of a gateway to a joined client'''
+
+    sio.emit('config_response', {gw: sensors.get_config_of_gw(gw)},
+             to=sid,
+             namespace=METRICS_NAMESPACE)
+    actuator_id_values, actuator_addr_values = sensors.get_actuators_of_gw(gw)
+    if actuator_id_values:
+        sio.emit('actuator_response',
+                 json.dumps({gw: actuator_id_values}),
+                 to=sid,
+                 namespace=METRICS_NAMESPACE)
+    if actuator_addr_values:
+        sio.emit('actuator_addr_response',
+                 json.dumps({gw: actuator_addr_values}),
+                 to=sid,
+                 namespace=METRICS_NAMESPACE)
+
+
+def emit_init(sid):
+    '''emit state of all sensors to a connected events client'''
+
+    data = sensors.get_metrics_dict_by_node(skip_None=False)
+    sio.emit('init_response', json.dumps(data), to=sid, namespace=EVENTS_NAMESPACE)
+
+
+def forward(event, message):
+    '''forward a message of the client to the state process (front end)'''
+
+    sio.server.manager.forward(event, message, request.sid)
+
+
+def on_forward(event, message, sid):
+    '''handle a message forwarded by a front end (state process)'''
+
+    logger.debug("forwarded %s of %s: %s", event, sid, message)
+    if event == 'sensor_response':
+        put_message(message, wait=False)
+    elif event == 'sensor_addr_response':
+        put_message(sensors.conv_addrs_to_ids(message), wait=False)
+    elif event == 'join':
+        emit_gw_state(message['room'], sid)
+    elif event == 'connect':
+        emit_init(sid)
 
 
 class MetricsNamespace(Namespace):
@@ -51,27 +167,18 @@ class MetricsNamespace(Namespace):
         receive metrics of changed sensors identified by node_id/sensor_id
         '''
 
-        for node_id in message:
-            request_form = message[node_id]
-            logger.info('SocketIO message: node_id=%s: data=%s', node_id,
-                        str(request_form))
-            try:
-                sensors.set_node_values(node_id, request_form)
-            except KeyError:
-                pass
+        if pars.front_end:
+            return forward('sensor_response', message)
+        return put_message(message)
 
     @staticmethod
     @metrics.func_measure({'event': 'sensor_addr_response', 'namespace': '/metric'})
     def on_sensor_addr_response(message):
         '''receive metrics of changed sensors identified by node_addr/key'''
 
-        for node_id, request_form in sensors.conv_addrs_to_ids(message).items():
-            logger.info('SocketIO translated message: node_id=%s: data=%s', node_id,
-                        str(request_form))
-            try:
-                sensors.set_node_values(node_id, request_form)
-            except KeyError:
-                pass
+        if pars.front_end:
+            return forward('sensor_addr_response', message)
+        return put_message(sensors.conv_addrs_to_ids(message))
 
     @staticmethod
     @metrics.func_measure({'event': 'join', 'namespace': '/metric'})
@@ -82,7 +189,23 @@ class MetricsNamespace(Namespace):
         gw = message['room']
         join_room(gw)
         emit('status_response', {'joined in': rooms()})
-        emit('config_response', {gw: list(sensors.get_config_of_gw(gw))})
+        if pars.front_end:
+            forward('join', message)
+            return
+
+        # config and current state of actuators to the joined client only
+        emit_gw_state(gw, request.sid)
+        if sensors.cluster is not None:
+            sensors.cluster.announce()
+
+
+class ClusterNamespace(Namespace):
+    '''Socket.IO namespace for replication between cluster nodes'''
+    @staticmethod
+    def on_sync(message):
+        '''return log entries after a sequence number of the peer'''
+
+        return sensors.cluster.get_sync(message.get('epoch'), message.get('seq'))
 
 
 class EventsNamespace(Namespace):
@@ -93,9 +216,10 @@ class EventsNamespace(Namespace):
     def on_connect():
         '''emit initital event after a successful connection'''
 
-        data = sensors.get_metrics_dict_by_node(skip_None=False)
-
-        emit('init_response', json.dumps(data), namespace=EVENTS_NAMESPACE)
+        if pars.front_end:
+            forward('connect', None)
+        else:
+            emit_init(request.sid)
 
 
 class DefaultNamespace(Namespace):
@@ -116,12 +240,47 @@ bootstrap = Bootstrap(app)
 app.config.SWAGGER_UI_DOC_EXPANSION = 'list'
 app.register_blueprint(blueprint)
 REGISTRY.register(metrics.CustomCollector(metrics))
-sio = SocketIO(app, async_mode='gevent', engineio_logger=True)
+if pars.front_end and (not pars.message_queue or pars.cluster_peers):
+    logger.error("a front end needs --message-queue and can't be a cluster node")
+    sys.exit(1)
+if pars.message_queue:
+    try:
+        client_manager = get_client_manager(pars.message_queue,
+                                            channel=pars.message_queue_channel)
+    except ValueError as exc:
+        logger.error(exc)
+        sys.exit(1)
+    if not pars.front_end:
+        client_manager.forward_handler = on_forward
+else:
+    client_manager = None
+sio = SocketIO(app,
+               async_mode='gevent',
+               client_manager=client_manager,
+               logger=logging.getLogger('socketio.server'),
+               engineio_logger=logging.getLogger('engineio.server'),
+               ping_interval=pars.ping_interval,
+               ping_timeout=pars.ping_timeout,
+               max_http_buffer_size=pars.max_buffer_size)
 sio.on_namespace(DefaultNamespace('/'))
 sio.on_namespace(MetricsNamespace(METRICS_NAMESPACE))
 sio.on_namespace(EventsNamespace(EVENTS_NAMESPACE))
 sensors.sio = sio
 sensors.scheduler = GeventScheduler()
+sensors.outboxes = Outboxes(sio)
+sensors.timers = Timers(sio)
+if pars.ingest_queue_size:
+    sensors.ingest = IngestQueue(sio, sensors, max_size=pars.ingest_queue_size)
+if pars.shm_path:
+    sensors.shm = SharedState(pars.shm_path)
+if pars.cluster_peers:
+    sio.on_namespace(ClusterNamespace(CLUSTER_NAMESPACE))
+    sensors.cluster = Cluster(sio,
+                              sensors,
+                              pars.cluster_node_id
+                              or '{}:{}'.format(socket.gethostname(), pars.listen_port),
+                              pars.cluster_peers,
+                              log_size=pars.cluster_log_size)
 
 # REST API methods
 
@@ -148,19 +307,27 @@ for sensor_id, t, t_str in sensors.get_parser_arguments():
 class NodeMetrics(Resource):
     @api.doc(params={'node_id': 'a node to be affected'})
     @api.response(200, 'Success')
+    @api.response(400, 'Invalid value')
     @api.response(404, 'Node or sensor not found')
+    @api.response(503, 'Ingest queue is full')
     @api.expect(parser)
     @metrics.func_measure({'method': 'put', 'location': '/api/metrics/<node_id>'})
     def put(self, node_id):
         '''set sensors of a node'''
-        logger.info("API/set: %s: %s", node_id, str(request.form.to_dict()))
+        logger.debug("API/set: %s: %s", node_id, Lazy(request.form.to_dict))
         try:
-            ret = sensors.set_node_values(node_id, request.form)
+            ret = put_values(sensors.coerce_values({node_id: request.form.to_dict()}))
         except KeyError:
             logger.warning("node %s or sensor not found", node_id)
             abort(404)  # sensor not configured
+        except ValueError as exc:
+            logger.warning(exc)
+            abort(400, str(exc))  # value of a wrong type
+        except Overloaded as exc:
+            logger.warning(exc)
+            raise ServiceUnavailable(str(exc), retry_after=RETRY_AFTER) from exc
 
-        return ret
+        return wait_values(ret)
 
     @api.doc(params={'node_id': 'a node from which to get metrics'})
     @api.response(200, 'Success')
@@ -182,19 +349,28 @@ class NodeMetrics(Resource):
 class IncNodeMetrics(Resource):
     @api.doc(params={'node_id': 'a node to be affected'})
     @api.response(200, 'Success')
+    @api.response(400, 'Invalid value')
     @api.response(404, 'Node or sensor not found')
+    @api.response(503, 'Ingest queue is full')
     @api.expect(parser)
     @metrics.func_measure({'method': 'put', 'location': '/api/metrics/inc/<node_id>'})
     def put(self, node_id):
         '''increment sensor values of a node'''
-        logger.info("API/inc: %s: %s", node_id, str(request.form.to_dict()))
+        logger.debug("API/inc: %s: %s", node_id, Lazy(request.form.to_dict))
         try:
-            ret = sensors.set_node_values(node_id, request.form, increment=True)
+            ret = put_values(sensors.coerce_values({node_id: request.form.to_dict()}),
+                             increment=True)
         except KeyError:
             logger.warning("node %s or sensor not found", node_id)
             abort(404)  # sensor not configured
+        except ValueError as exc:
+            logger.warning(exc)
+            abort(400, str(exc))  # value of a wrong type
+        except Overloaded as exc:
+            logger.warning(exc)
+            raise ServiceUnavailable(str(exc), retry_after=RETRY_AFTER) from exc
 
-        return ret
+        return wait_values(ret)
 
 
 @ns_metrics.route('/<string:node_id>/<string:sensor_id>')
@@ -223,12 +399,109 @@ class SensorMetrics(Resource):
         return ret
 
 
+NDJSON_CHUNK_SIZE = 100
+
+
+def get_ndjson_response(items):
+    '''stream items as newline delimited JSON, a chunk per NDJSON_CHUNK_SIZE items'''
+
+    def generate():
+        lines = []
+        for item in items:
+            lines.append(json.dumps(item))
+            if len(lines) >= NDJSON_CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+                sio.sleep(0)  # let other greenlets run between chunks
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+page_parser = api.parser()
+page_parser.add_argument('limit',
+                         type=int,
+                         required=False,
+                         help='max number of sensors in a page (default all)',
+                         location='args')
+page_parser.add_argument('cursor',
+                         type=int,
+                         required=False,
+                         help='next_cursor of the previous page',
+                         location='args')
+page_parser.add_argument('format',
+                         required=False,
+                         choices=('json', 'ndjson'),
+                         default='json',
+                         help='json or streamed newline delimited json',
+                         location='args')
+
+
+def get_page_args(parser):
+    '''parse and check pagination arguments'''
+
+    args = parser.parse_args()
+    if (args['limit'] is not None and args['limit'] < 1) or (args['cursor'] is not None
+                                                             and args['cursor'] < 0):
+        abort(400, 'limit must be positive, cursor must not be negative')
+    return args
+
+
+query_parser = page_parser.copy()
+query_parser.add_argument('gw', required=False, help='gateway', location='args')
+query_parser.add_argument('node',
+                          required=False,
+                          help='node_id or its glob pattern',
+                          location='args')
+query_parser.add_argument('sensor',
+                          required=False,
+                          help='sensor_id or its glob pattern',
+                          location='args')
+query_parser.add_argument('type',
+                          required=False,
+                          choices=('gauge', 'counter', 'binary', 'message'),
+                          help='sensor type',
+                          location='args')
+query_parser.add_argument('mode',
+                          required=False,
+                          choices=('sensor', 'actuator'),
+                          help='sensor or actuator',
+                          location='args')
+
+LABEL_ARG_PREFIX = 'label.'
+
+
 @ns_metrics.route('/')
 class SensorsMetricsList(Resource):
+    @api.expect(query_parser)
+    @api.doc(params={'label.<name>': 'export label value, e.g. label.location=kitchen'})
     def get(self):
-        '''get a list of all metrics'''
+        '''
+        get a list of all metrics or metrics matching a query,
+        a page {items, next_cursor} if limit or cursor is set
+        '''
 
-        return list(sensors.get_metrics(skip_None=False))
+        args = get_page_args(query_parser)
+        labels = {
+            key[len(LABEL_ARG_PREFIX):]: value
+            for key, value in request.args.items() if key.startswith(LABEL_ARG_PREFIX)
+        }
+        items, next_cursor = sensors.get_metrics_page(args['cursor'],
+                                                      args['limit'],
+                                                      skip_None=False,
+                                                      gw=args['gw'],
+                                                      node=args['node'],
+                                                      sensor=args['sensor'],
+                                                      sensor_type=args['type'],
+                                                      mode=args['mode'],
+                                                      labels=labels)
+
+        if args['format'] == 'ndjson':
+            return get_ndjson_response(items)
+        if args['limit'] is None and args['cursor'] is None:
+            return list(items)
+        return {'items': list(items), 'next_cursor': next_cursor}
 
 
 @ns_metrics.route('/by_gw')
@@ -284,10 +557,21 @@ class StateReload(Resource):
 
 @ns_state.route('/dump')
 class StateDump(Resource):
+    @api.expect(page_parser)
     def get(self):
-        '''get all data of all sensors'''
+        '''
+        get all data of all sensors,
+        a page {items, next_cursor} if limit or cursor is set
+        '''
+
+        args = get_page_args(page_parser)
+        items, next_cursor = sensors.get_sensors_dump_page(args['cursor'], args['limit'])
 
-        return sensors.get_sensors_dump_dict()
+        if args['format'] == 'ndjson':
+            return get_ndjson_response(items)
+        if args['limit'] is None and args['cursor'] is None:
+            return sensors.nest_sensors_dump(items)
+        return {'items': sensors.nest_sensors_dump(items), 'next_cursor': next_cursor}
 
 
 @ns_info.route('/version')
@@ -298,6 +582,56 @@ class InfoVersion(Resource):
         return get_build_info()
 
 
+@ns_info.route('/history')
+class InfoHistory(Resource):
+    def get(self):
+        '''get number of sensors with history, stored samples and memory usage'''
+
+        return sensors.get_history_info()
+
+
+eval_profile_parser = api.parser()
+eval_profile_parser.add_argument('top',
+                                 type=int,
+                                 required=False,
+                                 help='number of the most expensive sensors',
+                                 location='args')
+eval_profile_parser.add_argument('samples',
+                                 type=int,
+                                 required=False,
+                                 default=10,
+                                 help='number of evals captured by cProfile',
+                                 location='args')
+
+# cProfile slows evals down, so only a few sensors are profiled by default
+eval_capture_parser = eval_profile_parser.copy()
+eval_capture_parser.replace_argument('top',
+                                     type=int,
+                                     required=False,
+                                     default=3,
+                                     help='number of the most expensive sensors',
+                                     location='args')
+
+
+@ns_info.route('/eval_profile')
+class InfoEvalProfile(Resource):
+    @api.expect(eval_profile_parser)
+    def get(self):
+        '''get eval profile of sensors sorted by total eval time'''
+
+        args = eval_profile_parser.parse_args()
+        return list(sensors.get_eval_profile(top=args['top']))
+
+    @api.expect(eval_capture_parser)
+    def put(self):
+        '''capture cProfile of next evals of the most expensive sensors'''
+
+        args = eval_capture_parser.parse_args()
+        if args['top'] is None or args['top'] < 1 or args['samples'] < 1:
+            abort(400, 'top and samples must be positive')
+        return sensors.capture_eval_profile(args['top'], args['samples'])
+
+
 @ns_info.route('/myip')
 class InfoIP(Resource):
     def get(self):
@@ -314,9 +648,21 @@ class InfoIP(Resource):
         return ret
 
 
+@app.before_request
+def front_end_only():
+    '''a front end serves only Socket.IO clients and its Prometheus metrics'''
+
+    if pars.front_end and request.endpoint != 'prom_metrics':
+        abort(404, 'a front end, use the Laporte process with sensors')
+
+
 # Web interface
 
 
+# number of sensors loaded by the status page at once
+STATUS_PAGE_LIMIT = 500
+
+
 @app.route('/')
 @app.route('/sensors')
 @metrics.func_measure({'location': '/sensors'})
@@ -324,7 +670,7 @@ def table():
     return render_template('sensors.html',
                            time_locale=pars.time_locale,
                            async_mode=sio.async_mode,
-                           data=sensors.get_sensors_dump_dict())
+                           page_limit=STATUS_PAGE_LIMIT)
 
 
 @app.route('/scheduler')
@@ -358,22 +704,60 @@ def prom_metrics():
     return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST)
 
 
+class CloseConnectionHandler(WebSocketHandler):
+    '''handler closing HTTP connections after each request (no keep-alive)'''
+    def start_response(self, status, headers, exc_info=None):
+        if not any(header.lower() == 'connection' for header, _ in headers):
+            headers = list(headers) + [('Connection', 'close')]
+        return super().start_response(status, headers, exc_info)
+
+
+def get_listener():
+    '''create a listening socket shared with other processes by SO_REUSEPORT'''
+
+    family = socket.AF_INET6 if ':' in pars.listen_addr else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((pars.listen_addr, pars.listen_port))
+    sock.listen(pars.backlog)
+    sock.setblocking(False)
+    return sock
+
+
 def run_server():
     '''start a http server'''
 
-    sensors.scheduler.start()
-    try:
-        sensors.load_config(pars)
-    except sensors.ConfigException as exc:
-        logger.error(exc)
-        sys.exit(1)
+    if pars.front_end:
+        logger.info("front end of %s", pars.message_queue)
+    else:
+        sensors.scheduler.start()
+        try:
+            sensors.load_config(pars)
+        except sensors.ConfigException as exc:
+            logger.error(exc)
+            sys.exit(1)
+
+    if client_manager is not None and not sio.server.manager_initialized:
+        # listen to the bus before the first client connects (forwarded messages)
+        sio.server.manager_initialized = True
+        client_manager.initialize()
 
     logger.info("HTTP server `listen %s:%s", pars.listen_addr, pars.listen_port)
     dlog = LoggingLogAdapter(logger, level=logging.DEBUG)
     errlog = LoggingLogAdapter(logger, level=logging.ERROR)
-    http_server = WSGIServer((pars.listen_addr, pars.listen_port),
+
+    if pars.reuse_port:
+        listener, backlog = get_listener(), None
+    else:
+        listener, backlog = (pars.listen_addr, pars.listen_port), pars.backlog
+
+    http_server = WSGIServer(listener,
                              app,
+                             backlog=backlog,
+                             spawn=Pool(pars.pool_size) if pars.pool_size else 'default',
                              log=dlog,
                              error_log=errlog,
-                             handler_class=WebSocketHandler)
+                             handler_class=CloseConnectionHandler
+                             if pars.no_keep_alive else WebSocketHandler)
     http_server.serve_forever()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+'''
+export of numeric sensor state to a memory-mapped file for co-located readers
+
+The data file has a header and fixed size slots, one per sensor. A slot is
+guarded by a seqlock: the writer makes its sequence number odd, writes
+the fields and makes it even again, a reader retries while the number is odd
+or changed during the read. Slots of sensors are listed in an index file
+(JSON), a slot of a sensor is kept across config reloads.
+
+This module uses only the standard library, readers can import it without
+the server dependencies:
+
+    from laporte.shm import SharedStateReader
+
+    with SharedStateReader('/dev/shm/laporte') as reader:
+        print(reader.get('weather1', 'temp_celsius'))
+'''
+
+import json
+import math
+import mmap
+import os
+from collections import namedtuple
+from numbers import Real
+from struct import Struct
+
+MAGIC = b'LPRTSHM1'
+
+# magic, slot size, capacity (slots), generation of the index
+HEADER = Struct('<8sIQQ')
+HEADER_SIZE = 64
+
+# sequence number, value, hit timestamp, hits total
+SLOT = Struct('<QddQ')
+SEQ = Struct('<Q')
+FIELDS = Struct('<ddQ')
+
+# generation written to a replaced data file, readers reopen the path
+STALE = 2**64 - 1
+
+MIN_CAPACITY = 1024
+
+# reads of a slot before a reader gives up (writer stopped during a write)
+MAX_RETRIES = 100000
+
+SensorState = namedtuple('SensorState', ['value', 'hit_timestamp', 'hits_total'])
+
+
+def get_index_path(path):
+    return path + '.index.json'
+
+
+def to_float(value):
+    '''numeric (or binary) value as float, NaN for other values and None'''
+
+    if isinstance(value, Real):
+        return float(value)
+    return math.nan
+
+
+class SharedState():
+    '''writer of the data and index files (used by the server)'''
+    def __init__(self, path):
+        '''
+        Create empty data and index files.
+
+            path (str):
+                Path of the data file, the index is path.index.json.
+        '''
+
+        self.path = path
+        self.slots = {}  # (node_id, sensor_id) -> slot
+        self.keys = []  # slot -> (node_id, sensor_id)
+        self.generation = 0
+        self.capacity = 0
+        self.buf = None
+        self.__map(MIN_CAPACITY)
+        self.__write_index()
+
+    def __map(self, capacity):
+        '''create a data file with capacity slots, copy slots of the current one'''
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb+') as stream:
+            stream.truncate(HEADER_SIZE + capacity * SLOT.size)
+            buf = mmap.mmap(stream.fileno(), 0)
+        HEADER.pack_into(buf, 0, MAGIC, SLOT.size, capacity, self.generation)
+        if self.buf is not None:
+            buf[HEADER_SIZE:HEADER_SIZE + self.capacity * SLOT.size] = \
+                self.buf[HEADER_SIZE:HEADER_SIZE + self.capacity * SLOT.size]
+        os.replace(tmp_path, self.path)
+
+        if self.buf is not None:
+            HEADER.pack_into(self.buf, 0, MAGIC, SLOT.size, self.capacity, STALE)
+            self.buf.close()
+        self.buf = buf
+        self.capacity = capacity
+
+    def __write_index(self):
+        '''replace the index file, then publish its generation in the header'''
+
+        self.generation += 1
+        index_path = get_index_path(self.path)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as stream:
+            json.dump({'generation': self.generation, 'slots': self.keys}, stream)
+        os.replace(tmp_path, index_path)
+        HEADER.pack_into(self.buf, 0, MAGIC, SLOT.size, self.capacity, self.generation)
+
+    def __get_slot(self, sensor):
+        '''return a slot of the sensor, add a slot to the index if needed'''
+
+        key = (sensor.node_id, sensor.sensor_id)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            if slot >= self.capacity:
+                self.__map(self.capacity * 2)
+            self.slots[key] = slot
+            self.keys.append(key)
+        return slot
+
+    def __write_slot(self, slot, value, hit_timestamp, hits_total):
+        offset = HEADER_SIZE + slot * SLOT.size
+        seq = SEQ.unpack_from(self.buf, offset)[0]
+        SEQ.pack_into(self.buf, offset, seq + 1)
+        FIELDS.pack_into(self.buf, offset + SEQ.size, value, hit_timestamp, hits_total)
+        SEQ.pack_into(self.buf, offset, seq + 2)
+
+    def update(self, sensors):
+        '''write the current state of sensors'''
+
+        slots_count = len(self.keys)
+        for sensor in sensors:
+            self.__write_slot(self.__get_slot(sensor), to_float(sensor.value),
+                              to_float(sensor.hit_timestamp), sensor.hits_total or 0)
+        if len(self.keys) != slots_count:
+            self.__write_index()
+
+    def set_sensors(self, sensors):
+        '''
+        write the state of all sensors after a config load,
+        slots of removed sensors are cleared and kept reserved
+        '''
+
+        sensors = list(sensors)
+        present = {(sensor.node_id, sensor.sensor_id) for sensor in sensors}
+        for key, slot in self.slots.items():
+            if key not in present:
+                self.__write_slot(slot, math.nan, math.nan, 0)
+        self.update(sensors)
+
+    def close(self):
+        self.buf.close()
+
+
+class SharedStateReader():
+    '''read-only mapping of the data file written by a Laporte server'''
+    def __init__(self, path):
+        '''
+        Map the data file and load its index.
+
+            path (str):
+                Path of the data file (--shm-path of the server).
+        '''
+
+        self.path = path
+        self.buf = None
+        self.slots = {}
+        self.generation = None
+        self.__open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __open(self):
+        if self.buf is not None:
+            self.buf.close()
+        with open(self.path, 'rb') as stream:
+            self.buf = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slot_size, _, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or slot_size != SLOT.size:
+            raise ValueError('{} is not a Laporte shared state file'.format(self.path))
+        self.generation = None
+
+    def refresh(self):
+        '''reopen a replaced data file and reload a changed index'''
+
+        generation = HEADER.unpack_from(self.buf, 0)[3]
+        if generation == STALE:
+            self.__open()
+            generation = HEADER.unpack_from(self.buf, 0)[3]
+        if generation != self.generation:
+            with open(get_index_path(self.path), 'r') as stream:
+                index = json.load(stream)
+            capacity = HEADER.unpack_from(self.buf, 0)[2]
+            self.slots = {(node_id, sensor_id): slot
+                          for slot, (node_id, sensor_id) in enumerate(index['slots'])
+                          if slot < capacity}
+            if len(self.slots) == len(index['slots']):
+                self.generation = index['generation']
+            # else the data file is being replaced, reopen on the next refresh
+
+    def __read_slot(self, slot):
+        offset = HEADER_SIZE + slot * SLOT.size
+        for _ in range(MAX_RETRIES):
+            seq = SEQ.unpack_from(self.buf, offset)[0]
+            if seq & 1:
+                continue  # being written
+            value, hit_timestamp, hits_total = FIELDS.unpack_from(
+                self.buf, offset + SEQ.size)
+            if SEQ.unpack_from(self.buf, offset)[0] == seq:
+                break
+        else:
+            raise RuntimeError('slot {} of {} is locked'.format(slot, self.path))
+
+        return SensorState(None if math.isnan(value) else value,
+                           None if math.isnan(hit_timestamp) else hit_timestamp,
+                           hits_total or None)
+
+    def get(self, node_id, sensor_id):
+        '''return SensorState of a sensor or None if it is not exported'''
+
+        self.refresh()
+        slot = self.slots.get((node_id, sensor_id))
+        if slot is None:
+            return None
+        return self.__read_slot(slot)
+
+    def get_all(self):
+        '''return {node_id:{sensor_id:SensorState}} of all exported sensors'''
+
+        self.refresh()
+        ret = {}
+        for (node_id, sensor_id), slot in self.slots.items():
+            if node_id not in ret:
+                ret[node_id] = {}
+            ret[node_id][sensor_id] = self.__read_slot(slot)
+        return ret
+
+    def close(self):
+        self.buf.close()
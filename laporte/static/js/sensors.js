@@ -1,14 +1,91 @@
 var countdowns = {};
+var node_bodies = {};
+var next_cursor = 0;
+var loading = false;
+var page_metrics = ["value", "hits_total", "hit_timestamp", "duration_seconds", "exp_timestamp"];
+
+function get_sensor_label(node_id, sensor_id) {
+    return (node_id + "_" + sensor_id).replace(/\./g, "-");
+}
+
+function add_sensor_row(gw, node_id, sensor_id) {
+    var tbody = node_bodies[node_id];
+    var sensor_label = get_sensor_label(node_id, sensor_id);
+
+    if (tbody === undefined) {
+        var head = $("<thead>").append($("<tr class='bg-light'>")
+            .append($("<th style='width: 40%' scope='col'>").text(node_id + " ")
+                .append($("<small>").text("[" + gw + "]")))
+            .append("<th style='width: 20%' scope='col'>value</th>")
+            .append("<th style='width: 20%' scope='col'>hits</th>")
+            .append("<th style='width: 20%' scope='col'>duration</th>"));
+        tbody = $("<tbody>");
+        $("#sensors").append(head, tbody);
+        node_bodies[node_id] = tbody;
+    }
+
+    tbody.append($("<tr>")
+        .append($("<td scope='row'>").append($("<div>").text(sensor_id)))
+        .append($("<td>").append(
+            $("<span>").attr("id", sensor_label + "_value"), " ",
+            $("<small class='text-secondary font-weight-light'>").attr("id", sensor_label + "_ttl")))
+        .append($("<td>").append(
+            $("<span>").attr("id", sensor_label + "_hits_total"), " ",
+            $("<small class='text-secondary font-weight-light'>").attr("id", sensor_label + "_hit_timestamp")))
+        .append($("<td>").append($("<span>").attr("id", sensor_label + "_duration_seconds"))));
+}
+
+// load next page of sensors, sections of nodes are added when scrolled into view
+function load_page(observer) {
+    if (loading || next_cursor === null) {
+        return;
+    }
+    loading = true;
+    $("#more").html("loading...");
+
+    $.getJSON("/api/state/dump", { limit: page_limit, cursor: next_cursor }, function (page) {
+        var metrics = {};
+        var gw, node_id, sensor_id;
+
+        for (gw in page.items) {
+            for (node_id in page.items[gw]) {
+                metrics[node_id] = {};
+                for (sensor_id in page.items[gw][node_id]) {
+                    var data = page.items[gw][node_id][sensor_id];
+                    add_sensor_row(gw, node_id, sensor_id);
+                    metrics[node_id][sensor_id] = {};
+                    page_metrics.forEach(function (metric) {
+                        if (metric in data) {
+                            metrics[node_id][sensor_id][metric] = data[metric];
+                        }
+                    });
+                }
+            }
+        }
+        update_metrics(metrics);
+
+        next_cursor = page.next_cursor;
+        loading = false;
+        $("#more").html(next_cursor === null ? "" : "...");
+
+        // trigger the observer again if the end of the table is still visible
+        observer.unobserve(document.getElementById("more"));
+        observer.observe(document.getElementById("more"));
+    });
+}
 
 function fill_metrics(msg) {
-    var obj = JSON.parse(msg);
+    update_metrics(JSON.parse(msg));
+}
+
+function update_metrics(obj) {
     var tnow = new Date();
     var tnowzero = tnow - (60 * 60 * 1000 * tnow.getHours()) - (60 * 1000 * tnow.getMinutes()) - (1000 * tnow.getSeconds());
     var node_id, sensor_id, metric;
 
     for (node_id in obj) {
         for (sensor_id in obj[node_id]) {
-            var sensor_label = (node_id + "_" + sensor_id).replace(/\./g, "-");
+            var sensor_label = get_sensor_label(node_id, sensor_id);
 
             for (metric in obj[node_id][sensor_id]) {
                 var metric_label = sensor_label + "_" + metric;
@@ -72,6 +149,13 @@ function fill_metrics(msg) {
 }
 
 $(document).ready(function () {
+    var observer = new IntersectionObserver(function (entries) {
+        if (entries[0].isIntersecting) {
+            load_page(observer);
+        }
+    });
+    observer.observe(document.getElementById("more"));
+
     var namespace = '/events';
     // Connect to the Socket.IO server.
     // The connection URL has the following format:
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''lightweight one-shot timers served by a single background task'''
+
+import logging
+from heapq import heappush, heappop
+from threading import Event
+from time import monotonic
+
+# create logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Timers():
+    '''
+    One-shot timers kept in a heap of deadlines and fired by one background
+    task - cheaper than a scheduler job per timer for short-lived timers
+    started at a high rate (e.g. debounce windows).
+    '''
+    def __init__(self, sio):
+        '''
+        Create an empty heap and start the background task.
+
+            sio (flask_socketio.SocketIO):
+                Socket.IO server used to start the background task.
+        '''
+
+        self.heap = []
+        self.seq = 0
+        self.wakeup = Event()
+        self.task = sio.start_background_task(self.loop)
+
+    def call_later(self, delay, func, *args):
+        '''call func(*args) after delay seconds'''
+
+        self.seq += 1
+        deadline = monotonic() + delay
+        earliest = not self.heap or deadline < self.heap[0][0]
+        heappush(self.heap, (deadline, self.seq, func, args))
+        if earliest:
+            self.wakeup.set()
+
+    def loop(self):
+        '''background task calling due timers'''
+
+        while True:
+            timeout = None
+            if self.heap:
+                timeout = self.heap[0][0] - monotonic()
+
+            if timeout is None or timeout > 0:
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+                continue
+
+            _, _, func, args = heappop(self.heap)
+            try:
+                func(*args)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("timer %s failed", func.__name__)
@@ -1,23 +1,28 @@
 # -*- coding: utf-8 -*-
 '''Laporte app version and resources info'''
 
+from functools import lru_cache
 from platform import python_version
-import pkg_resources
 
 __version__ = '0.6.1'
 
+# distributions reported in build info
+DISTRIBUTIONS = ('flask', 'flask-restx', 'flask-socketio', 'python-socketio',
+                 'python-engineio', 'gevent', 'prometheus_client')
 
+
+@lru_cache(maxsize=None)
 def get_build_info():
-    '''get app version and resources info'''
-    ret = {
-        'laporte': __version__,
-        'python': python_version(),
-        'flask': pkg_resources.get_distribution('flask').version,
-        'flask-restx': pkg_resources.get_distribution('flask-restx').version,
-        'flask-socketio': pkg_resources.get_distribution('flask-socketio').version,
-        'python-socketio': pkg_resources.get_distribution('python-socketio').version,
-        'python-engineio': pkg_resources.get_distribution('python-engineio').version,
-        'gevent': pkg_resources.get_distribution('gevent').version,
-        'prometheus_client': pkg_resources.get_distribution('prometheus_client').version,
-    }
+    '''get app version and resources info (resolved upon the first call)'''
+
+    # imported here - importlib.metadata is slow to import and rarely needed
+    # pylint: disable=import-outside-toplevel
+    from importlib.metadata import version, PackageNotFoundError
+
+    ret = {'laporte': __version__, 'python': python_version()}
+    for dist in DISTRIBUTIONS:
+        try:
+            ret[dist] = version(dist)
+        except PackageNotFoundError:
+            ret[dist] = None
     return ret
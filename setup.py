@@ -27,13 +27,17 @@ setuptools.setup(
     url="https://github.com/vinklat/laporte",
     include_package_data=True,
     zip_safe=False,
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     install_requires=required,
+    extras_require={'asyncio': ['python-socketio[asyncio_client]']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
     entry_points={
-        'console_scripts': ['laporte=laporte.server:run_server'],
+        'console_scripts': [
+            'laporte=laporte.server:run_server', 'laporte-bench=laporte.bench:run_bench',
+            'laporte-bus=laporte.fanout:run_broker'
+        ],
     })
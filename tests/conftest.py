@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+'''fixtures shared by the tests'''
+
+import pytest
+from laporte.sensors import Sensors
+from benchmarks.common import StubScheduler, StubSocketIO
+
+
+class StubTimers():
+    '''timers that only remember calls, run by the test'''
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay, func, *args):
+        del delay  # Ignored parameter
+        self.calls.append((func, args))
+
+    def run_pending(self):
+        calls, self.calls = self.calls, []
+        for func, args in calls:
+            func(*args)
+
+
+@pytest.fixture
+def make_sensors():
+    '''return a function creating Sensors of a config, Socket.IO and timers are stubs'''
+    def factory(config):
+        sensors = Sensors()
+        sensors.sio = StubSocketIO()
+        sensors.scheduler = StubScheduler()
+        sensors.timers = StubTimers()
+        sensors.add_sensors(config)
+        return sensors
+
+    return factory
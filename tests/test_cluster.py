@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''replication, versions and leadership of cluster nodes'''
+
+from time import sleep
+from types import SimpleNamespace
+import pytest
+from laporte.cluster import Cluster, get_rank
+from laporte.sensors import METRICS_NAMESPACE
+
+DEBOUNCE_TIME = 0.05
+
+CONFIG = {
+    'gw': {
+        'node': {
+            'sensors': {
+                'temp': {
+                    'type': 'gauge'
+                },
+                'debounced': {
+                    'type': 'gauge',
+                    'debounce': {
+                        'time': DEBOUNCE_TIME,
+                        'edge': 'trailing'
+                    }
+                },
+                'doubled': {
+                    'type': 'gauge',
+                    'eval': {
+                        'code': 'value*2'
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+@pytest.fixture
+def get_cluster(make_sensors):
+    '''return a function creating a cluster node with gateways joined to it'''
+    def factory(node_id, peers=(), gateways=(), log_size=100):
+        sensors = make_sensors(CONFIG)
+        rooms = {None: {'sid': 'eio'}, 'sid': {'sid': True}}
+        rooms.update({gw: {'sid': True} for gw in gateways})
+        sensors.sio.server = SimpleNamespace(manager=SimpleNamespace(
+            rooms={METRICS_NAMESPACE: rooms}))
+        sensors.cluster = Cluster(sensors.sio,
+                                  sensors,
+                                  node_id,
+                                  list(peers),
+                                  log_size=log_size)
+        return sensors.cluster
+
+    return factory
+
+
+def get_entry(timestamp, origin, value, sensor_id='temp'):
+    return {
+        'origin': origin,
+        'seq': 1,
+        'timestamp': timestamp,
+        'values': [['node', sensor_id, value]]
+    }
+
+
+def get_value(cluster, sensor_id):
+    return cluster.sensors.node_id_index['node'][sensor_id].value
+
+
+def test_apply_keeps_newest_version(get_cluster):
+    cluster = get_cluster('n1')
+    cluster.apply(get_entry(10, 'n2', 1))
+    cluster.apply(get_entry(5, 'n3', 2))
+    assert get_value(cluster, 'temp') == 1
+    assert cluster.stale_total == 1
+
+    # same timestamp, the origin decides
+    cluster.apply(get_entry(10, 'n3', 3))
+    cluster.apply(get_entry(10, 'n2', 4))
+    assert get_value(cluster, 'temp') == 3
+    assert cluster.stale_total == 2
+    assert cluster.applied_total == 2
+
+
+def test_values_are_published_once_applied(get_cluster):
+    cluster = get_cluster('n1')
+    peer = get_cluster('n2')
+    sensors = cluster.sensors
+
+    sensors.set_node_values('node', {'temp': 20, 'debounced': 5, 'doubled': 1})
+    assert cluster.log[-1]['values'] == [['node', 'temp', 20], ['node', 'doubled', 1]]
+
+    # the value swallowed by debounce is published at the trailing edge
+    sleep(DEBOUNCE_TIME * 1.5)
+    sensors.timers.run_pending()
+    assert cluster.log[-1]['values'] == [['node', 'debounced', 5]]
+
+    for entry in cluster.log:
+        peer.apply(entry)
+    assert get_value(peer, 'temp') == 20
+    assert get_value(peer, 'debounced') == 5
+    assert get_value(peer, 'doubled') == 2  # evaluated once
+    assert not peer.log  # replicated values are not published again
+
+
+def test_get_sync_returns_log_or_snapshot(get_cluster):
+    cluster = get_cluster('n1', log_size=2)
+    for value in (1, 2, 3):
+        cluster.sensors.set_node_values('node', {'temp': value})
+
+    def get_seqs(epoch, seq):
+        return [entry.get('seq') for entry in cluster.get_sync(epoch, seq)['entries']]
+
+    assert get_seqs(cluster.epoch, 3) == []
+    assert get_seqs(cluster.epoch, 2) == [3]
+    assert get_seqs(cluster.epoch, 1) == [2, 3]
+
+    # entries missing in the log or a log before restart
+    timestamp, origin, _ = cluster.versions[('node', 'temp')]
+    snapshot = [['node', 'temp', 3, timestamp, origin]]
+    for epoch, seq in ((cluster.epoch, 0), (cluster.epoch - 1, 3)):
+        entries = cluster.get_sync(epoch, seq)['entries']
+        assert [entry['snapshot'] for entry in entries] == [snapshot]
+
+
+def test_leader_has_the_highest_rank(get_cluster):
+    cluster = get_cluster('n1', peers=['http://n2', 'http://n3'], gateways=['gw'])
+    for peer, node_id in zip(cluster.peers, ('n2', 'n3')):
+        peer.node_id = node_id
+        peer.gateways = {'gw'}
+        peer.client.connected = True
+
+    ranked = max(('n1', 'n2', 'n3'), key=lambda node_id: get_rank('gw', node_id))
+    assert cluster.is_leader('gw') == (ranked == 'n1')
+
+    # peers disconnected or without the gateway
+    for peer in cluster.peers:
+        peer.client.connected = False
+    assert cluster.is_leader('gw')
+
+    # nobody has joined the gateway
+    assert cluster.is_leader('other')
+    cluster.peers[0].client.connected = True
+    cluster.peers[0].gateways = {'other'}
+    assert not cluster.is_leader('other')
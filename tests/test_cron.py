@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''cron jobs shared by sensors with the same schedule'''
+
+CONFIG = {
+    'gw': {
+        'node': {
+            'sensors': {
+                'temp': {
+                    'type': 'gauge',
+                    'cron': {
+                        '0 * * * *': 20
+                    }
+                },
+                'invalid': {
+                    'type': 'gauge',
+                    'cron': {
+                        '0 * * * *': 'warm'
+                    }
+                },
+                'button': {
+                    'type': 'message',
+                    'cron': {
+                        '0 * * * *': 'pressed'
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def test_invalid_member_does_not_skip_the_group(make_sensors):
+    sensors = make_sensors(CONFIG)
+    assert len(sensors.cron_groups) == 1
+
+    for job in sensors.scheduler.jobs.values():
+        job.run()
+
+    node = sensors.node_id_index['node']
+    assert node['temp'].value == 20
+    assert node['button'].value == 'pressed'
+    assert node['invalid'].value is None
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''debounce windows of sensors with eval code'''
+
+from time import sleep
+import pytest
+
+DEBOUNCE_TIME = 0.05
+
+
+def get_config(edge):
+    return {
+        'gw': {
+            'node': {
+                'sensors': {
+                    'x': {
+                        'type': 'gauge',
+                        'debounce': {
+                            'time': DEBOUNCE_TIME,
+                            'edge': edge
+                        },
+                        'eval': {
+                            'code': 'value*2'
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def flush(sensors):
+    sleep(DEBOUNCE_TIME * 1.5)
+    sensors.timers.run_pending()
+
+
+@pytest.mark.parametrize('edge', ['trailing', 'both'])
+def test_eval_settles_after_flush(make_sensors, edge):
+    sensors = make_sensors(get_config(edge))
+    sensor = sensors.node_id_index['node']['x']
+
+    sensors.set_node_values('node', {'x': 1})
+    for _ in range(3):
+        flush(sensors)
+
+    assert sensor.value == 2
+    assert sensor.hits_total == 1
+    assert not sensors.timers.calls
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''compiled eval expressions give the same results as asteval'''
+
+import glob
+import itertools
+import math
+import os
+import pytest
+from yaml import safe_load
+from asteval import Interpreter, make_symbol_table
+from laporte.expression import compile_expression
+from laporte.sensor import EVAL_METRICS
+
+# numpy warns about log(0) like asteval does
+pytestmark = pytest.mark.filterwarnings('ignore::RuntimeWarning')
+
+CONF_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'conf')
+
+# values of symbols, each code is evaluated with all pairs of them
+VALUES = (None, 0, 1, -1, 2.5, -3.7, 0.0, True, False, 'on', '')
+
+# expressions not used in the example configs
+EXTRA_CODES = (
+    'a / b', 'a % b', 'a // b', 'a ** b', 'not a', '-a if a > b else b', 'a < b < 3',
+    'abs(a) + max(a, b)', 'round(a, 2)', 'sqrt(a)', 'log(a)', 'a and b', 'a or b',
+    'str(a) * 3', 'a in (1, 2)', 'value * 1.01 + 0.5', 'int(a) + float(b)', 'len(str(a))'
+)
+
+
+class Devnull():
+    def write(self, *_):
+        pass
+
+
+def get_eval_configs(config):
+    '''yield eval sections (dicts with code) of a config'''
+
+    if isinstance(config, dict):
+        if isinstance(config.get('code'), str):
+            yield config
+        for value in config.values():
+            yield from get_eval_configs(value)
+    elif isinstance(config, list):
+        for value in config:
+            yield from get_eval_configs(value)
+
+
+def get_cases():
+    '''yield (code, names of required vars)'''
+
+    for path in sorted(glob.glob(os.path.join(CONF_DIR, '*.yml'))):
+        with open(path, 'r') as stream:
+            config = safe_load(stream)
+        for eval_config in get_eval_configs(config):
+            yield pytest.param(eval_config['code'],
+                               sorted(eval_config.get('require') or {}),
+                               id='{}:{}'.format(os.path.basename(path),
+                                                 eval_config['code'].strip()[:30]))
+    for code in EXTRA_CODES:
+        yield pytest.param(code, ['a', 'b'], id=code)
+
+
+def same(result1, result2):
+    if isinstance(result1, float) and isinstance(result2, float) and math.isnan(
+            result1) and math.isnan(result2):
+        return True
+    return result1 == result2 and type(result1) is type(result2)
+
+
+@pytest.mark.parametrize('code,required', list(get_cases()))
+def test_expression_equals_asteval(code, required):
+    names = EVAL_METRICS | {'origin'} | set(required)
+    expression = compile_expression(code, names)
+    if expression is None:
+        pytest.skip('evaluated by asteval')
+
+    variables = ['value', 'prev_value'] + required
+    for first, second in itertools.product(VALUES, repeat=2):
+        symbols = {name: first for name in variables}
+        symbols[variables[-1]] = second
+        symbols.update({'hits_total': 3, 'origin': [('node', 'sensor')]})
+
+        aeval = Interpreter(writer=Devnull(),
+                            err_writer=Devnull(),
+                            symtable=make_symbol_table(use_numpy=True, **symbols))
+        expected = aeval.eval(code)
+        result, error = expression.eval(symbols)
+
+        assert same(expected, result), symbols
+        assert bool(aeval.error) == (error is not None), symbols
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+'''RESP codec, the bus broker and forwarding of front end messages'''
+
+from io import BytesIO
+from threading import Thread
+from time import sleep
+import gevent
+from gevent import socket as gsocket
+import pytest
+from laporte.fanout import (Broker, LocalManager, encode_bulk, encode_command,
+                            read_reply)
+
+
+def test_command_round_trip():
+    payload = b'{"data": "\r\n\x00"}'
+    stream = BytesIO(encode_command('PUBLISH', 'laporte', payload) + encode_bulk('x'))
+
+    assert read_reply(stream) == [b'PUBLISH', b'laporte', payload]
+    assert read_reply(stream) == b'x'
+    assert read_reply(stream) is None  # EOF
+
+
+@pytest.mark.parametrize('data, reply', [
+    (b'+PONG\r\n', b'PONG'),
+    (b':2\r\n', 2),
+    (b'$-1\r\n', None),
+    (b'$0\r\n\r\n', b''),
+    (b'*3\r\n$7\r\nmessage\r\n$2\r\nch\r\n:1\r\n', [b'message', b'ch', 1]),
+])
+def test_replies(data, reply):
+    assert read_reply(BytesIO(data)) == reply
+
+
+@pytest.mark.parametrize('data', [b'-ERR unknown command\r\n', b'?\r\n'])
+def test_error_replies_raise(data):
+    with pytest.raises(ConnectionError):
+        read_reply(BytesIO(data))
+
+
+def connect(broker, name):
+    '''return a client socket and its reader connected to the broker'''
+
+    client, server = gsocket.socketpair()
+    gevent.spawn(broker.handle, server, name)
+    return client, client.makefile('rb')
+
+
+def test_broker_routes_messages():
+    broker = Broker()
+    sub, sub_reader = connect(broker, 'sub')
+    pub, pub_reader = connect(broker, 'pub')
+
+    sub.sendall(encode_command('SUBSCRIBE', 'ch', 'other'))
+    assert read_reply(sub_reader) == [b'subscribe', b'ch', 1]
+    assert read_reply(sub_reader) == [b'subscribe', b'other', 2]
+
+    pub.sendall(encode_command('PUBLISH', 'ch', 'hello'))
+    assert read_reply(pub_reader) == 1
+    assert read_reply(sub_reader) == [b'message', b'ch', b'hello']
+
+    pub.sendall(encode_command('PING') + encode_command('FLUSHALL'))
+    assert read_reply(pub_reader) == b'PONG'
+    with pytest.raises(ConnectionError):
+        read_reply(pub_reader)
+
+    sub.sendall(encode_command('UNSUBSCRIBE', 'ch'))
+    assert read_reply(sub_reader) == [b'unsubscribe', b'ch', 1]
+    pub.sendall(encode_command('PUBLISH', 'ch', 'lost'))
+    assert read_reply(pub_reader) == 0
+
+    # subscriptions of a closed connection are removed
+    sub.sendall(encode_command('QUIT'))
+    assert read_reply(sub_reader) == b'OK'
+    gevent.sleep(0.01)
+    pub.sendall(encode_command('PUBLISH', 'other', 'lost'))
+    assert read_reply(pub_reader) == 0
+
+
+def test_forwarded_messages_are_handled_by_the_state_process():
+    state = LocalManager(channel='forward')
+    front = LocalManager(channel='forward')
+    forwarded = []
+    state.forward_handler = lambda *args: forwarded.append(args)
+
+    # managers get the next message that is not a forwarded one
+    received = {}
+    threads = [
+        Thread(target=lambda m=manager: received.setdefault(m, next(m._listen())),
+               daemon=True) for manager in (state, front)
+    ]
+    for thread in threads:
+        thread.start()
+    while len(LocalManager.channels.get('forward', [])) < 2:
+        sleep(0.001)
+
+    front.forward('sensor_response', {'node': {'temp': 20}}, 'sid1')
+    front._publish({'method': 'emit', 'event': 'update_response'})
+    for thread in threads:
+        thread.join(1)
+
+    assert forwarded == [('sensor_response', {'node': {'temp': 20}}, 'sid1')]
+    assert received[state]['event'] == received[front]['event'] == 'update_response'
+    assert state.received_total == front.received_total == 2
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+'''sensor histories and their windowed aggregates'''
+
+from time import time
+import pytest
+from laporte.history import History
+
+CONFIG = {
+    'gw': {
+        'node': {
+            'sensors': {
+                'temp': {
+                    'type': 'gauge',
+                    'history': {
+                        'size': 10
+                    }
+                },
+                'temp_avg': {
+                    'type': 'gauge',
+                    'eval': {
+                        'require': {
+                            't': ['temp', 'history']
+                        },
+                        'code': 't.avg(600)'
+                    }
+                },
+                'temp_max': {
+                    'type': 'gauge',
+                    'history': {
+                        'size': 10
+                    },
+                    'eval': {
+                        'require': {
+                            't': ['temp', 'value']
+                        },
+                        'code': 'max(t, history.max(600) or t)'
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def set_temps(sensors, values):
+    for value in values:
+        sensors.set_sensors_values(sensors.coerce_values({'node': {'temp': value}}))
+
+
+def test_window_selects_recent_samples():
+    history = History(10)
+    now = time()
+    for age, value in ((100, 1), (50, 2), (10, 4), (5, 8)):
+        history.append(now - age, value)
+
+    assert history.count() == 4
+    assert history.count(60) == 3
+    assert history.sum(60) == 14
+    assert history.avg(20) == 6
+    assert history.min(60) == 2
+    assert history.max() == 8
+    assert history.delta(60) == 6
+    assert history.rate(60) == pytest.approx(6 / 45)
+    assert history.percentile(50, 20) == 6
+    assert history.avg(1) is None
+    assert history.rate(6) is None
+
+
+def test_ring_buffer_keeps_last_samples():
+    history = History(3)
+    now = time()
+    for value in range(5):
+        history.append(now - 5 + value, value)
+    history.replace_last(10)
+
+    assert history.count() == 3
+    assert history.min() == 2
+    assert history.max() == 10
+    assert history.delta() == 8
+
+
+def test_evals_use_aggregates(make_sensors):
+    sensors = make_sensors(CONFIG)
+    set_temps(sensors, (20, 24, 22))
+    node = sensors.node_id_index['node']
+
+    assert node['temp_avg'].value == 22
+    assert node['temp_max'].value == 24
+
+
+@pytest.mark.parametrize('method', ['default_values', 'reset_values'])
+def test_reset_clears_history(make_sensors, method):
+    sensors = make_sensors(CONFIG)
+    set_temps(sensors, (1, 2, 3))
+    assert sensors.get_history_info()['samples'] == 6
+
+    getattr(sensors, method)()
+
+    assert sensors.get_history_info()['samples'] == 0
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''admission and coalescing of the ingest queue'''
+
+import pytest
+from laporte.ingest import IngestQueue, Overloaded, HIGH, LOW
+
+
+CONFIG = {
+    'gw': {
+        'node': {
+            'sensors': {
+                'button': {
+                    'type': 'message'
+                },
+                'temp': {
+                    'type': 'gauge'
+                }
+            },
+            'actuators': {
+                'relay': {
+                    'type': 'binary'
+                }
+            }
+        }
+    }
+}
+
+
+@pytest.fixture
+def get_queue(make_sensors):
+    '''return a function creating sensors and their queue, applied by the test'''
+    def factory(max_size):
+        sensors = make_sensors(CONFIG)
+        return sensors, IngestQueue(sensors.sio, sensors, max_size=max_size)
+
+    return factory
+
+
+def test_values_of_a_sensor_are_not_coalesced(get_queue):
+    sensors, queue = get_queue(10)
+    queue.put(sensors.coerce_values({'node': {'button': 'pressed'}}))
+    queue.put(sensors.coerce_values({'node': {'button': 'released'}}))
+
+    assert [list(batch.values.values()) for batch in queue.queues[LOW]] == [['pressed'],
+                                                                          ['released']]
+    assert queue.coalesced_total[LOW] == 0
+
+
+def test_requests_share_a_batch(get_queue):
+    sensors, queue = get_queue(10)
+    queue.put(sensors.coerce_values({'node': {'button': 'pressed'}}))
+    queue.put(sensors.coerce_values({'node': {'temp': 20}}))
+
+    assert len(queue.queues[LOW]) == 1
+    assert queue.get_depth(LOW) == 2
+
+
+def test_full_queue_coalesces_or_rejects(get_queue):
+    sensors, queue = get_queue(1)
+    queue.put(sensors.coerce_values({'node': {'temp': 20}}))
+    queue.put(sensors.coerce_values({'node': {'temp': 21}}))
+
+    assert [list(batch.values.values()) for batch in queue.queues[LOW]] == [[21]]
+    assert queue.coalesced_total[LOW] == 1
+
+    with pytest.raises(Overloaded):
+        queue.put(sensors.coerce_values({'node': {'button': 'pressed'}}))
+    assert queue.dropped_total[LOW] == 1
+
+
+def test_request_stays_in_one_batch(get_queue):
+    sensors, queue = get_queue(10)
+    queue.put(sensors.coerce_values({'node': {'temp': 20, 'relay': 'on'}}))
+
+    assert not queue.queues[LOW]
+    assert len(queue.queues[HIGH]) == 1
+    assert queue.get_depth(HIGH) == 2
+
+
+def test_values_of_a_sensor_are_applied_in_order(get_queue):
+    sensors, queue = get_queue(10)
+    queue.put(sensors.coerce_values({'node': {'temp': 20, 'button': 'pressed'}}))
+    queue.put(sensors.coerce_values({'node': {'button': 'released'}}))
+    queue.put(sensors.coerce_values({'node': {'temp': 21, 'relay': 'on'}}))
+    queue.put(sensors.coerce_values({'node': {'temp': 22}}))
+
+    applied = []
+    set_sensors_values = sensors.set_sensors_values
+
+    def record(sensor_values, increment=False):
+        applied.extend((sensor.sensor_id, value) for sensor, value in sensor_values)
+        return set_sensors_values(sensor_values, increment=increment)
+
+    sensors.set_sensors_values = record
+    queue.apply_pending()
+
+    node = sensors.node_id_index['node']
+    assert node['temp'].value == 22
+    assert node['relay'].value is True
+    assert [value for sensor_id, value in applied
+            if sensor_id == 'temp'] == [20, 21, 22]
+    assert [value for sensor_id, value in applied
+            if sensor_id == 'button'] == ['pressed', 'released']
+    assert queue.get_depth(HIGH) == queue.get_depth(LOW) == 0
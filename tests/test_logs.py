@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+'''sampling, rate limit and formatting of log records'''
+
+import json
+import logging
+import sys
+from queue import SimpleQueue
+import pytest
+from laporte import logs
+from laporte.logs import JsonFormatter, RecordQueueHandler, ThrottleFilter
+
+
+def get_record(level=logging.INFO, lineno=1, msg='value %s', args=(1, ),
+               exc_info=None):
+    return logging.LogRecord('laporte.test', level, 'test.py', lineno, msg, args,
+                             exc_info)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''return a list with the current monotonic time, changed by the test'''
+    now = [100.0]
+    monkeypatch.setattr(logs, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_sampling_of_a_call_site():
+    throttle = ThrottleFilter(sample=3)
+    passed = [throttle.filter(get_record()) for _ in range(7)]
+    assert passed == [True, False, False, True, False, False, True]
+
+    # call sites are sampled separately, warnings are not sampled
+    assert throttle.filter(get_record(lineno=2))
+    assert all(throttle.filter(get_record(logging.WARNING)) for _ in range(3))
+
+
+def test_rate_limit_counts_suppressed_records(clock):
+    throttle = ThrottleFilter(rate=2)
+    passed = [throttle.filter(get_record()) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+
+    clock[0] += 0.5  # one token
+    record = get_record()
+    assert throttle.filter(record)
+    assert record.suppressed == 3
+
+    record = get_record()
+    assert not throttle.filter(record)
+    clock[0] += 0.5
+    record = get_record()
+    assert throttle.filter(record)
+    assert record.suppressed == 1
+
+
+def test_json_record_has_the_exception():
+    queue = SimpleQueue()
+    handler = RecordQueueHandler(queue)
+    try:
+        raise ValueError('invalid')
+    except ValueError:
+        record = get_record(logging.ERROR, msg='failed %s', args=('x', ),
+                            exc_info=sys.exc_info())
+    handler.handle(record)
+
+    data = json.loads(JsonFormatter().format(queue.get()))
+    assert data['message'] == 'failed x'
+    assert data['exception'].startswith('Traceback')
+    assert 'ValueError: invalid' in data['exception']
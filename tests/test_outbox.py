@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''coalescing and dropping of queued actuator values'''
+
+from laporte.outbox import GatewayOutbox
+from benchmarks.common import StubSocketIO
+
+
+def get_values(outbox):
+    return {(response, node, key): value
+            for response, nodes in outbox.pending.items()
+            for node, values in nodes.items() for key, value in values.items()}
+
+
+def test_full_outbox_drops_the_oldest_value():
+    outbox = GatewayOutbox(StubSocketIO(), 'gw', max_size=3)
+    outbox.put('a', {'node': {'x': 1, 'y': 1}})
+    outbox.put('b', {'node': {'x': 1}})
+    outbox.put('a', {'node': {'x': 2}})  # a.x is the newest now
+    outbox.put('b', {'node': {'y': 1}})
+    outbox.put('b', {'other': {'z': 1}})
+
+    assert get_values(outbox) == {('a', 'node', 'x'): 2, ('b', 'node', 'y'): 1,
+                                  ('b', 'other', 'z'): 1}
+    assert outbox.size == 3
+    assert outbox.dropped_total == 2
+
+
+def test_failed_values_are_older_than_queued_ones():
+    outbox = GatewayOutbox(StubSocketIO(), 'gw', max_size=3)
+    outbox.put('a', {'node': {'x': 1, 'y': 1, 'z': 1}})
+    pending, order = outbox.pending, outbox.order
+    outbox.pending, outbox.order, outbox.size = {}, {}, 0
+
+    # queued during the failed delivery
+    outbox.put('a', {'node': {'x': 2}})
+    outbox.put('b', {'node': {'x': 2}})
+    outbox._GatewayOutbox__requeue(pending, order)
+
+    assert get_values(outbox) == {('a', 'node', 'x'): 2, ('b', 'node', 'x'): 2,
+                                  ('a', 'node', 'z'): 1}
+    assert list(outbox.order) == [('a', 'node', 'z'), ('a', 'node', 'x'),
+                                  ('b', 'node', 'x')]
+    assert outbox.dropped_total == 1
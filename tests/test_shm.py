@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+'''shared state file written by the server and read by co-located readers'''
+
+from types import SimpleNamespace
+import pytest
+from laporte.shm import MIN_CAPACITY, SensorState, SharedState, SharedStateReader
+
+
+def get_sensor(sensor_id, value, node_id='node', hit_timestamp=10.0, hits_total=1):
+    return SimpleNamespace(node_id=node_id,
+                           sensor_id=sensor_id,
+                           value=value,
+                           hit_timestamp=hit_timestamp,
+                           hits_total=hits_total)
+
+
+@pytest.fixture
+def state(tmp_path):
+    '''return a writer of a temporary file and a function opening its readers'''
+    path = str(tmp_path / 'laporte')
+    writer = SharedState(path)
+    readers = []
+
+    def get_reader():
+        readers.append(SharedStateReader(path))
+        return readers[-1]
+
+    yield writer, get_reader
+    for reader in readers:
+        reader.close()
+    writer.close()
+
+
+def test_round_trip(state):
+    writer, get_reader = state
+    writer.set_sensors([
+        get_sensor('temp', 20.5),
+        get_sensor('relay', True),
+        get_sensor('button', 'pressed'),
+        get_sensor('idle', None, hit_timestamp=None, hits_total=None)
+    ])
+    reader = get_reader()
+
+    assert reader.get('node', 'temp') == SensorState(20.5, 10.0, 1)
+    assert reader.get('node', 'relay').value == 1.0
+    assert reader.get('node', 'button') == SensorState(None, 10.0, 1)
+    assert reader.get('node', 'idle') == SensorState(None, None, None)
+    assert reader.get('node', 'unknown') is None
+
+    writer.update([get_sensor('temp', 21, hit_timestamp=11.0, hits_total=2)])
+    assert reader.get_all()['node']['temp'] == SensorState(21.0, 11.0, 2)
+
+
+def test_reader_reopens_a_grown_file(state):
+    writer, get_reader = state
+    writer.update([get_sensor('temp', 20)])
+    reader = get_reader()
+    assert reader.get('node', 'temp').value == 20
+
+    # the data file is replaced by a bigger one, the old one is marked STALE
+    writer.update([get_sensor(str(i), i, node_id='many') for i in range(MIN_CAPACITY)])
+    assert writer.capacity == 2 * MIN_CAPACITY
+    writer.update([get_sensor('temp', 21)])
+
+    assert reader.get('node', 'temp').value == 21
+    assert reader.get('many', str(MIN_CAPACITY - 1)).value == MIN_CAPACITY - 1
+    assert len(reader.get_all()['many']) == MIN_CAPACITY
+
+
+def test_reader_reloads_a_changed_index(state):
+    writer, get_reader = state
+    writer.set_sensors([get_sensor('temp', 20), get_sensor('hum', 50)])
+    reader = get_reader()
+    assert reader.get('other', 'temp') is None
+    generation = reader.generation
+
+    writer.update([get_sensor('temp', 5, node_id='other')])
+    assert reader.get('other', 'temp').value == 5
+    assert reader.generation == generation + 1
+
+    # slots of removed sensors are cleared and kept
+    writer.set_sensors([get_sensor('temp', 20), get_sensor('temp', 5, node_id='other')])
+    assert reader.get('node', 'hum') == SensorState(None, None, None)
+    assert reader.generation == generation + 1
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+'''nodes spawned from templates'''
+
+import pytest
+
+CONFIG = {
+    'gw': {
+        1: {
+            'sensors': {
+                'temp': {
+                    'type': 'gauge'
+                },
+                'hum': {
+                    'type': 'gauge'
+                }
+            }
+        },
+        'node': {
+            'sensors': {
+                'level': {
+                    'type': 'gauge'
+                }
+            }
+        }
+    }
+}
+
+
+def test_node_is_spawned_from_a_template(make_sensors):
+    sensors = make_sensors(CONFIG)
+    sensors.set_sensors_values(sensors.coerce_values({'new': {'temp': '20', 'hum': 50}}))
+
+    assert {key: sensor.value for key, sensor in sensors.node_id_index['new'].items()} == {
+        'temp': 20,
+        'hum': 50
+    }
+
+
+@pytest.mark.parametrize('nodes_dict, exception', [
+    ({'new': {'temp': 'warm'}}, ValueError),
+    ({'new': {'temp': 20}, 'node': {'level': 'high'}}, ValueError),
+    ({'new': {'temp': 20, 'unknown': 1}}, KeyError),
+])
+def test_invalid_batch_spawns_no_node(make_sensors, nodes_dict, exception):
+    sensors = make_sensors(CONFIG)
+    count = len(sensors.sensor_index)
+
+    with pytest.raises(exception):
+        sensors.coerce_values(nodes_dict)
+
+    assert 'new' not in sensors.node_id_index
+    assert len(sensors.sensor_index) == count